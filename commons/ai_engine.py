@@ -1,21 +1,26 @@
+import hashlib
+import json
 import os
 import pickle
-from threading import Thread
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 import numpy as np
-from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier
-from sklearn.metrics import classification_report, precision_score, balanced_accuracy_score
-from sklearn.model_selection import train_test_split
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.neural_network import MLPClassifier
-from sklearn.svm import SVC
-from sklearn.tree import DecisionTreeClassifier
-
-from commons.aws.dynamodb_helper import get_all_elements_from_table
+
 from commons.aws.s3_helper import get_file, put_file, put_json
+from commons.fingerprint_encoder import get_encoder
+from commons.inference_executor import get_executor
 from commons.logger import logged, logger
+from commons.metrics import metrics
+from commons.model_cache import ModelArtifacts, get_context
+from commons.result_cache import localize_cache
 from commons.settings import settings
 
+# The sklearn estimators and metrics, the dataset loading and the training engine
+# are imported by the methods that train, localize only loads the classes of the
+# models it unpickles. Importing sklearn.ensemble alone takes over a second of a cold start
+
 AI_BUCKET = os.environ['AI_BUCKET_NAME']
 FINGERPRINT_TABLE = os.environ['DYNAMODB_FINGERPRINTS']
 
@@ -23,16 +28,202 @@ MACS_5GHZ = settings['MACS_5GHZ'].split(',')
 MACS_2_4GHZ = settings['MACS_2_4GHZ'].split(',')
 FINGERPRINT_NULL_VALUE = int(settings['FINGERPRINT_NULL_VALUE'])
 
+# Cascade inference runs the models from the cheapest to the most expensive one and
+# settles a row once its top label leads the runner-up by more than CASCADE_MARGIN
+# times the weight the remaining models could still add (1 never changes the label)
+CASCADE_INFERENCE = settings.get('CASCADE_INFERENCE', 'false').lower() == 'true'
+CASCADE_MARGIN = float(settings.get('CASCADE_MARGIN', 1))
+
+# The missing value aware nearest neighbours index (see commons.fingerprint_index):
+# 'off', 'add' (one more ensemble model) or 'replace' (instead of 'Nearest Neighbors')
+FINGERPRINT_INDEX = settings.get('FINGERPRINT_INDEX', 'off')
+
+# 'dense' (int8 RSS matrices padded with FINGERPRINT_NULL_VALUE) or 'sparse' (CSR matrices
+# of the RSS offsets, see commons.sparse_fingerprints) from the dataset load to the inference.
+# The models keep the format they were trained with until the next training
+FEATURE_FORMAT = settings.get('FEATURE_FORMAT', 'dense')
+
+# How the ensemble weights its models: 'youden' (the Youden index of every model)
+# or 'stacking' (mixture weights learnt on the test set probabilities, see commons.evaluation_engine)
+ENSEMBLE_WEIGHTING = settings.get('ENSEMBLE_WEIGHTING', 'youden')
+
+# Localize runs the models compiled to NumPy arrays (see commons.compiled_models) when
+# the manifest has them, without scikit-learn. The models that couldn't be compiled
+# are still unpickled
+COMPILED_INFERENCE = settings.get('COMPILED_INFERENCE', 'true').lower() == 'true'
+# Localize never needs scikit-learn: the trainings export every compiled model within
+# tolerance even when it's slower than the sklearn one, and the compiled engines leave
+# out the models that couldn't be compiled
+COMPILED_ONLY = settings.get('COMPILED_ONLY', 'false').lower() == 'true'
+
+# Fraction of the localizations whose parameters and result are logged
+LOCALIZE_LOG_SAMPLE_RATE = float(settings.get('LOCALIZE_LOG_SAMPLE_RATE', 1))
+
+MANIFEST_VERSION = 1
+
+# Share of the fingerprints held out for the Youden indexes and for the train stats
+TEST_SIZE = 0.2
+VALIDATION_SIZE = 0.16
+
+
+def mix_keys(keys):
+    """
+    splitmix64 finalizer, consecutive keys end up scattered over the whole uint64 range
+    """
+    keys = keys ^ (keys >> np.uint64(30))
+    keys = keys * np.uint64(0xbf58476d1ce4e5b9)
+    keys = keys ^ (keys >> np.uint64(27))
+    keys = keys * np.uint64(0x94d049bb133111eb)
+    return keys ^ (keys >> np.uint64(31))
+
+
+def split_rows(timestamps):
+    """
+    Deterministic train/test/validation split derived from the fingerprint timestamps,
+    a fingerprint stays in the same set on every (incremental) training
+    """
+    # Timestamps have up to microsecond resolution
+    keys = np.rint(np.asarray(timestamps, dtype=float) * 1e6).astype(np.uint64)
+    position = mix_keys(keys) / 2.0 ** 64
+
+    test_rows = position < TEST_SIZE
+    val_rows = ~test_rows & (position < TEST_SIZE + VALIDATION_SIZE)
+    train_rows = ~test_rows & ~val_rows
+
+    return train_rows, test_rows, val_rows
+
+
+def to_feature_matrix(X, feature_format):
+    """
+    A dense or sparse RSS matrix in `feature_format`
+    """
+    from commons.dataset_snapshot import to_rss_matrix
+    from commons.sparse_fingerprints import to_dense, to_sparse
+
+    if feature_format == 'sparse':
+        return to_sparse(X, FINGERPRINT_NULL_VALUE)
+    # The dense training set is kept as int8, an eighth of the float64 matrix
+    return to_rss_matrix(to_dense(X, FINGERPRINT_NULL_VALUE), FINGERPRINT_NULL_VALUE)
+
+
+def build_models(hyperparameters=None):
+    """
+    The ensemble models, with the tuned `hyperparameters` ({model_name: params}) if any
+    """
+    from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.neural_network import MLPClassifier
+    from sklearn.svm import SVC
+    from sklearn.tree import DecisionTreeClassifier
+
+    from commons.fingerprint_index import FingerprintIndexClassifier
+
+    models = {
+        'Nearest Neighbors': KNeighborsClassifier(3),
+        'Decision Tree': DecisionTreeClassifier(max_depth=5),
+        'Lineal SVM': SVC(kernel="linear", C=0.025, probability=True),
+        'Random Forest': RandomForestClassifier(max_depth=5, n_estimators=10, max_features=1),
+        'Neural Net': MLPClassifier(alpha=1, max_iter=1000),
+        'AdaBoost': AdaBoostClassifier()
+    }
+
+    if FINGERPRINT_INDEX in ('add', 'replace'):
+        models['Fingerprint Index'] = FingerprintIndexClassifier(null_value=FINGERPRINT_NULL_VALUE)
+    if FINGERPRINT_INDEX == 'replace':
+        del models['Nearest Neighbors']
+
+    for model_name, params in (hyperparameters or {}).items():
+        if model_name in models:
+            models[model_name].set_params(**params)
+
+    return models
+
+
+def build_model(model_name, params):
+    return build_models({model_name: params})[model_name]
+
+
+def model_search_space():
+    """
+    Hyperparameter search space of the models currently in the ensemble
+    """
+    from commons.hyperparameter_search import get_search_space
+
+    model_names = build_models().keys()
+    return {
+        model_name: space for model_name, space in get_search_space().items() if model_name in model_names
+    }
+
+
+def band_s3_path(is_5ghz):
+    return f'ai/{"5ghz" if is_5ghz else "2_4ghz"}'
+
+
+def band_macs(is_5ghz):
+    return MACS_5GHZ + MACS_2_4GHZ if is_5ghz else MACS_2_4GHZ
+
+
+def put_artifact(s3_path, model_data, extension='pkl'):
+    """
+    Upload a serialized model under its content hash, returns its manifest entry
+    """
+    sha256 = hashlib.sha256(model_data).hexdigest()
+    key = f'{s3_path}/models/{sha256}.{extension}'
+
+    put_file(AI_BUCKET, key, model_data)
+
+    return {'key': key, 'sha256': sha256, 'size': len(model_data)}
+
+
+def put_model_artifact(s3_path, model):
+    return put_artifact(s3_path, pickle.dumps(model))
+
+
+def parse_manifest(manifest_data):
+    manifest = json.loads(manifest_data)
+    # JSON turns the numerical labels into strings
+    manifest['label_mapping']['to'] = {
+        int(index): label for index, label in manifest['label_mapping']['to'].items()
+    }
+    # A new training writes a new manifest, cached localizations of other versions are stale
+    manifest['model_version'] = hashlib.sha256(manifest_data).hexdigest()
+    return manifest
+
+
+def parse_legacy_context(context_data):
+    context = pickle.loads(context_data)
+    context['model_version'] = hashlib.sha256(context_data).hexdigest()
+    return context
+
+
 class AIEngine():
 
-    def __init__(self, is_5ghz=True):
+    def __init__(self, is_5ghz=True, use_cache=False, shard=None, compiled=False):
         # Try to restore context from S3
         self.is_5ghz = is_5ghz
         
-        self.ai_s3_path = f'ai/{"5ghz" if is_5ghz else "2_4ghz"}'
-
-        downloaded_data = get_file(AI_BUCKET, f'{self.ai_s3_path}/context.ai')
-        if not downloaded_data:
+        self.ai_s3_path = band_s3_path(is_5ghz)
+        if shard is not None:
+            # The models of a single site or floor (see commons.sharding)
+            self.ai_s3_path = f'{self.ai_s3_path}/shards/{quote(shard, safe="")}'
+        # Contexts saved before the manifest existed are still readable
+        legacy_context_key = f'{self.ai_s3_path}/context.ai'
+
+        if use_cache:
+            # Warm containers keep the parsed context between invocations
+            saved_data = (
+                get_context(AI_BUCKET, self.manifest_key, loads=parse_manifest)
+                or get_context(AI_BUCKET, legacy_context_key, loads=parse_legacy_context)
+            )
+        else:
+            downloaded_data = get_file(AI_BUCKET, self.manifest_key)
+            if downloaded_data:
+                saved_data = parse_manifest(downloaded_data)
+            else:
+                downloaded_data = get_file(AI_BUCKET, legacy_context_key)
+                saved_data = parse_legacy_context(downloaded_data) if downloaded_data else None
+
+        if not saved_data:
             self.algorithms = {
                 'Nearest Neighbors': None,
                 'Decision Tree': None,
@@ -49,56 +240,194 @@ class AIEngine():
                 'Random Forest': 1,
                 'Neural Net': 1,
                 'AdaBoost': 1
-            },
+            }
+            self.model_weights = dict(self.youden_indexes)
             self.label_mapping = {}
+            self.inference_costs = {}
+            self.cascade_order = list(self.algorithms.keys())
+            self.compiled_cascade_order = list(self.cascade_order)
+            self.hyperparameters = {}
+            self.feature_format = 'dense'
+            self.compiled_artifacts = {}
+            self.model_version = None
         else:
-            saved_data = pickle.loads(downloaded_data)
+            # Shallow copies, the cached context may be shared with other instances
             self.headers = saved_data['headers']
-            self.algorithms = saved_data['algorithms']
-            self.youden_indexes = saved_data['youden_indexes']
+            self.compiled_artifacts = saved_data.get('compiled_models', {})
+            if 'models' in saved_data:
+                # Models are downloaded only when they are used. Only inference
+                # engines take the compiled ones, training needs the sklearn models
+                artifacts = {**saved_data['models'], **self.compiled_artifacts} if compiled else saved_data['models']
+                if compiled and COMPILED_ONLY:
+                    if self.compiled_artifacts:
+                        artifacts = self.compiled_artifacts
+                    else:
+                        logger.warning('COMPILED_ONLY is set but the context has no compiled models')
+                self.algorithms = ModelArtifacts(AI_BUCKET, artifacts, use_cache)
+            else:
+                self.algorithms = dict(saved_data['algorithms'])
+            self.youden_indexes = dict(saved_data['youden_indexes'])
+            # Contexts trained before the stacking weights existed are weighted by their Youden indexes
+            self.model_weights = dict(saved_data.get('model_weights', self.youden_indexes))
             self.label_mapping = saved_data['label_mapping']
+            self.inference_costs = saved_data.get('inference_costs', {})
+            self.cascade_order = saved_data.get('cascade_order', list(self.algorithms.keys()))
+            self.compiled_cascade_order = saved_data.get('compiled_cascade_order', self.cascade_order)
+            if compiled:
+                # The compiled models don't cost what the sklearn ones do
+                self.cascade_order = self.compiled_cascade_order
+            self.hyperparameters = saved_data.get('hyperparameters', {})
+            self.feature_format = saved_data.get('feature_format', 'dense')
+            self.model_version = saved_data.get('model_version')
+
+    @property
+    def filtered_macs(self):
+        return band_macs(self.is_5ghz)
+
+    @property
+    def manifest_key(self):
+        return f'{self.ai_s3_path}/manifest.json'
+
+    def save_model(self, model_name):
+        """
+        Upload a model as a content addressed artifact, unless it's unchanged since it was loaded
+        """
+        if isinstance(self.algorithms, ModelArtifacts):
+            artifact = self.algorithms.unchanged_artifact(model_name)
+            if artifact:
+                return artifact
+
+        return put_model_artifact(self.ai_s3_path, self.algorithms[model_name])
 
     def save_context(self):
-        save_data = {
+        """
+        Upload the models first and then the manifest that points to them,
+        replacing the manifest is what swaps the models atomically
+        """
+        model_names = list(self.algorithms.keys())
+        with ThreadPoolExecutor(max_workers=max(1, len(model_names))) as pool:
+            artifacts = dict(zip(model_names, pool.map(self.save_model, model_names)))
+
+        manifest = {
+            'version': MANIFEST_VERSION,
             'headers': self.headers,
-            'algorithms': self.algorithms,
+            'label_mapping': self.label_mapping,
             'youden_indexes': self.youden_indexes,
-            'label_mapping': self.label_mapping
+            'model_weights': self.model_weights,
+            'inference_costs': self.inference_costs,
+            'cascade_order': self.cascade_order,
+            'compiled_cascade_order': self.compiled_cascade_order,
+            'hyperparameters': self.hyperparameters,
+            'feature_format': self.feature_format,
+            'models': artifacts,
+            'compiled_models': self.compiled_artifacts
         }
-        save_data = pickle.dumps(save_data)
-        put_file(AI_BUCKET, f'{self.ai_s3_path}/context.ai', save_data)
-
-    @logged
-    def get_datasets(self):
-        dynamo_data = get_all_elements_from_table(FINGERPRINT_TABLE)
-        filtered_macs = MACS_5GHZ + MACS_2_4GHZ if self.is_5ghz else MACS_2_4GHZ
-
-        X = dynamo_data.reindex(columns=filtered_macs)
-
-        X = X[filtered_macs].fillna(FINGERPRINT_NULL_VALUE)
-
-        self.headers = self.create_headers(list(X))
+        put_json(AI_BUCKET, self.manifest_key, manifest)
+        # The version is the hash of the manifest as it's read back, unknown until then
+        self.model_version = None
+
+    def load_dataset(self, full_rescan=False):
+        """
+        Return the whole training set (X, raw labels, timestamps) and the mask of the
+        rows that are new since the last snapshot. Unless `full_rescan` is set, only
+        the fingerprints newer than the snapshot high water mark (minus the
+        INCREMENTAL_LOAD_OVERLAP window) are read from DynamoDB.
+        """
+        from commons.dataset_loader import (
+            load_fingerprints, load_new_fingerprints, new_rows_mask, overlap_start, timestamp_microseconds
+        )
+        from commons.dataset_snapshot import load_snapshot
+        from commons.sparse_fingerprints import concatenate_rows
 
-        raw_y = np.array(dynamo_data['result'])
+        filtered_macs = self.filtered_macs
+        sparse = FEATURE_FORMAT == 'sparse'
 
-        self.label_mapping = {'from': {}, 'to': {}}
-        numerical_label = 0
+        snapshot = None if full_rescan else load_snapshot(AI_BUCKET, self.snapshot_key)
 
-        y = np.zeros(raw_y.shape)
-        for index, label in enumerate(raw_y):
-            if label not in self.label_mapping['from']:
-                self.label_mapping['from'][label] = numerical_label
-                self.label_mapping['to'][numerical_label] = label
-                numerical_label += 1
-            y[index] = self.label_mapping['from'][label]
+        if (
+            snapshot is None
+            or snapshot['headers'] != self.create_headers(filtered_macs)
+            or snapshot['null_value'] != FINGERPRINT_NULL_VALUE
+        ):
+            X, labels, timestamps = load_fingerprints(
+                FINGERPRINT_TABLE, filtered_macs, FINGERPRINT_NULL_VALUE, sparse=sparse
+            )
+            self.is_incremental = False
+            return (
+                to_feature_matrix(X, FEATURE_FORMAT), labels, timestamps,
+                np.ones(len(timestamps), dtype=bool)
+            )
 
-        X = np.array(X)
+        # The rows of the overlap window are read again and replace the snapshot ones,
+        # the table returns every item once even when two share a microsecond
+        start_us = overlap_start(snapshot['high_water_mark'])
+        X_window, labels_window, timestamps_window = load_new_fingerprints(
+            FINGERPRINT_TABLE, filtered_macs, FINGERPRINT_NULL_VALUE, start_us, sparse=sparse
+        )
+        snapshot_timestamps = snapshot['timestamps']
+        kept = timestamp_microseconds(snapshot_timestamps) < start_us
+        new_rows = new_rows_mask(timestamps_window, snapshot_timestamps[~kept])
+        snapshot_X = snapshot['X'] if kept.all() else snapshot['X'][kept]
+        logger.info({
+            'message': 'Incremental dataset load',
+            'snapshot_rows': int(kept.sum()),
+            'window_rows': len(timestamps_window),
+            'new_rows': int(new_rows.sum())
+        })
+
+        self.is_incremental = True
+        return (
+            concatenate_rows([
+                to_feature_matrix(snapshot_X, FEATURE_FORMAT), to_feature_matrix(X_window, FEATURE_FORMAT)
+            ]),
+            np.concatenate([snapshot['labels'][kept], labels_window]),
+            np.concatenate([snapshot_timestamps[kept], timestamps_window]),
+            np.concatenate([np.zeros(int(kept.sum()), dtype=bool), new_rows])
+        )
 
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+    @logged
+    def get_datasets(self, full_rescan=True, dataset=None):
+        """
+        Train, test and validation sets of the fingerprints table, or of the
+        already loaded `dataset` (X, raw labels, timestamps) if given
+        """
+        from commons.dataset_loader import encode_labels
+        from commons.feature_selection import rank_features, select_columns, select_features, selection_stats
+
+        if dataset is None:
+            X, raw_y, timestamps, new_rows = self.load_dataset(full_rescan)
+        else:
+            X, raw_y, timestamps = dataset
+            new_rows = np.ones(len(timestamps), dtype=bool)
+            self.is_incremental = False
+        self.dataset = (X, raw_y, timestamps)
+        self.feature_format = FEATURE_FORMAT
+
+        y, self.label_mapping = encode_labels(raw_y)
+
+        train_rows, test_rows, val_rows = split_rows(timestamps)
+        self.new_rows = new_rows
+        self.new_train_rows = new_rows[train_rows]
+
+        # The MACs are picked with the training rows only, the headers
+        # of the context (and so the encoder) only map the kept ones
+        X_train = X[train_rows]
+        filtered_macs = self.filtered_macs
+        ranking = rank_features(X_train, y[train_rows], FINGERPRINT_NULL_VALUE)
+        columns = select_features(ranking)
+        self.headers = self.create_headers([filtered_macs[column] for column in columns])
+        self.feature_selection = selection_stats(filtered_macs, ranking, columns)
+        metrics.put('FeatureColumns', len(columns), 'Count')
+
+        return (
+            select_columns(X_train, columns), select_columns(X[test_rows], columns),
+            select_columns(X[val_rows], columns),
+            y[train_rows], y[test_rows], y[val_rows]
+        )
 
-        X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=0.2)
-        
-        return X_train, X_test, X_val, y_train, y_test, y_val
+    @property
+    def snapshot_key(self):
+        return f'{self.ai_s3_path}/dataset.snap'
 
     @logged
     def create_headers(self, headers_list):
@@ -111,6 +440,8 @@ class AIEngine():
 
     @logged
     def youden_statistic(self, y_test, y_hat):
+        from sklearn.metrics import balanced_accuracy_score
+
         return balanced_accuracy_score(y_test, y_hat, adjusted=True)
 
         # TP = 0
@@ -138,123 +469,341 @@ class AIEngine():
         # return specificity + sensitivity - 1 
 
     @logged
-    def train(self):
-        X_train, X_test, X_val, y_train, y_test, y_val = self.get_datasets()
-
-        models = {
-            'Nearest Neighbors': KNeighborsClassifier(3),
-            'Decision Tree': DecisionTreeClassifier(max_depth=5),
-            'Lineal SVM': SVC(kernel="linear", C=0.025, probability=True),
-            'Random Forest': RandomForestClassifier(max_depth=5, n_estimators=10, max_features=1),
-            'Neural Net': MLPClassifier(alpha=1, max_iter=1000),
-            'AdaBoost': AdaBoostClassifier()
-        }
+    def train(self, full_rescan=False, tune=False, dataset=None, distributed=False, invoke=None, deadline=None):
+        """
+        Train the ensemble with the fingerprints table, or with an already loaded
+        `dataset` (X, raw labels, timestamps), e.g.: the rows of a shard.
+        The dataset snapshot is only saved when the table was read.
+        `distributed` fits every model in its own train-worker invocation
+        (see commons.distributed_training), started with `invoke`.
+        `deadline` (time.monotonic()) defaults to TRAIN_TOTAL_BUDGET from now.
+        """
+        from commons.dataset_snapshot import save_snapshot
+        from commons.evaluation_engine import EvaluationEngine
+        from commons.hyperparameter_search import TUNING_BUDGET, HyperparameterSearch
+        from commons.sparse_fingerprints import matrix_nbytes
+        from commons.training_engine import TRAIN_TOTAL_BUDGET, PartialFit, TrainingEngine
+
+        if deadline is None:
+            deadline = time.monotonic() + TRAIN_TOTAL_BUDGET
+        previous_algorithms = self.algorithms
+        previous_labels = self.label_mapping.get('from')
+        previous_format = self.feature_format
+        previous_headers = self.headers
+
+        with metrics.span('LoadDataset'):
+            X_train, X_test, X_val, y_train, y_test, y_val = self.get_datasets(full_rescan, dataset)
+        metrics.put('DatasetRows', len(self.dataset[2]), 'Count')
+        metrics.put('DatasetBytes', matrix_nbytes(self.dataset[0]), 'Bytes')
+
+        # Tuning may change the hyperparameters, every model is refit then.
+        # So does a new feature format or MAC selection, the models only understand the one they learnt
+        is_up_to_date = (
+            not tune
+            and all(model is not None for model in previous_algorithms.values())
+            and previous_labels == self.label_mapping['from']
+            and previous_format == self.feature_format
+            and previous_headers == self.headers
+        )
 
-        for name, model in models.items():
-            try:
-                self.algorithms[name] = model.fit(X_train,y_train)
-            except Exception as e:
-                logger.error(str(e))
+        if self.is_incremental and is_up_to_date and not self.new_rows.any():
+            logger.info('No new fingerprints since the last training, keeping the current models')
+            return
+
+        self.tuning_stats = None
+        if tune:
+            with metrics.span('Tuning'):
+                self.hyperparameters, self.tuning_stats = HyperparameterSearch(
+                    AI_BUCKET, self.ai_s3_path, build_model, model_search_space(),
+                    budget=min(TUNING_BUDGET, deadline - time.monotonic())
+                ).run(X_train, y_train)
+
+        models = build_models(self.hyperparameters)
+
+        if self.is_incremental and is_up_to_date and not distributed:
+            # Models that support it learn only the new rows, the rest are refit.
+            # The distributed workers refit every model, they don't get the previous ones
+            X_new, y_new = X_train[self.new_train_rows], y_train[self.new_train_rows]
+            for model_name, model in previous_algorithms.items():
+                if model_name in models and hasattr(model, 'partial_fit'):
+                    models[model_name] = PartialFit(model, X_new, y_new)
+
+        # Models that fail or run out of time are left out of the ensemble,
+        # loading and tuning count against the same budget
+        with metrics.span('Training'):
+            if distributed:
+                from commons.distributed_training import DistributedTraining
+
+                artifacts, self.training_stats, evaluations = DistributedTraining(
+                    AI_BUCKET, self.ai_s3_path, invoke=invoke
+                ).fit(
+                    {model_name: self.hyperparameters.get(model_name, {}) for model_name in models},
+                    X_train, y_train, X_test, X_val,
+                    total_budget=deadline - time.monotonic()
+                )
+                self.algorithms = ModelArtifacts(AI_BUCKET, artifacts)
+            else:
+                self.algorithms, self.training_stats = TrainingEngine(
+                    total_budget=deadline - time.monotonic()
+                ).fit(models, X_train, y_train)
+
+        for model_name, model_stats in self.training_stats.items():
+            if 'fit_time' in model_stats:
+                metrics.put(f'Fit.{model_name}', model_stats['fit_time'] * 1000)
+            metrics.put(f'FitFailed.{model_name}', int(model_stats['status'] != 'fitted'), 'Count')
+
+        if not self.algorithms:
+            raise RuntimeError(f'No model could be trained: {self.training_stats}')
+
+        with metrics.span('Evaluation'):
+            # Every model runs once over the test and the validation sets,
+            # the weights and the stats all come from those probabilities
+            evaluation = EvaluationEngine(len(self.label_mapping['from']))
+            if distributed:
+                # The workers already ran their models
+                for model_name, model_evaluation in evaluations.items():
+                    evaluation.add(model_name, **model_evaluation)
+            else:
+                evaluation.run(self.algorithms, X_test, X_val)
+
+            self.youden_indexes = {
+                model_name: self.youden_statistic(y_test, evaluation.test_predictions(model_name))
+                for model_name in evaluation.test_probabilities
+            }
+            if ENSEMBLE_WEIGHTING == 'stacking':
+                self.model_weights = evaluation.stacking_weights(y_test)
+            else:
+                self.model_weights = dict(self.youden_indexes)
 
-        results = {}
+            # The cascade goes from the cheapest to the most expensive model
+            self.inference_costs = dict(evaluation.inference_costs)
+            self.cascade_order = sorted(self.inference_costs, key=self.inference_costs.get)
 
-        for model_name in self.algorithms.keys():
-            results[model_name] = self.algorithms[model_name].predict(X_test)
+        with metrics.span('Compile'):
+            self.compile_models(evaluation, X_val)
 
-        self.youden_indexes = {}
+        self.save_train_stats(evaluation, y_val)
 
-        for model_name in self.algorithms.keys():
-            self.youden_indexes[model_name] = self.youden_statistic(y_test, results[model_name])
+        with metrics.span('SaveContext'):
+            self.save_context()
 
-        self.save_train_stats(X_val, y_val)
+        if dataset is not None:
+            return
 
-        self.save_context()
+        # Only once the context is saved, so a failed training is retried with the same rows.
+        # The snapshot keeps every MAC, the selection may change with the next rows
+        with metrics.span('SaveSnapshot'):
+            save_snapshot(
+                AI_BUCKET, self.snapshot_key, *self.dataset, self.create_headers(self.filtered_macs),
+                FINGERPRINT_NULL_VALUE
+            )
 
-    def save_train_stats(self, X_val, y_val):
-        y_final, _ = self.classify(X_val)
+    def compile_models(self, evaluation, X_val):
+        """
+        Export every model as NumPy arrays for localize (see commons.compiled_models).
+        A compiled model is only exported when its probabilities of the validation set
+        match the sklearn ones (already in `evaluation`) within COMPILED_TOLERANCE and,
+        unless COMPILED_ONLY is set, it localizes a fingerprint at least as fast.
+        The compiled cascade is ordered by the latency of the models localize will run
+        """
+        from commons.compiled_models import COMPILED_TOLERANCE, CompiledModel, compile_model, dumps
+        from commons.evaluation_engine import row_latency
+
+        self.compiled_artifacts = {}
+        self.compile_stats = {}
+        latencies = {}
+
+        for model_name in evaluation.val_probabilities:
+            latencies[model_name] = row_latency(self.algorithms[model_name], X_val)
+            try:
+                arrays = compile_model(self.algorithms[model_name])
+            except ValueError as error:
+                self.compile_stats[model_name] = {'status': 'unsupported', 'error': str(error)}
+                continue
+
+            compiled_model = CompiledModel(arrays)
+            probabilities = compiled_model.predict_proba(X_val)
+            max_error = float(np.max(
+                np.abs(evaluation.aligned(probabilities, arrays['classes']) - evaluation.val_probabilities[model_name]),
+                initial=0
+            ))
+            if max_error > COMPILED_TOLERANCE:
+                logger.warning({'message': 'Compiled model out of tolerance', 'model': model_name, 'error': max_error})
+                self.compile_stats[model_name] = {'status': 'out_of_tolerance', 'max_error': max_error}
+                continue
+
+            compiled_latency = row_latency(compiled_model, X_val)
+            if compiled_latency > latencies[model_name] and not COMPILED_ONLY:
+                # e.g.: the pairwise coupling of the SVM iterates in Python, libsvm in C
+                self.compile_stats[model_name] = {
+                    'status': 'slower', 'latency': compiled_latency, 'sklearn_latency': latencies[model_name]
+                }
+                continue
+
+            self.compiled_artifacts[model_name] = {
+                **put_artifact(self.ai_s3_path, dumps(arrays), 'npz'), 'format': 'compiled'
+            }
+            self.compile_stats[model_name] = {
+                'status': 'compiled', 'max_error': max_error, 'size': self.compiled_artifacts[model_name]['size'],
+                'latency': compiled_latency, 'sklearn_latency': latencies[model_name]
+            }
+            latencies[model_name] = compiled_latency
 
-        labels = list(self.label_mapping['from'].keys())
+        self.compiled_cascade_order = sorted(latencies, key=latencies.get)
 
-        precision = precision_score(y_val, y_final, average='macro')
-        classification_report_json = classification_report(
-            y_val, y_final, target_names=labels, output_dict=True
-        )
+    def save_train_stats(self, evaluation, y_val):
+        labels = list(self.label_mapping['from'].keys())
 
         stats = {
-            'precision': precision,
-            'classification_report': classification_report_json
+            **evaluation.ensemble_stats(self.model_weights, y_val, labels),
+            'youden_indexes': self.youden_indexes,
+            'weighting': ENSEMBLE_WEIGHTING,
+            'model_weights': self.model_weights,
+            'training': self.training_stats,
+            'hyperparameters': self.hyperparameters,
+            'tuning': self.tuning_stats,
+            'compiled': self.compile_stats,
+            'feature_selection': self.feature_selection
         }
 
         put_json(AI_BUCKET, f'{self.ai_s3_path}/stats.json', stats)   
 
-    def classify_single_model(self, X_val, model_name, model, model_results):
-        model_results[model_name] = model.predict_proba(X_val)
-
-    def classify(self, X_val):
-        model_results = {}
+    def classify(self, X_val, cascade=CASCADE_INFERENCE):
+        if cascade:
+            return self.classify_cascade(X_val)
 
-        threads = [None]*len(self.algorithms)
+        model_results = get_executor().predict_proba(self.algorithms, X_val)
 
-        for i, model_name in enumerate(self.algorithms.keys()):
-            threads[i] = Thread(
-                target=self.classify_single_model, 
-                args=(X_val, model_name, self.algorithms[model_name], model_results)
-            )
-            threads[i].start()
-
-        for thread in threads:
-            thread.join()
+        return self.aggregate(model_results)
 
-        shape = np.shape(model_results[model_name])
+    def aggregate(self, model_results):
+        """
+        Youden weighted average of the predict_proba of every model
+        """
+        with metrics.span('Aggregation'):
+            shape = np.shape(next(iter(model_results.values())))
 
-        probabilities = np.zeros(shape)
+            probabilities = np.zeros(shape)
 
-        for model_name, model_result in model_results.items():
-            probabilities = probabilities + model_result * self.youden_indexes[model_name]
+            for model_name, model_result in model_results.items():
+                probabilities = probabilities + model_result * self.model_weights[model_name]
 
-        probabilities = probabilities / len(model_results)
+            probabilities = probabilities / len(model_results)
 
-        y_final = np.argmax(probabilities, axis=1)
+            y_final = np.argmax(probabilities, axis=1)
         
         return y_final, probabilities
 
-    def prepare_fingerprint(self, raw_fingerprint):
-        fingerprint = np.zeros(len(self.headers)) + FINGERPRINT_NULL_VALUE
+    def classify_cascade(self, X_val):
+        from commons.sparse_fingerprints import is_sparse
 
-        filtered_macs = MACS_5GHZ + MACS_2_4GHZ if self.is_5ghz else MACS_2_4GHZ
-        filtered_macs = [mac for mac in filtered_macs if mac in self.headers.keys()]
+        if not is_sparse(X_val):
+            X_val = np.asarray(X_val)
+        n_rows = X_val.shape[0]
+        model_names = [
+            model_name for model_name in self.cascade_order if model_name in self.algorithms
+        ]
 
-        wifi_fingerprint = {
-            mac:rss 
-            for mac,rss in raw_fingerprint.get('wifi', {}).items() 
-            if mac in filtered_macs
-        }
+        # A model with weight w moves the gap between two labels by at most |w|
+        remaining_weight = sum(abs(self.model_weights[model_name]) for model_name in model_names)
 
-        for mac, rss in wifi_fingerprint.items():
-            fingerprint[self.headers[mac]] = rss
+        scores = None
+        evaluated_models = np.zeros(n_rows)
+        pending_rows = np.arange(n_rows)
 
-        bt_fingerprint = {
-            mac:rss 
-            for mac,rss in raw_fingerprint.get('bt', {}).items() 
-            if mac in filtered_macs
-        }
+        for model_name in model_names:
+            weight = self.model_weights[model_name]
+            with metrics.span(f'Predict.{model_name}'):
+                model_result = self.algorithms[model_name].predict_proba(X_val[pending_rows])
 
-        for mac, rss in bt_fingerprint.items():
-            fingerprint[self.headers[mac]] = rss
+            if scores is None:
+                scores = np.zeros((n_rows, model_result.shape[1]))
 
-        return [fingerprint]
-        
-    @logged
-    def localize_fingerprint(self, fingerprint):
-        classification, raw_probabilities = self.classify(fingerprint)
+            scores[pending_rows] += model_result * weight
+            evaluated_models[pending_rows] += 1
+            remaining_weight -= abs(weight)
+
+            if scores.shape[1] < 2:
+                break
+
+            top_two = np.sort(scores[pending_rows], axis=1)[:, -2:]
+            lead = top_two[:, 1] - top_two[:, 0]
+            pending_rows = pending_rows[lead <= CASCADE_MARGIN * remaining_weight]
+
+            if not len(pending_rows):
+                break
+
+        metrics.put('CascadeModels', float(evaluated_models.mean()), 'Count')
+
+        probabilities = scores / evaluated_models[:, np.newaxis]
+
+        y_final = np.argmax(probabilities, axis=1)
 
-        classification = classification[0]
-        raw_probabilities = raw_probabilities[0]
+        return y_final, probabilities
 
+    @property
+    def encoder(self):
+        return get_encoder(self.headers, self.filtered_macs, FINGERPRINT_NULL_VALUE)
 
+    def prepare_fingerprint(self, raw_fingerprint):
+        if self.feature_format == 'sparse':
+            return self.encoder.encode_sparse([raw_fingerprint])
+        return [self.encoder.encode(raw_fingerprint)]
+
+    def prepare_fingerprints(self, raw_fingerprints):
+        """
+        Encode a list of raw fingerprints into a single matrix, one row per fingerprint,
+        in the feature format the models were trained with
+        """
+        if self.feature_format == 'sparse':
+            return self.encoder.encode_sparse(raw_fingerprints)
+        return self.encoder.encode_batch(raw_fingerprints)
+
+    def format_result(self, classification, raw_probabilities):
         probabilities = {
             self.label_mapping['to'][index]: probability
             for index, probability in enumerate(raw_probabilities)
         }
 
         return self.label_mapping['to'][classification], probabilities
+
+    @logged(sample_rate=LOCALIZE_LOG_SAMPLE_RATE)
+    def localize_fingerprint(self, fingerprint):
+        """
+        Localize a prepared fingerprint, repeated (quantized) fingerprints are served
+        from the result cache while the models don't change
+        """
+        if not localize_cache.enabled or self.model_version is None:
+            return self.classify_fingerprint(fingerprint)
+
+        localize_cache.invalidate(self.ai_s3_path, self.model_version)
+        key = (
+            self.ai_s3_path, self.model_version, localize_cache.quantize(fingerprint, FINGERPRINT_NULL_VALUE)
+        )
+
+        result = localize_cache.get(key)
+        metrics.put('ResultCacheHit', int(result is not None), 'Count')
+        if result is None:
+            result = self.classify_fingerprint(fingerprint)
+            localize_cache.put(key, result)
+
+        location_label, probabilities = result
+        return location_label, dict(probabilities)
+
+    def classify_fingerprint(self, fingerprint):
+        classification, raw_probabilities = self.classify(fingerprint)
+
+        return self.format_result(classification[0], raw_probabilities[0])
+
+    @logged(sample_rate=LOCALIZE_LOG_SAMPLE_RATE)
+    def localize_fingerprints(self, fingerprints):
+        """
+        Localize a whole batch with a single ensemble pass, every model runs
+        predict_proba once over all the rows
+        """
+        classification, raw_probabilities = self.classify(fingerprints)
+
+        return [
+            self.format_result(row_classification, row_probabilities)
+            for row_classification, row_probabilities in zip(classification, raw_probabilities)
+        ]
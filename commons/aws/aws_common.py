@@ -1,3 +1,31 @@
+import threading
+
+# boto3 clients shared by the whole process, created on their first use.
+# Importing boto3 and building a client takes hundreds of ms of the cold start,
+# handlers that don't use a service don't pay for it
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name):
+    client = _clients.get(service_name)
+    if client is None:
+        with _clients_lock:
+            if service_name not in _clients:
+                import boto3
+                _clients[service_name] = boto3.session.Session().client(service_name)
+            client = _clients[service_name]
+    return client
+
+
+def set_client(service_name, client):
+    """
+    Replace the client of a service (e.g.: with a local stand-in)
+    """
+    with _clients_lock:
+        _clients[service_name] = client
+
+
 def paginate(method, **kwargs):
     client = method.__self__
     paginator = client.get_paginator(method.__name__)
@@ -5,4 +33,4 @@ def paginate(method, **kwargs):
         result
         for page in paginator.paginate(**kwargs).result_key_iters()
         for result in page
-    )
\ No newline at end of file
+    )
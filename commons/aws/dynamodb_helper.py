@@ -1,12 +1,21 @@
-import boto3
-import pandas as pd
-from commons.logger import logged
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from commons.aws.aws_common import get_client
+from commons.logger import logged, logger
 from dynamodb_json import json_util as json_d
 
-client = boto3.client('dynamodb')
+# DynamoDB rejects expressions longer than 4KB
+MAX_EXPRESSION_LENGTH = 4096
+
+# Maximum number of items of a BatchWriteItem request
+BATCH_WRITE_SIZE = 25
 
 def get_all_elements_from_table(table_name):
-    paginator = client.get_paginator('scan')
+    import pandas as pd
+
+    paginator = get_client('dynamodb').get_paginator('scan')
     operation_parameters = {
         'TableName': table_name
     }
@@ -22,9 +31,109 @@ def get_all_elements_from_table(table_name):
     return df
 
 
+def projection_parameters(attribute_names):
+    """
+    Build the ProjectionExpression (with placeholders, MACs and reserved words like
+    `result` can't be used as is) that fetches only `attribute_names`.
+    Returns no parameters when the expression would be too long, fetching whole items.
+    """
+    names = {f'#{index}': attribute_name for index, attribute_name in enumerate(attribute_names)}
+    expression = ','.join(names.keys())
+
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        return {}
+
+    return {
+        'ProjectionExpression': expression,
+        'ExpressionAttributeNames': names
+    }
+
+
+def parallel_scan(table_name, decode_page, total_segments=4, **scan_parameters):
+    """
+    Scan `table_name` with `total_segments` workers (Segment/TotalSegments),
+    every page of raw items is passed to `decode_page` as soon as it arrives.
+    Returns the list of decoded pages.
+    """
+    def scan_segment(segment):
+        paginator = get_client('dynamodb').get_paginator('scan')
+        page_iterator = paginator.paginate(
+            TableName=table_name,
+            Segment=segment,
+            TotalSegments=total_segments,
+            **scan_parameters
+        )
+        return [decode_page(page['Items']) for page in page_iterator]
+
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        return [
+            decoded_page
+            for segment_pages in pool.map(scan_segment, range(total_segments))
+            for decoded_page in segment_pages
+        ]
+
+
+def query_pages(table_name, decode_page, **query_parameters):
+    """
+    Query `table_name` (or one of its indexes) passing every page of raw items
+    to `decode_page`. Returns the list of decoded pages.
+    """
+    paginator = get_client('dynamodb').get_paginator('query')
+    page_iterator = paginator.paginate(TableName=table_name, **query_parameters)
+
+    return [decode_page(page['Items']) for page in page_iterator]
+
+
+def serialize_item(content):
+    """
+    DynamoDB JSON of `content`, bytes values are stored as binary attributes
+    """
+    item = json_d.dumps(
+        {name: value for name, value in content.items() if not isinstance(value, bytes)},
+        as_dict=True
+    )
+    item.update({
+        name: {'B': value} for name, value in content.items() if isinstance(value, bytes)
+    })
+    return item
+
+
 @logged()
 def add_element_to_table(table_name, content):
-    return client.put_item(
+    return get_client('dynamodb').put_item(
         TableName=table_name,
-        Item=json_d.dumps(content, as_dict=True)
-    )
\ No newline at end of file
+        Item=serialize_item(content)
+    )
+
+def batch_add_elements_to_table(table_name, contents, max_workers=4, max_retries=8, base_delay=0.05):
+    """
+    Write `contents` with concurrent BatchWriteItem requests of BATCH_WRITE_SIZE items,
+    retrying the UnprocessedItems with exponential backoff (and jitter).
+    Returns the number of items that couldn't be written, a chunk whose request
+    fails counts all its items still unprocessed and the other chunks go on.
+    """
+    def write_chunk(chunk):
+        requests = [
+            {'PutRequest': {'Item': serialize_item(content)}}
+            for content in chunk
+        ]
+        try:
+            for attempt in range(max_retries + 1):
+                response = get_client('dynamodb').batch_write_item(RequestItems={table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(table_name, [])
+                if not requests or attempt == max_retries:
+                    break
+                time.sleep(base_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+        except Exception as exception:
+            logger.error({'message': 'BatchWriteItem failed', 'table': table_name, 'error': str(exception)})
+        return len(requests)
+
+    chunks = [
+        contents[index:index + BATCH_WRITE_SIZE]
+        for index in range(0, len(contents), BATCH_WRITE_SIZE)
+    ]
+    if not chunks:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        return sum(pool.map(write_chunk, chunks))
@@ -1,16 +1,13 @@
 import json
-import boto3
 
+from commons.aws.aws_common import get_client
 from commons.logger import logged
 
-# Create the boto3 lambda client
-lambda_client = boto3.session.Session().client('lambda')
-
 
 @logged()
 def invoke_async(lambda_name, payload):
-    payload_dump = payload if payload else json.dumps(payload)
-    return lambda_client.invoke(
+    payload_dump = json.dumps(payload)
+    return get_client('lambda').invoke(
         InvocationType='Event',
         FunctionName=lambda_name,
         Payload=payload_dump
@@ -19,7 +16,7 @@ def invoke_async(lambda_name, payload):
 
 @logged
 def invoke_sync(lambda_name, payload):
-    return json.loads(lambda_client.invoke(
+    return json.loads(get_client('lambda').invoke(
         InvocationType='RequestResponse',
         FunctionName=lambda_name,
         Payload=json.dumps(payload)
@@ -1,33 +1,67 @@
 import os
 import io
-import boto3
 import json
 
+from botocore.exceptions import ClientError
+
+from commons.aws.aws_common import get_client
 from commons.logger import logged
 
-S3_CLIENT = boto3.session.Session().client('s3')
+
+def s3_client():
+    return get_client('s3')
 
 
 def get_file(bucket_name, key):
     try:
-        json_obj = S3_CLIENT.get_object(Bucket=bucket_name, Key=key)
+        json_obj = s3_client().get_object(Bucket=bucket_name, Key=key)
         return json_obj['Body'].read()
-    except S3_CLIENT.exceptions.NoSuchKey:
+    except s3_client().exceptions.NoSuchKey:
         return None
 
 
+def get_file_if_modified(bucket_name, key, etag=None):
+    """
+    Conditional GET of `key`. Returns a (body, etag) tuple, where body is None
+    when the object is missing or when it still matches the given `etag`
+    """
+    extra_args = {'IfNoneMatch': etag} if etag else {}
+    try:
+        s3_obj = s3_client().get_object(Bucket=bucket_name, Key=key, **extra_args)
+        return s3_obj['Body'].read(), s3_obj['ETag']
+    except s3_client().exceptions.NoSuchKey:
+        return None, None
+    except ClientError as error:
+        if error.response['Error']['Code'] == '304':
+            return None, etag
+        raise
+
+
+def download_file(bucket_name, key, path):
+    """
+    Download `key` to the local `path`, returns False if it doesn't exist
+    """
+    try:
+        s3_client().download_file(bucket_name, key, path)
+        return True
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+
+
 @logged
 def get_json(bucket_name, key):
     try:
-        json_obj = S3_CLIENT.get_object(Bucket=bucket_name, Key=key)
+        json_obj = s3_client().get_object(Bucket=bucket_name, Key=key)
         return json.loads(json_obj['Body'].read().decode())
-    except S3_CLIENT.exceptions.NoSuchKey:
+    except s3_client().exceptions.NoSuchKey:
         return None
 
 
 def put_file(bucket_name, key, upload_file):
     file_like = io.BytesIO(upload_file)
-    S3_CLIENT.upload_fileobj(file_like, bucket_name, key)
+    s3_client().upload_fileobj(file_like, bucket_name, key)
 
 
 @logged
@@ -51,6 +85,6 @@ def put_json(bucket_name, key, json_dict, public_read=False):
     if public_read:
         extra_args = {'ACL': 'public-read'}
 
-    S3_CLIENT.upload_fileobj(file_like, bucket_name, key, ExtraArgs=extra_args)
+    s3_client().upload_fileobj(file_like, bucket_name, key, ExtraArgs=extra_args)
 
-    return f'{S3_CLIENT.meta.endpoint_url}/{bucket_name}/{key}'
\ No newline at end of file
+    return f'{s3_client().meta.endpoint_url}/{bucket_name}/{key}'
\ No newline at end of file
@@ -1,14 +1,10 @@
-import boto3
-
-from commons.aws.aws_common import paginate
-
-ssm_client = boto3.session.Session().client('ssm')
+from commons.aws.aws_common import get_client, paginate
 
 
 def get_parameters_by_path(path='/'):
     # Append the '/' to the end so the split call later don't produce an empty first component
     parameter_store = paginate(
-        ssm_client.get_parameters_by_path,
+        get_client('ssm').get_parameters_by_path,
         Path=path,
         Recursive=True,
         WithDecryption=True
@@ -0,0 +1,437 @@
+"""
+Fitted models compiled to flat NumPy arrays for the localize path.
+
+Localize only runs forward passes: compile_model exports every fitted model as the
+arrays its predict_proba needs (tree node tables, weight matrices, support vector
+hyperplanes, the training rows of the nearest neighbours) and CompiledModel runs
+them with vectorized NumPy, without scikit-learn and without unpickling.
+
+The kernels reproduce the sklearn predict_proba up to floating point rounding, the
+training checks every compiled model against the sklearn probabilities of the
+validation set and only exports the ones within COMPILED_TOLERANCE. The nearest
+neighbours may pick a different one of several equidistant training rows.
+"""
+import io
+import json
+
+import numpy as np
+
+from commons.settings import settings
+
+COMPILED_FORMAT_VERSION = 1
+
+# Largest absolute difference with the sklearn predict_proba that a compiled model may
+# show on the validation set, models above it keep being served from their pickles.
+# Networks trained on sparse (float32) matrices differ by up to ~1e-6
+COMPILED_TOLERANCE = float(settings.get('COMPILED_TOLERANCE', 1e-5))
+
+# Rows per block of the nearest neighbours distance matrix
+NEIGHBORS_BLOCK_ROWS = 256
+
+# libsvm clips the pairwise probabilities of its Platt scaling to [min, 1 - min]
+SVM_MIN_PROBABILITY = 1e-7
+
+# Fitted arrays of the fingerprint index, its search runs on them as they are
+INDEX_ATTRIBUTES = ('rss_', 'y_codes_', 'class_prior_', 'postings_rows_', 'postings_rss_', 'postings_indptr_')
+
+
+def tree_tables(trees):
+    """
+    Node tables of the trees, concatenated. Leaves point to themselves so every
+    tree is walked the same `depth` steps, the deepest tree sets it.
+    """
+    lefts, rights, features, thresholds, probabilities, roots = [], [], [], [], [], []
+    offset = 0
+    depth = 0
+
+    for tree in trees:
+        tree_ = tree.tree_
+        nodes = np.arange(tree_.node_count)
+        is_leaf = tree_.children_left == -1
+
+        lefts.append(np.where(is_leaf, nodes, tree_.children_left) + offset)
+        rights.append(np.where(is_leaf, nodes, tree_.children_right) + offset)
+        features.append(np.where(is_leaf, 0, tree_.feature))
+        thresholds.append(np.where(is_leaf, 0, tree_.threshold))
+
+        # What DecisionTreeClassifier.predict_proba does with the node values
+        values = np.array(tree_.value[:, 0, :], dtype=np.float64)
+        normalizer = values.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0] = 1
+        probabilities.append(values / normalizer)
+
+        roots.append(offset)
+        offset += tree_.node_count
+        depth = max(depth, tree_.max_depth)
+
+    return {
+        'left': np.concatenate(lefts).astype(np.int32),
+        'right': np.concatenate(rights).astype(np.int32),
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'probabilities': np.concatenate(probabilities),
+        'roots': np.array(roots, dtype=np.int32),
+        'depth': np.array(depth)
+    }
+
+
+def compile_tree(model):
+    return {**tree_tables([model]), 'kind': 'forest'}
+
+
+def compile_forest(model):
+    for tree in model.estimators_:
+        if not np.array_equal(tree.classes_, np.arange(len(model.classes_))):
+            raise ValueError('The forest trees must have the classes of the forest')
+
+    return {**tree_tables(model.estimators_), 'kind': 'forest'}
+
+
+def compile_adaboost(model):
+    for tree in model.estimators_:
+        if not hasattr(tree, 'tree_') or not np.array_equal(tree.classes_, model.classes_):
+            raise ValueError('Only AdaBoost over decision trees with every class is supported')
+
+    # Releases before 1.6 default to the real SAMME.R
+    algorithm = getattr(model, 'algorithm', 'SAMME')
+    if algorithm not in ('SAMME', 'SAMME.R'):
+        algorithm = 'SAMME'
+
+    return {
+        **tree_tables(model.estimators_),
+        'kind': 'adaboost',
+        'algorithm': np.array(algorithm),
+        'estimator_weights': np.asarray(model.estimator_weights_[:len(model.estimators_)], dtype=np.float64),
+        'weights_sum': np.array(np.sum(model.estimator_weights_), dtype=np.float64)
+    }
+
+
+def compile_mlp(model):
+    arrays = {
+        'kind': 'mlp',
+        'activation': np.array(model.activation),
+        'out_activation': np.array(model.out_activation_),
+        'n_layers': np.array(len(model.coefs_))
+    }
+    for layer, (coefs, intercepts) in enumerate(zip(model.coefs_, model.intercepts_)):
+        arrays[f'coefs_{layer}'] = coefs
+        arrays[f'intercepts_{layer}'] = intercepts
+    return arrays
+
+
+def compile_svc(model):
+    """
+    The one vs one hyperplanes of a linear SVC, from its libsvm dual coefficients
+    """
+    import scipy.sparse
+
+    if model.kernel != 'linear' or not model.probability:
+        raise ValueError('Only linear SVCs with probability=True are supported')
+
+    support_vectors = model.support_vectors_
+    dual_coef = model._dual_coef_
+    if scipy.sparse.issparse(support_vectors):
+        support_vectors = support_vectors.toarray()
+    if scipy.sparse.issparse(dual_coef):
+        dual_coef = dual_coef.toarray()
+
+    n_classes = len(model.classes_)
+    starts = np.concatenate([[0], np.cumsum(model._n_support)])
+    coefs = []
+    for first in range(n_classes):
+        first_vectors = slice(starts[first], starts[first + 1])
+        for second in range(first + 1, n_classes):
+            second_vectors = slice(starts[second], starts[second + 1])
+            coefs.append(
+                dual_coef[second - 1, first_vectors] @ support_vectors[first_vectors]
+                + dual_coef[first, second_vectors] @ support_vectors[second_vectors]
+            )
+
+    return {
+        'kind': 'svc',
+        'coef': np.array(coefs, dtype=np.float64),
+        'intercept': np.asarray(model._intercept_, dtype=np.float64),
+        'prob_a': np.asarray(model._probA, dtype=np.float64),
+        'prob_b': np.asarray(model._probB, dtype=np.float64)
+    }
+
+
+def compile_neighbors(model):
+    import scipy.sparse
+
+    if model.effective_metric_ != 'euclidean' or model.weights not in ('uniform', 'distance'):
+        raise ValueError('Only euclidean nearest neighbours with uniform or distance weights are supported')
+
+    fit_X = model._fit_X
+    if scipy.sparse.issparse(fit_X):
+        fit_X = fit_X.toarray()
+
+    return {
+        'kind': 'neighbors',
+        'fit_X': fit_X,
+        'fit_y': np.asarray(model._y, dtype=np.int32),
+        'n_neighbors': np.array(model.n_neighbors),
+        'weights': np.array(model.weights)
+    }
+
+
+def compile_fingerprint_index(model):
+    params = ('n_neighbors', 'weights', 'strong_aps', 'rss_window', 'max_candidates', 'missing_rss', 'null_value')
+    arrays = {
+        'kind': 'fingerprint_index',
+        'params': np.array(json.dumps({param: getattr(model, param) for param in params}))
+    }
+    for attribute in INDEX_ATTRIBUTES:
+        arrays[attribute] = getattr(model, attribute)
+    return arrays
+
+
+COMPILERS = {
+    'DecisionTreeClassifier': compile_tree,
+    'RandomForestClassifier': compile_forest,
+    'AdaBoostClassifier': compile_adaboost,
+    'MLPClassifier': compile_mlp,
+    'SVC': compile_svc,
+    'KNeighborsClassifier': compile_neighbors,
+    'FingerprintIndexClassifier': compile_fingerprint_index
+}
+
+
+def compile_model(model):
+    """
+    The arrays of a fitted model, ValueError for the models no kernel runs
+    """
+    compiler = COMPILERS.get(type(model).__name__)
+    if compiler is None:
+        raise ValueError(f'{type(model).__name__} models can\'t be compiled')
+
+    return {
+        **compiler(model),
+        'version': np.array(COMPILED_FORMAT_VERSION),
+        'classes': np.asarray(model.classes_)
+    }
+
+
+def dumps(arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return CompiledModel({name: arrays[name] for name in arrays.files})
+
+
+def features(X):
+    """
+    Dense float matrix of a dense or sparse (see commons.sparse_fingerprints) batch,
+    the models saw the sparse offsets with their implicit zeros
+    """
+    if hasattr(X, 'toarray'):
+        X = X.toarray()
+    return np.asarray(X, dtype=np.float64)
+
+
+def softmax(X):
+    X = np.exp(X - X.max(axis=1, keepdims=True))
+    return X / X.sum(axis=1, keepdims=True)
+
+
+def walk_trees(arrays, X):
+    """
+    Probabilities of every tree, (rows, trees, classes)
+    """
+    # The sklearn trees split the float32 features
+    X = features(X).astype(np.float32)
+    rows = np.arange(X.shape[0])[:, np.newaxis]
+    nodes = np.tile(arrays['roots'], (X.shape[0], 1))
+
+    for _ in range(int(arrays['depth'])):
+        go_left = X[rows, arrays['feature'][nodes]] <= arrays['threshold'][nodes]
+        nodes = np.where(go_left, arrays['left'][nodes], arrays['right'][nodes])
+
+    return arrays['probabilities'][nodes]
+
+
+def forest_proba(arrays, X):
+    return walk_trees(arrays, X).mean(axis=1)
+
+
+def adaboost_proba(arrays, X):
+    tree_probabilities = walk_trees(arrays, X)
+    n_classes = tree_probabilities.shape[2]
+    if n_classes == 1:
+        return np.ones((tree_probabilities.shape[0], 1))
+
+    if str(arrays['algorithm']) == 'SAMME.R':
+        log_probabilities = np.log(np.clip(tree_probabilities, np.finfo(np.float64).eps, None))
+        decision = ((n_classes - 1) * (
+            log_probabilities - log_probabilities.sum(axis=2, keepdims=True) / n_classes
+        )).sum(axis=1)
+    else:
+        votes = np.argmax(tree_probabilities, axis=2)[:, :, np.newaxis] == np.arange(n_classes)
+        weights = arrays['estimator_weights'][np.newaxis, :, np.newaxis]
+        decision = np.where(votes, weights, -1 / (n_classes - 1) * weights).sum(axis=1)
+    decision /= arrays['weights_sum']
+
+    if n_classes == 2:
+        decision = decision[:, 1] - decision[:, 0]
+        return softmax(np.stack([-decision, decision], axis=1) / 2)
+    return softmax(decision / (n_classes - 1))
+
+
+ACTIVATIONS = {
+    'identity': lambda X: X,
+    'logistic': lambda X: 1 / (1 + np.exp(-X)),
+    'tanh': np.tanh,
+    'relu': lambda X: np.maximum(X, 0),
+    'softmax': softmax
+}
+
+
+def mlp_proba(arrays, X):
+    n_layers = int(arrays['n_layers'])
+    # The network computes in the dtype it was trained with
+    activation = features(X).astype(arrays['coefs_0'].dtype)
+
+    for layer in range(n_layers):
+        activation = activation @ arrays[f'coefs_{layer}'] + arrays[f'intercepts_{layer}']
+        if layer < n_layers - 1:
+            activation = ACTIVATIONS[str(arrays['activation'])](activation)
+
+    probabilities = ACTIVATIONS[str(arrays['out_activation'])](activation)
+    if probabilities.shape[1] == 1:
+        return np.hstack([1 - probabilities, probabilities])
+    return probabilities
+
+
+def couple_pairwise(pairwise):
+    """
+    libsvm multiclass_probability: class probabilities from the pairwise ones
+    (rows, k, k), the same fixed point iteration vectorized over the rows
+    """
+    n_rows, k = pairwise.shape[:2]
+    transposed = pairwise.transpose(0, 2, 1)
+    Q = -transposed * pairwise
+    diagonal = np.arange(k)
+    # The diagonal of `pairwise` is 0
+    Q[:, diagonal, diagonal] = (transposed ** 2).sum(axis=2)
+
+    probabilities = np.full((n_rows, k), 1 / k)
+    active = np.ones(n_rows, dtype=bool)
+    eps = 0.005 / k
+
+    for _ in range(max(100, k)):
+        Qp = np.einsum('nij,nj->ni', Q, probabilities)
+        pQp = (probabilities * Qp).sum(axis=1)
+        active &= np.abs(Qp - pQp[:, np.newaxis]).max(axis=1) >= eps
+        if not active.any():
+            break
+
+        for t in range(k):
+            # Settled rows take steps of 0, which leave them as they are
+            diff = np.where(active, (-Qp[:, t] + pQp) / Q[:, t, t], 0)
+            probabilities[:, t] += diff
+            pQp = (pQp + diff * (diff * Q[:, t, t] + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff[:, np.newaxis] * Q[:, t, :]) / (1 + diff)[:, np.newaxis]
+            probabilities /= (1 + diff)[:, np.newaxis]
+
+    return probabilities
+
+
+def svc_proba(arrays, X):
+    decision = features(X) @ arrays['coef'].T + arrays['intercept']
+
+    # Platt scaling of every one vs one decision, libsvm sigmoid_predict
+    fApB = decision * arrays['prob_a'] + arrays['prob_b']
+    exp_fApB = np.exp(-np.abs(fApB))
+    pairwise_probabilities = np.where(fApB >= 0, exp_fApB / (1 + exp_fApB), 1 / (1 + exp_fApB))
+    pairwise_probabilities = np.clip(pairwise_probabilities, SVM_MIN_PROBABILITY, 1 - SVM_MIN_PROBABILITY)
+
+    # The libsvm of sklearn couples the pairwise probabilities of two classes too
+    n_pairs = decision.shape[1]
+    k = int(round((1 + np.sqrt(1 + 8 * n_pairs)) / 2))
+    first, second = np.triu_indices(k, 1)
+    pairwise = np.zeros((decision.shape[0], k, k))
+    pairwise[:, first, second] = pairwise_probabilities
+    pairwise[:, second, first] = 1 - pairwise_probabilities
+
+    return couple_pairwise(pairwise)
+
+
+def neighbors_proba(arrays, X):
+    X = features(X)
+    fit_X = arrays['fit_X'].astype(np.float64)
+    fit_y = arrays['fit_y']
+    n_neighbors = int(arrays['n_neighbors'])
+    n_classes = len(arrays['classes'])
+    fit_norms = (fit_X ** 2).sum(axis=1)
+
+    probabilities = np.zeros((X.shape[0], n_classes))
+    for start in range(0, X.shape[0], NEIGHBORS_BLOCK_ROWS):
+        block = X[start:start + NEIGHBORS_BLOCK_ROWS]
+        squared_distances = np.maximum(
+            (block ** 2).sum(axis=1, keepdims=True) - 2 * block @ fit_X.T + fit_norms, 0
+        )
+
+        nearest = np.argpartition(squared_distances, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        rows = np.arange(len(block))[:, np.newaxis]
+
+        if str(arrays['weights']) == 'distance':
+            with np.errstate(divide='ignore'):
+                neighbor_weights = 1 / np.sqrt(squared_distances[rows, nearest])
+            # Training rows at distance 0 take all the weight, as in sklearn
+            exact = np.isinf(neighbor_weights)
+            exact_rows = exact.any(axis=1)
+            neighbor_weights[exact_rows] = exact[exact_rows]
+        else:
+            neighbor_weights = np.ones(nearest.shape)
+
+        block_probabilities = probabilities[start:start + len(block)]
+        np.add.at(block_probabilities, (np.broadcast_to(rows, nearest.shape), fit_y[nearest]), neighbor_weights)
+        block_probabilities /= block_probabilities.sum(axis=1, keepdims=True)
+
+    return probabilities
+
+
+KERNELS = {
+    'forest': forest_proba,
+    'adaboost': adaboost_proba,
+    'mlp': mlp_proba,
+    'svc': svc_proba,
+    'neighbors': neighbors_proba
+}
+
+
+class CompiledModel():
+    """
+    predict_proba of a compiled model, the columns are `classes_` like in sklearn
+    """
+
+    def __init__(self, arrays):
+        if int(arrays['version']) != COMPILED_FORMAT_VERSION:
+            raise ValueError(f'Unsupported compiled model version {int(arrays["version"])}')
+
+        self.arrays = arrays
+        self.kind = str(arrays['kind'])
+        self.classes_ = arrays['classes']
+
+        if self.kind == 'fingerprint_index':
+            from commons.fingerprint_search import FingerprintIndexSearch
+
+            self.index = FingerprintIndexSearch()
+            self.index.__dict__.update(json.loads(str(arrays['params'])))
+            for attribute in INDEX_ATTRIBUTES:
+                setattr(self.index, attribute, arrays[attribute])
+            self.index.classes_ = self.classes_
+        elif self.kind not in KERNELS:
+            raise ValueError(f'Unknown compiled model kind "{self.kind}"')
+
+    def predict_proba(self, X):
+        if self.kind == 'fingerprint_index':
+            return self.index.predict_proba(X)
+        return KERNELS[self.kind](self.arrays, X)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -0,0 +1,221 @@
+import numpy as np
+
+from commons.aws.dynamodb_helper import parallel_scan, projection_parameters, query_pages
+from commons.fingerprint_packing import dictionary_store, unpack_readings
+from commons.fingerprint_schema import (
+    DATASET_ATTRIBUTE, DATASET_NAME, DICTIONARY_ATTRIBUTE, FINGERPRINT_ATTRIBUTES,
+    PACKED_ATTRIBUTE, TIME_INDEX
+)
+from commons.settings import settings
+from commons.sparse_fingerprints import concatenate_rows, to_sparse
+
+DYNAMODB_SCAN_SEGMENTS = int(settings.get('DYNAMODB_SCAN_SEGMENTS', 4))
+# Seconds below the high water mark read again by the incremental loads. The timestamps
+# come from the clocks of the add-fingerprint containers and the index is eventually
+# consistent, an item may show up after a newer one was already loaded
+INCREMENTAL_LOAD_OVERLAP = float(settings.get('INCREMENTAL_LOAD_OVERLAP', 300))
+
+
+def _scalar(attribute_value):
+    """
+    Value of a raw DynamoDB attribute ({'S': 'kitchen'} or {'N': '-70'})
+    """
+    if 'N' in attribute_value:
+        return float(attribute_value['N'])
+    return next(iter(attribute_value.values()))
+
+
+def _timestamp(attribute_value):
+    """
+    Seconds of a timestamp key, exact to the microsecond. The digits after the
+    microseconds only tell apart the containers that wrote in the same one (see
+    add_fingerprint), a float of the whole key wouldn't keep the microsecond exact
+    """
+    seconds, _, fraction = attribute_value['N'].partition('.')
+    return int(seconds) + int(f'{fraction:0<6}'[:6]) / 1e6
+
+
+def timestamp_microseconds(timestamps):
+    return np.rint(np.asarray(timestamps, dtype=float) * 1e6).astype(np.int64)
+
+
+class FingerprintPageDecoder():
+    """
+    Decodes raw DynamoDB items straight into a preallocated RSS matrix,
+    skipping the dynamodb_json -> DataFrame round trip.
+    Both packed fingerprints and the legacy one attribute per MAC items are read.
+    With `sparse` every page is turned into a CSR matrix of RSS offsets
+    (see commons.sparse_fingerprints), only one page is dense at a time.
+    """
+
+    def __init__(self, macs, null_value, dictionaries=dictionary_store, sparse=False):
+        self.columns = {mac: column for column, mac in enumerate(macs)}
+        self.n_columns = len(macs)
+        self.null_value = null_value
+        self.sparse = sparse
+        self.dictionaries = dictionaries
+        self.dictionary_columns = {}
+
+    def __call__(self, items):
+        X = np.full((len(items), self.n_columns), self.null_value, dtype=float)
+        labels = np.empty(len(items), dtype=object)
+        timestamps = np.zeros(len(items))
+        columns = self.columns
+        packed_rows, packed_fingerprints, dictionary_versions = [], [], []
+
+        for row, item in enumerate(items):
+            if PACKED_ATTRIBUTE in item:
+                packed_rows.append(row)
+                packed_fingerprints.append(item[PACKED_ATTRIBUTE]['B'])
+                dictionary_versions.append(item[DICTIONARY_ATTRIBUTE]['S'])
+            else:
+                for attribute_name, attribute_value in item.items():
+                    column = columns.get(attribute_name)
+                    if column is not None:
+                        X[row, column] = float(attribute_value['N'])
+
+            if 'result' in item:
+                labels[row] = _scalar(item['result'])
+            if 'timestamp' in item:
+                timestamps[row] = _timestamp(item['timestamp'])
+
+        if packed_rows:
+            self.decode_packed(X, np.array(packed_rows), packed_fingerprints, dictionary_versions)
+
+        if self.sparse:
+            X = to_sparse(X, self.null_value)
+
+        return X, labels, timestamps
+
+    def get_dictionary_columns(self, version):
+        """
+        Column of every MAC of a dictionary, -1 for the ones not in this matrix
+        """
+        if version not in self.dictionary_columns:
+            self.dictionary_columns[version] = np.array(
+                [self.columns.get(mac, -1) for mac in self.dictionaries.get(version)],
+                dtype=np.intp
+            )
+        return self.dictionary_columns[version]
+
+    def decode_packed(self, X, rows, packed_fingerprints, dictionary_versions):
+        fingerprint_indexes, mac_positions, rss = unpack_readings(packed_fingerprints)
+        reading_versions = np.array(dictionary_versions)[fingerprint_indexes]
+
+        for version in set(dictionary_versions):
+            version_readings = reading_versions == version
+            reading_columns = self.get_dictionary_columns(version)[mac_positions[version_readings]]
+            known = reading_columns >= 0
+
+            X[
+                rows[fingerprint_indexes[version_readings][known]],
+                reading_columns[known]
+            ] = rss[version_readings][known]
+
+
+def merge_pages(pages, n_columns, sparse=False):
+    if not pages:
+        X = np.zeros((0, n_columns))
+        return to_sparse(X, 0) if sparse else X, np.empty(0, dtype=object), np.zeros(0)
+
+    X = concatenate_rows([page[0] for page in pages])
+    labels = np.concatenate([page[1] for page in pages])
+    timestamps = np.concatenate([page[2] for page in pages])
+
+    # Items without a label can't be used for training
+    labelled = np.array([label is not None for label in labels], dtype=bool)
+
+    return X[labelled], labels[labelled], timestamps[labelled]
+
+
+def load_fingerprints(table_name, macs, null_value, total_segments=DYNAMODB_SCAN_SEGMENTS, sparse=False):
+    """
+    Parallel scan of the fingerprints table fetching only the `macs` columns.
+    Returns the RSS matrix (one column per MAC, in order), the raw labels and the timestamps.
+    """
+    decoder = FingerprintPageDecoder(macs, null_value, sparse=sparse)
+
+    pages = parallel_scan(
+        table_name,
+        decoder,
+        total_segments=total_segments,
+        **projection_parameters(list(dict.fromkeys(macs)) + FINGERPRINT_ATTRIBUTES)
+    )
+
+    return merge_pages(pages, len(macs), sparse)
+
+
+def overlap_start(high_water_mark, overlap=INCREMENTAL_LOAD_OVERLAP):
+    """
+    First microsecond read again by an incremental load
+    """
+    return int(round(high_water_mark * 1e6)) - int(round(overlap * 1e6))
+
+
+def load_new_fingerprints(table_name, macs, null_value, start_us, sparse=False):
+    """
+    Same as load_fingerprints but only for the items written from the `start_us`
+    microsecond on, read with a Query on the timestamp index instead of a full scan
+    """
+    decoder = FingerprintPageDecoder(macs, null_value, sparse=sparse)
+
+    projection = projection_parameters(list(dict.fromkeys(macs)) + FINGERPRINT_ATTRIBUTES)
+    attribute_names = {
+        **projection.get('ExpressionAttributeNames', {}),
+        '#dataset': DATASET_ATTRIBUTE,
+        '#timestamp': 'timestamp'
+    }
+
+    pages = query_pages(
+        table_name,
+        decoder,
+        IndexName=TIME_INDEX,
+        KeyConditionExpression='#dataset = :dataset AND #timestamp >= :start',
+        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeValues={
+            ':dataset': {'S': DATASET_NAME},
+            # Exact, a float would round the microseconds
+            ':start': {'N': f'{start_us // 10 ** 6}.{start_us % 10 ** 6:06d}'}
+        },
+        **({'ProjectionExpression': projection['ProjectionExpression']} if projection else {})
+    )
+
+    return merge_pages(pages, len(macs), sparse)
+
+
+def new_rows_mask(timestamps, loaded_timestamps):
+    """
+    Mask of the rows of `timestamps` that aren't among the `loaded_timestamps` rows.
+    Rows of the same microsecond (written by different containers) are told apart by
+    count, as many of them as were loaded are taken as the loaded ones
+    """
+    keys = timestamp_microseconds(timestamps)
+    loaded_keys = np.sort(timestamp_microseconds(loaded_timestamps))
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    # Position of every row among the rows of its microsecond
+    rank = np.arange(len(keys)) - np.searchsorted(sorted_keys, sorted_keys, side='left')
+    loaded_counts = (
+        np.searchsorted(loaded_keys, sorted_keys, side='right')
+        - np.searchsorted(loaded_keys, sorted_keys, side='left')
+    )
+
+    new = np.empty(len(keys), dtype=bool)
+    new[order] = rank >= loaded_counts
+    return new
+
+
+def encode_labels(labels):
+    """
+    Vectorized label encoding, returns the numeric labels and the label mapping
+    """
+    classes, y = np.unique(labels.astype(str), return_inverse=True)
+    classes = classes.tolist()
+
+    label_mapping = {
+        'from': {label: index for index, label in enumerate(classes)},
+        'to': {index: label for index, label in enumerate(classes)}
+    }
+
+    return y, label_mapping
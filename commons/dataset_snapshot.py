@@ -0,0 +1,197 @@
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+import scipy.sparse
+
+from commons.aws.s3_helper import download_file, put_file
+from commons.sparse_fingerprints import is_sparse
+
+# Snapshot file layout (all numbers little endian):
+#   MAGIC (6 bytes) | version (uint16) | header length (uint32) | JSON header
+#   followed by the sections listed in the header, each one aligned to ALIGNMENT bytes:
+#   rss        int8    (rows, columns)  RSS readings, null_value where the MAC wasn't seen
+#   labels     int32   (rows,)          index in header['labels']
+#   timestamps float64 (rows,)
+# Sparse training sets (version 2) store the RSS as CSR instead of the rss section:
+#   rss_data    int8   (readings,)      RSS offset from null_value, 1 to 127 (see commons.sparse_fingerprints)
+#   rss_indices int32  (readings,)      column of every reading
+#   rss_indptr  int64  (rows + 1,)
+MAGIC = b'PFSNAP'
+VERSION = 2
+READABLE_VERSIONS = (1, 2)
+PREAMBLE = struct.Struct('<6sHI')
+ALIGNMENT = 64
+
+RSS_DTYPE = np.dtype('int8')
+RSS_MIN = np.iinfo(RSS_DTYPE).min
+RSS_MAX = np.iinfo(RSS_DTYPE).max
+
+SNAPSHOTS_DIR = os.path.join(tempfile.gettempdir(), 'snapshots')
+
+
+def to_rss_matrix(X, null_value):
+    """
+    Compact int8 copy of an RSS matrix, readings are small negative integers
+    """
+    if not RSS_MIN <= null_value <= RSS_MAX:
+        raise ValueError(f'FINGERPRINT_NULL_VALUE {null_value} does not fit in {RSS_DTYPE}')
+
+    X = np.asarray(X)
+    if X.dtype == RSS_DTYPE:
+        return X
+
+    return np.clip(np.rint(X), RSS_MIN, RSS_MAX).astype(RSS_DTYPE)
+
+
+def rss_sections(X, null_value):
+    """
+    The RSS sections of a dense or a sparse (RSS offsets) matrix
+    """
+    if not is_sparse(X):
+        return {'rss': to_rss_matrix(X, null_value)}
+
+    if not RSS_MIN <= null_value <= RSS_MAX:
+        raise ValueError(f'FINGERPRINT_NULL_VALUE {null_value} does not fit in {RSS_DTYPE}')
+
+    X = X.tocsr(copy=True)
+    X.data = np.rint(X.data)
+    # Offsets of 0 or less are readings at or below the null value, they weren't seen
+    X.data[X.data < 0] = 0
+    X.eliminate_zeros()
+    return {
+        'rss_data': np.clip(X.data, 1, RSS_MAX).astype(RSS_DTYPE),
+        'rss_indices': X.indices.astype('<i4'),
+        'rss_indptr': X.indptr.astype('<i8')
+    }
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(file, X, labels, timestamps, headers, null_value):
+    """
+    Write the training set to the binary `file`
+    `headers` is the MAC -> column map, `labels` the raw (string) labels
+    """
+    label_list, label_codes = np.unique(np.asarray(labels).astype(str), return_inverse=True)
+
+    sections = {
+        **rss_sections(X, null_value),
+        'labels': label_codes.astype('<i4'),
+        'timestamps': np.asarray(timestamps, dtype='<f8')
+    }
+
+    header = {
+        'rows': len(sections['timestamps']),
+        'columns': X.shape[1],
+        'headers': headers,
+        'labels': label_list.tolist(),
+        'null_value': null_value,
+        'high_water_mark': float(sections['timestamps'].max()) if len(timestamps) else 0.0
+    }
+
+    relative_offsets = {}
+    offset = 0
+    for name, array in sections.items():
+        relative_offsets[name] = offset
+        offset = _aligned(offset + array.nbytes)
+
+    # The header holds the section offsets and its length moves them,
+    # grow the data start until the header fits before it
+    data_start = 0
+    while True:
+        header['sections'] = {
+            name: {
+                'offset': data_start + relative_offsets[name],
+                'dtype': array.dtype.str,
+                'shape': array.shape
+            }
+            for name, array in sections.items()
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        required_start = _aligned(PREAMBLE.size + len(header_bytes))
+        if required_start <= data_start:
+            break
+        data_start = required_start
+
+    file.write(PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+    file.write(header_bytes)
+
+    position = PREAMBLE.size + len(header_bytes)
+    for name, array in sections.items():
+        section_offset = header['sections'][name]['offset']
+        file.write(b'\0' * (section_offset - position))
+        file.write(np.ascontiguousarray(array).tobytes())
+        position = section_offset + array.nbytes
+
+
+def open_snapshot(path):
+    """
+    Memory map a snapshot file, sections are read lazily from disk
+    """
+    with open(path, 'rb') as file:
+        magic, version, header_length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a fingerprint snapshot')
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f'Unsupported snapshot version {version}')
+        header = json.loads(file.read(header_length).decode('utf-8'))
+
+    arrays = {
+        name: np.memmap(
+            path, mode='r', dtype=np.dtype(section['dtype']),
+            offset=section['offset'], shape=tuple(section['shape'])
+        ) if np.prod(section['shape']) else np.zeros(tuple(section['shape']), dtype=np.dtype(section['dtype']))
+        for name, section in header['sections'].items()
+    }
+
+    if 'rss' in arrays:
+        X = arrays['rss']
+    else:
+        # Wraps the memory maps, nothing is read until the matrix is used
+        X = scipy.sparse.csr_matrix(
+            (arrays['rss_data'], arrays['rss_indices'], arrays['rss_indptr']),
+            shape=(header['rows'], header['columns'])
+        )
+
+    return {
+        'X': X,
+        'label_codes': arrays['labels'],
+        'labels': np.array(header['labels'], dtype=object)[arrays['labels']],
+        'label_list': header['labels'],
+        'timestamps': arrays['timestamps'],
+        'headers': header['headers'],
+        'macs': sorted(header['headers'], key=header['headers'].get),
+        'null_value': header['null_value'],
+        'high_water_mark': header['high_water_mark']
+    }
+
+
+def save_snapshot(bucket_name, key, X, labels, timestamps, headers, null_value):
+    path = os.path.join(SNAPSHOTS_DIR, key.replace('/', '_'))
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+
+    # Replaced instead of overwritten, the previous snapshot may still be memory mapped
+    with open(f'{path}.tmp', 'wb') as file:
+        write_snapshot(file, X, labels, timestamps, headers, null_value)
+    os.replace(f'{path}.tmp', path)
+
+    with open(path, 'rb') as file:
+        put_file(bucket_name, key, file.read())
+
+
+def load_snapshot(bucket_name, key):
+    """
+    Download the snapshot to /tmp and memory map it, None if there is none
+    """
+    path = os.path.join(SNAPSHOTS_DIR, key.replace('/', '_'))
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+
+    if not download_file(bucket_name, key, path):
+        return None
+
+    return open_snapshot(path)
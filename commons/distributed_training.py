@@ -0,0 +1,180 @@
+"""
+Training fanned out across lambda invocations, one train-worker per model.
+
+The coordinator uploads the train, test and validation sets of the job and invokes
+a worker per model. Every worker fits its model, uploads it as a regular model
+artifact and writes its test and validation probabilities and stats as the
+result of the job, or a failed result when it fails. The coordinator polls S3 for
+the results from within its own invocation, so its time budget still covers the
+whole training, but the memory and CPU of the fits are the workers'.
+
+The workers always refit their model from scratch, the incremental training
+(partial_fit of the new rows) only runs in the coordinator training.
+"""
+import os
+import pickle
+import time
+import uuid
+from urllib.parse import quote
+
+from commons.aws.s3_helper import get_file, put_file
+from commons.logger import logger
+from commons.settings import settings
+
+TRAIN_WORKER_FUNCTION = os.environ.get('TRAIN_WORKER_FUNCTION', 'train-worker')
+# Seconds between two checks of the results that are still missing
+TRAIN_POLL_INTERVAL = float(settings.get('TRAIN_POLL_INTERVAL', 5))
+
+# Expired by the AI bucket lifecycle rules
+JOBS_PREFIX = 'training-jobs'
+
+
+def invoke_worker(function_name, payload):
+    from commons.aws.lambda_helper import invoke_async
+
+    return invoke_async(function_name, payload)
+
+
+def result_key(job_key, model_name):
+    return f'{job_key}/results/{quote(model_name, safe="")}.pkl'
+
+
+class DistributedTraining():
+    """
+    `invoke(function_name, payload)` starts a worker, asynchronous lambda
+    invocations by default. Replacing it (or the lambda client) with an
+    in-process stand-in runs the whole flow locally.
+    """
+
+    def __init__(
+        self, bucket_name, s3_path, invoke=None,
+        function_name=TRAIN_WORKER_FUNCTION, poll_interval=TRAIN_POLL_INTERVAL
+    ):
+        self.bucket_name = bucket_name
+        self.s3_path = s3_path
+        self.invoke = invoke or invoke_worker
+        self.function_name = function_name
+        self.poll_interval = poll_interval
+
+    def submit(self, model_params, X_train, y_train, X_test, X_val, total_budget):
+        """
+        Upload the job dataset and start a worker per model, returns the job key
+        """
+        job_key = f'{JOBS_PREFIX}/{self.s3_path}/{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+        put_file(self.bucket_name, f'{job_key}/dataset.pkl', pickle.dumps({
+            'X_train': X_train,
+            'y_train': y_train,
+            'X_test': X_test,
+            'X_val': X_val
+        }, protocol=pickle.HIGHEST_PROTOCOL))
+
+        for model_name, params in model_params.items():
+            self.invoke(self.function_name, {
+                'job': job_key,
+                's3_path': self.s3_path,
+                'model_name': model_name,
+                'params': params,
+                'total_budget': total_budget
+            })
+
+        logger.info({'message': 'Distributed training started', 'job': job_key, 'models': list(model_params)})
+        return job_key
+
+    def collect(self, job_key, model_names, total_budget):
+        """
+        Wait for the results of the workers, the ones missing after `total_budget` seconds are left out
+        """
+        deadline = time.monotonic() + total_budget
+        results = {}
+
+        while True:
+            for model_name in model_names:
+                if model_name not in results:
+                    result_data = get_file(self.bucket_name, result_key(job_key, model_name))
+                    if result_data:
+                        results[model_name] = pickle.loads(result_data)
+
+            remaining = deadline - time.monotonic()
+            if len(results) == len(model_names) or remaining <= 0:
+                return results
+            time.sleep(min(self.poll_interval, remaining))
+
+    def fit(self, model_params, X_train, y_train, X_test, X_val, total_budget):
+        """
+        Fit every model of `model_params` ({model_name: hyperparameters}) in its own worker.
+        Return the ({model_name: artifact}, {model_name: stats}, {model_name: evaluation})
+        of the fitted models, an evaluation has the classes, the test and validation
+        probabilities and the inference cost (ms per row) of the model
+        """
+        start = time.monotonic()
+        job_key = self.submit(model_params, X_train, y_train, X_test, X_val, total_budget)
+        results = self.collect(job_key, list(model_params), total_budget - (time.monotonic() - start))
+
+        artifacts, stats, evaluations = {}, {}, {}
+        for model_name in model_params:
+            result = results.get(model_name)
+            if result is None:
+                logger.warning({'message': 'No result from the training worker', 'model': model_name})
+                stats[model_name] = {'status': 'timeout', 'error': 'no result from the worker'}
+                continue
+
+            stats[model_name] = result['stats']
+            if 'artifact' in result:
+                artifacts[model_name] = result['artifact']
+                evaluations[model_name] = result['evaluation']
+
+        return artifacts, stats, evaluations
+
+
+def fit_job_model(job):
+    """
+    Fit the `job['model_name']` model of the job, returns the result of the worker
+    """
+    from commons.ai_engine import AI_BUCKET, build_model, put_model_artifact
+    from commons.training_engine import TrainingEngine
+
+    model_name = job['model_name']
+    dataset = pickle.loads(get_file(AI_BUCKET, f'{job["job"]}/dataset.pkl'))
+
+    fitted_models, stats = TrainingEngine(max_workers=1, total_budget=job['total_budget']).fit(
+        {model_name: build_model(model_name, job['params'])}, dataset['X_train'], dataset['y_train']
+    )
+    result = {'stats': stats[model_name]}
+
+    if model_name in fitted_models:
+        model = fitted_models[model_name]
+
+        inference_start = time.perf_counter()
+        test_probabilities = model.predict_proba(dataset['X_test'])
+        inference_cost = (time.perf_counter() - inference_start) * 1000 / dataset['X_test'].shape[0]
+
+        result['artifact'] = put_model_artifact(job['s3_path'], model)
+        # The arguments of EvaluationEngine.add
+        result['evaluation'] = {
+            'classes': model.classes_,
+            'test_probabilities': test_probabilities,
+            'val_probabilities': model.predict_proba(dataset['X_val']),
+            'inference_cost': inference_cost
+        }
+
+    return result
+
+
+def run_worker(job):
+    """
+    Body of a train-worker invocation. A result is always written, a failed one when
+    the worker fails, so the coordinator doesn't wait for it until the deadline
+    """
+    from commons.ai_engine import AI_BUCKET
+
+    model_name = job['model_name']
+    try:
+        result = fit_job_model(job)
+    except Exception as exception:
+        logger.error({'message': 'Training worker failed', 'model': model_name, 'error': str(exception)})
+        result = {'stats': {'status': 'failed', 'error': str(exception)}}
+
+    put_file(AI_BUCKET, result_key(job['job'], model_name), pickle.dumps(result))
+
+    return {'model_name': model_name, 'status': result['stats']['status']}
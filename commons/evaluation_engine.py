@@ -0,0 +1,124 @@
+import time
+
+import numpy as np
+from sklearn.metrics import classification_report, confusion_matrix, precision_score
+
+from commons.settings import settings
+
+EVALUATION_TOP_K = int(settings.get('EVALUATION_TOP_K', 3))
+
+STACKING_ITERATIONS = 200
+STACKING_TOLERANCE = 1e-6
+# Floor of the probability of the true label, a model that's sure and wrong
+# would otherwise zero the likelihood of every mixture that uses it
+STACKING_MIN_PROBABILITY = 1e-6
+
+# Rows localized one at a time to measure the latency of a model
+LATENCY_ROWS = 20
+
+
+def row_latency(model, X, n_rows=LATENCY_ROWS):
+    """
+    Median time (ms) of a predict_proba of a single row, what localize pays per fingerprint
+    """
+    latencies = []
+    for row in range(min(n_rows, X.shape[0])):
+        start = time.perf_counter()
+        model.predict_proba(X[row:row + 1])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies)) if latencies else 0.0
+
+
+class EvaluationEngine():
+    """
+    Runs the predict_proba of every model over the test and validation sets once
+    and derives every metric from those cached matrices. Their columns are aligned
+    to the `n_classes` labels, a model that never saw a label gives it 0.
+    """
+
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.test_probabilities = {}
+        self.val_probabilities = {}
+        self.inference_costs = {}
+
+    def aligned(self, probabilities, classes):
+        aligned_probabilities = np.zeros((len(probabilities), self.n_classes))
+        aligned_probabilities[:, np.asarray(classes, dtype=int)] = probabilities
+        return aligned_probabilities
+
+    def add(self, model_name, classes, test_probabilities, val_probabilities, inference_cost):
+        """
+        Cache the results of a model evaluated somewhere else (e.g.: a training worker)
+        """
+        self.test_probabilities[model_name] = self.aligned(test_probabilities, classes)
+        self.val_probabilities[model_name] = self.aligned(val_probabilities, classes)
+        self.inference_costs[model_name] = inference_cost
+
+    def run(self, models, X_test, X_val):
+        """
+        Evaluate every model, the test set pass also measures its predict_proba time per row (ms)
+        """
+        for model_name, model in models.items():
+            start = time.perf_counter()
+            test_probabilities = model.predict_proba(X_test)
+            inference_cost = (time.perf_counter() - start) * 1000 / X_test.shape[0]
+
+            self.add(model_name, model.classes_, test_probabilities, model.predict_proba(X_val), inference_cost)
+
+        return self
+
+    def test_predictions(self, model_name):
+        return np.argmax(self.test_probabilities[model_name], axis=1)
+
+    def stacking_weights(self, y_test):
+        """
+        Weights of the mixture of the models probabilities that maximizes the likelihood
+        of the test labels (EM), scaled to add up to the number of models
+        """
+        model_names = list(self.test_probabilities)
+        rows = np.arange(len(y_test))
+        likelihoods = np.maximum(np.stack([
+            self.test_probabilities[model_name][rows, y_test] for model_name in model_names
+        ], axis=1), STACKING_MIN_PROBABILITY)
+
+        weights = np.full(len(model_names), 1 / len(model_names))
+        for _ in range(STACKING_ITERATIONS):
+            responsibilities = likelihoods * weights
+            responsibilities /= responsibilities.sum(axis=1, keepdims=True)
+            new_weights = responsibilities.mean(axis=0)
+
+            converged = np.abs(new_weights - weights).max() < STACKING_TOLERANCE
+            weights = new_weights
+            if converged:
+                break
+
+        return {
+            model_name: float(weight) * len(model_names) for model_name, weight in zip(model_names, weights)
+        }
+
+    def ensemble(self, weights):
+        """
+        Weighted average of the validation probabilities, like AIEngine.aggregate
+        """
+        probabilities = sum(
+            self.val_probabilities[model_name] * weight for model_name, weight in weights.items()
+        ) / len(weights)
+
+        return np.argmax(probabilities, axis=1), probabilities
+
+    def ensemble_stats(self, weights, y_val, labels, top_k=EVALUATION_TOP_K):
+        y_final, probabilities = self.ensemble(weights)
+        label_indexes = list(range(len(labels)))
+
+        top_k_labels = np.argsort(probabilities, axis=1)[:, ::-1][:, :top_k]
+
+        return {
+            'precision': precision_score(y_val, y_final, average='macro'),
+            'classification_report': classification_report(
+                y_val, y_final, labels=label_indexes, target_names=labels,
+                output_dict=True, zero_division=0
+            ),
+            'confusion_matrix': confusion_matrix(y_val, y_final, labels=label_indexes).tolist(),
+            f'top_{top_k}_accuracy': float((top_k_labels == np.asarray(y_val)[:, np.newaxis]).any(axis=1).mean())
+        }
@@ -0,0 +1,132 @@
+"""
+Selection of the MAC columns the models are trained with.
+
+The training ranks every column of its training rows by coverage (share of the
+fingerprints that saw the MAC), variance of the readings and mutual information
+with the label. Columns under any FEATURE_MIN_* threshold are dropped and
+FEATURE_TOP_N keeps the N most informative ones. The headers of the context only
+map the kept MACs, so the encoder builds the narrower vectors on its own.
+"""
+import numpy as np
+
+from commons.logger import logger
+from commons.settings import settings
+
+# MACs seen by fewer of the training fingerprints are dropped, the ones never seen always are
+FEATURE_MIN_COVERAGE = float(settings.get('FEATURE_MIN_COVERAGE', 0))
+# Variance of the readings (dB², the null value counts as a reading)
+FEATURE_MIN_VARIANCE = float(settings.get('FEATURE_MIN_VARIANCE', 0))
+# Mutual information (nats) between the binned readings and the label
+FEATURE_MIN_MUTUAL_INFO = float(settings.get('FEATURE_MIN_MUTUAL_INFO', 0))
+# Columns kept after the thresholds, the most informative first, 0 keeps them all
+FEATURE_TOP_N = int(settings.get('FEATURE_TOP_N', 0))
+
+# Width (dB) of the RSS bins of the mutual information, unseen is a bin of its own
+MUTUAL_INFO_RSS_BIN = int(settings.get('FEATURE_MUTUAL_INFO_RSS_BIN', 5))
+
+
+def mutual_information(joint_counts):
+    """
+    Mutual information (nats) of a (bins, classes) contingency table
+    """
+    joint = joint_counts / joint_counts.sum()
+    expected = joint.sum(axis=1, keepdims=True) * joint.sum(axis=0, keepdims=True)
+    seen = joint > 0
+    return float((joint[seen] * np.log(joint[seen] / expected[seen])).sum())
+
+
+def rank_features(X, y, null_value, rss_bin=MUTUAL_INFO_RSS_BIN):
+    """
+    Coverage, variance and mutual information with the labels `y` (indexes)
+    of every column of a dense RSS matrix or of a sparse matrix of offsets
+    """
+    from commons.sparse_fingerprints import to_sparse
+
+    # Column by column, only the readings that were seen
+    X = to_sparse(X, null_value).tocsc(copy=True)
+    # Readings at or below the null value are as good as unseen
+    X.data[X.data < 0] = 0
+    X.eliminate_zeros()
+    y = np.asarray(y)
+    n_rows, n_columns = X.shape
+    n_classes = int(y.max()) + 1 if len(y) else 1
+    class_counts = np.bincount(y, minlength=n_classes)
+
+    coverage = np.diff(X.indptr) / max(n_rows, 1)
+    variance = np.zeros(n_columns)
+    mutual_info = np.zeros(n_columns)
+
+    for column in range(n_columns):
+        start, end = X.indptr[column], X.indptr[column + 1]
+        if start == end:
+            continue
+
+        offsets = X.data[start:end].astype(float)
+        labels = y[X.indices[start:end]]
+
+        # The unseen rows are the implicit zero offsets
+        variance[column] = (offsets ** 2).sum() / n_rows - (offsets.sum() / n_rows) ** 2
+
+        bins = 1 + (offsets // rss_bin).astype(np.intp)
+        joint_counts = np.bincount(
+            bins * n_classes + labels, minlength=(bins.max() + 1) * n_classes
+        ).reshape(-1, n_classes)
+        joint_counts[0] = class_counts - np.bincount(labels, minlength=n_classes)
+        mutual_info[column] = mutual_information(joint_counts)
+
+    return {'coverage': coverage, 'variance': variance, 'mutual_info': mutual_info}
+
+
+def select_features(ranking):
+    """
+    Sorted indexes of the columns kept with the FEATURE_* settings
+    """
+    coverage, variance, mutual_info = ranking['coverage'], ranking['variance'], ranking['mutual_info']
+
+    keep = (
+        (coverage > 0)
+        & (coverage >= FEATURE_MIN_COVERAGE)
+        & (variance >= FEATURE_MIN_VARIANCE)
+        & (mutual_info >= FEATURE_MIN_MUTUAL_INFO)
+    )
+    columns = np.flatnonzero(keep)
+
+    if not len(columns):
+        # The models need at least one column, the most informative one
+        logger.warning('No MAC passes the feature selection thresholds, keeping the most informative one')
+        columns = np.array([int(np.argmax(mutual_info))])
+
+    columns = columns[np.argsort(-mutual_info[columns], kind='stable')]
+    if FEATURE_TOP_N > 0:
+        columns = columns[:FEATURE_TOP_N]
+
+    return np.sort(columns)
+
+
+def select_columns(X, columns):
+    """
+    The `columns` of a dense or sparse matrix, the matrix itself when they are all of them
+    """
+    if len(columns) == X.shape[1]:
+        return X
+    return X[:, columns]
+
+
+def selection_stats(macs, ranking, columns):
+    """
+    The kept MACs count and the ranking of the dropped ones, for the training stats
+    """
+    dropped = np.setdiff1d(np.arange(len(macs)), columns)
+
+    return {
+        'columns': len(columns),
+        'total_columns': len(macs),
+        'dropped': {
+            macs[column]: {
+                'coverage': float(ranking['coverage'][column]),
+                'variance': float(ranking['variance'][column]),
+                'mutual_info': float(ranking['mutual_info'][column])
+            }
+            for column in dropped
+        }
+    }
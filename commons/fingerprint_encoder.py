@@ -0,0 +1,96 @@
+import numpy as np
+
+# Encoders are memoized by the identity of the headers they were built from,
+# cached contexts keep the same headers dict alive between invocations
+MAX_CACHED_ENCODERS = 8
+_encoders = {}
+
+
+class FingerprintEncoder():
+    """
+    Turns raw fingerprints ({'wifi': {mac: rss}, 'bt': {mac: rss}}) into the
+    feature vectors used by the models.
+    The MAC -> column index and the null template are computed only once.
+    """
+
+    def __init__(self, headers, macs, null_value):
+        self.headers = headers
+        self.columns = {mac: headers[mac] for mac in macs if mac in headers}
+        self.null_value = null_value
+        self.template = np.full(len(headers), null_value, dtype=float)
+
+    def readings(self, raw_fingerprint):
+        """
+        Return the {column: rss} readings of the known MACs,
+        bt readings override wifi ones for the same MAC
+        """
+        columns = self.columns
+        readings = {}
+
+        for source in ('wifi', 'bt'):
+            for mac, rss in raw_fingerprint.get(source, {}).items():
+                column = columns.get(mac)
+                if column is not None:
+                    readings[column] = rss
+
+        return readings
+
+    def encode(self, raw_fingerprint):
+        fingerprint = self.template.copy()
+
+        for column, rss in self.readings(raw_fingerprint).items():
+            fingerprint[column] = rss
+
+        return fingerprint
+
+    def batch_readings(self, raw_fingerprints):
+        """
+        (rows, columns, rss) of the known readings of a list of raw fingerprints
+        """
+        rows, columns, values = [], [], []
+        for row, raw_fingerprint in enumerate(raw_fingerprints):
+            for column, rss in self.readings(raw_fingerprint).items():
+                rows.append(row)
+                columns.append(column)
+                values.append(rss)
+
+        return rows, columns, values
+
+    def encode_batch(self, raw_fingerprints):
+        fingerprints = np.tile(self.template, (len(raw_fingerprints), 1))
+
+        rows, columns, values = self.batch_readings(raw_fingerprints)
+        fingerprints[rows, columns] = values
+
+        return fingerprints
+
+    def encode_sparse(self, raw_fingerprints):
+        """
+        CSR matrix of the RSS offsets from the null value (see commons.sparse_fingerprints)
+        """
+        import scipy.sparse
+
+        from commons.sparse_fingerprints import SPARSE_DTYPE
+
+        rows, columns, values = self.batch_readings(raw_fingerprints)
+        offsets = np.array(values, dtype=SPARSE_DTYPE) - SPARSE_DTYPE(self.null_value)
+        # A reading at or below the null value means not seen
+        seen = offsets > 0
+
+        return scipy.sparse.csr_matrix(
+            (offsets[seen], (np.array(rows, dtype=np.intp)[seen], np.array(columns, dtype=np.intp)[seen])),
+            shape=(len(raw_fingerprints), len(self.template)), dtype=SPARSE_DTYPE
+        )
+
+
+def get_encoder(headers, macs, null_value):
+    key = (id(headers), null_value)
+    encoder = _encoders.get(key)
+
+    if encoder is None or encoder.headers is not headers:
+        if len(_encoders) >= MAX_CACHED_ENCODERS:
+            _encoders.clear()
+        encoder = FingerprintEncoder(headers, macs, null_value)
+        _encoders[key] = encoder
+
+    return encoder
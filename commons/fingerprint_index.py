@@ -0,0 +1,76 @@
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+from commons.fingerprint_search import FingerprintIndexSearch
+from commons.sparse_fingerprints import to_dense
+
+
+class FingerprintIndexClassifier(FingerprintIndexSearch, ClassifierMixin, BaseEstimator):
+    """
+    Nearest neighbours over an inverted index of the training fingerprints.
+
+    Every MAC keeps the training rows that observed it sorted by RSS. A query is
+    only compared with the rows that saw one of its `strong_aps` strongest MACs at
+    a similar RSS (within `rss_window` dB), at most `max_candidates` of them (the ones
+    that share the most strong MACs), so its cost grows with the number of candidates
+    instead of with the training set.
+
+    The distance ignores the MACs missing on both sides. A MAC seen on only one side
+    counts as far as its reading is above `missing_rss`: a weak AP may just not have
+    been heard, a strong one that's missing means a different place.
+
+    Sparse matrices of RSS offsets (see commons.sparse_fingerprints) are densified,
+    the index compares whole rows.
+    """
+
+    def __init__(
+        self, n_neighbors=3, weights='uniform', strong_aps=3, rss_window=10,
+        max_candidates=500, missing_rss=-90, null_value=-100
+    ):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.strong_aps = strong_aps
+        self.rss_window = rss_window
+        self.max_candidates = max_candidates
+        self.missing_rss = missing_rss
+        self.null_value = null_value
+
+    def fit(self, X, y):
+        X = np.asarray(to_dense(X, self.null_value))
+        y = np.asarray(y)
+
+        self.classes_, self.y_codes_ = np.unique(y, return_inverse=True)
+        self.class_prior_ = np.bincount(self.y_codes_, minlength=len(self.classes_)) / len(y)
+
+        # The readings are small negative integers, int8 unless the null value doesn't fit
+        rss_dtype = np.int8 if -128 <= self.null_value <= 127 else np.int16
+        # Clipped before the cast so nothing wraps around, readings below the null value
+        # weren't seen either (see commons.sparse_fingerprints)
+        self.rss_ = np.clip(np.rint(X), self.null_value, np.iinfo(rss_dtype).max).astype(rss_dtype)
+        self.n_features_in_ = X.shape[1]
+
+        # Postings of every MAC (column): its rows sorted by RSS, CSR style
+        columns_rss = np.ascontiguousarray(self.rss_.T)
+        order = np.argsort(columns_rss, axis=1, kind='stable')
+        sorted_rss = np.take_along_axis(columns_rss, order, axis=1)
+        seen = sorted_rss > self.null_value
+
+        self.postings_rows_ = order[seen].astype(np.int32)
+        self.postings_rss_ = sorted_rss[seen]
+        self.postings_indptr_ = np.concatenate([[0], np.cumsum(seen.sum(axis=1))])
+
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Add reference fingerprints, the index is rebuilt
+        """
+        if not hasattr(self, 'rss_'):
+            return self.fit(X, y)
+
+        return self.fit(
+            np.concatenate([
+                self.rss_.astype(np.int16), np.rint(np.asarray(to_dense(X, self.null_value))).astype(np.int16)
+            ]),
+            np.concatenate([self.classes_[self.y_codes_], np.asarray(y)])
+        )
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+import numpy as np
+
+from commons.aws.s3_helper import get_json, put_json
+
+AI_BUCKET = os.environ['AI_BUCKET_NAME']
+
+# MAC dictionaries (the position of every MAC) live in S3 under their version
+DICTIONARIES_PATH = 'fingerprints/dictionaries'
+
+# A packed fingerprint is the sequence of its readings, 3 bytes each:
+# the position of the MAC in the dictionary and the RSS
+READING_DTYPE = np.dtype([('mac', '<u2'), ('rss', 'i1')])
+RSS_MIN = np.iinfo(np.int8).min
+RSS_MAX = np.iinfo(np.int8).max
+
+
+def dictionary_version(macs):
+    return hashlib.sha256(','.join(macs).encode('utf-8')).hexdigest()[:16]
+
+
+def pack_readings(readings, mac_positions):
+    """
+    Pack the {mac: rss} `readings` against the {mac: position} of a dictionary
+    """
+    packed = np.zeros(len(readings), dtype=READING_DTYPE)
+    packed['mac'] = [mac_positions[mac] for mac in readings.keys()]
+    packed['rss'] = np.clip(np.rint(list(readings.values())), RSS_MIN, RSS_MAX)
+
+    return packed.tobytes()
+
+
+def unpack_readings(packed_fingerprints):
+    """
+    Vectorized decoding of many packed fingerprints, returns for every reading
+    the index of its fingerprint, its MAC position and its RSS
+    """
+    readings = np.frombuffer(b''.join(packed_fingerprints), dtype=READING_DTYPE)
+    lengths = [len(packed) // READING_DTYPE.itemsize for packed in packed_fingerprints]
+    fingerprint_indexes = np.repeat(np.arange(len(packed_fingerprints)), lengths)
+
+    return fingerprint_indexes, readings['mac'].astype(np.intp), readings['rss']
+
+
+class DictionaryStore():
+    """
+    Versioned MAC dictionaries, published once and then cached by the process
+    """
+
+    def __init__(self, bucket_name=AI_BUCKET):
+        self.bucket_name = bucket_name
+        self.dictionaries = {}
+
+    def key(self, version):
+        return f'{DICTIONARIES_PATH}/{version}.json'
+
+    def publish(self, macs):
+        version = dictionary_version(macs)
+
+        if version not in self.dictionaries:
+            if get_json(self.bucket_name, self.key(version)) is None:
+                put_json(self.bucket_name, self.key(version), {'version': version, 'macs': macs})
+            self.dictionaries[version] = list(macs)
+
+        return version
+
+    def get(self, version):
+        if version not in self.dictionaries:
+            dictionary = get_json(self.bucket_name, self.key(version))
+            if dictionary is None:
+                raise ValueError(f'Unknown MAC dictionary {version}')
+            self.dictionaries[version] = dictionary['macs']
+
+        return self.dictionaries[version]
+
+
+# Dictionaries shared by the whole process
+dictionary_store = DictionaryStore()
@@ -0,0 +1,18 @@
+import os
+
+# Attribute names of the fingerprints table, shared by the writers (add-fingerprint)
+# and the readers (commons.dataset_loader). Kept free of heavy imports, the
+# add-fingerprint cold start imports only this
+
+# Global secondary index of the fingerprints table sorted by timestamp, every
+# fingerprint is written with the same DATASET_ATTRIBUTE value as its partition key
+TIME_INDEX = os.environ.get('DYNAMODB_FINGERPRINTS_TIME_INDEX', 'by-timestamp')
+DATASET_ATTRIBUTE = 'dataset'
+DATASET_NAME = 'fingerprints'
+
+# Attributes of the packed fingerprints (see commons.fingerprint_packing)
+PACKED_ATTRIBUTE = 'rss'
+DICTIONARY_ATTRIBUTE = 'dict_version'
+
+# Attributes read for every fingerprint besides the MAC columns
+FINGERPRINT_ATTRIBUTES = ['result', 'timestamp', PACKED_ATTRIBUTE, DICTIONARY_ATTRIBUTE]
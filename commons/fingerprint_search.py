@@ -0,0 +1,87 @@
+import numpy as np
+
+from commons.sparse_fingerprints import to_dense
+
+
+class FingerprintIndexSearch():
+    """
+    Query side of the fingerprint index (see commons.fingerprint_index), it only needs
+    the fitted arrays and the parameters. Kept apart from the classifier so the
+    compiled models (see commons.compiled_models) can search without scikit-learn.
+    """
+
+    def postings(self, column, low=None, high=None):
+        start, end = self.postings_indptr_[column], self.postings_indptr_[column + 1]
+        if low is not None:
+            readings = self.postings_rss_[start:end]
+            start, end = (
+                start + np.searchsorted(readings, low, 'left'),
+                start + np.searchsorted(readings, high, 'right')
+            )
+        return self.postings_rows_[start:end]
+
+    def candidates(self, query, seen_columns):
+        """
+        Training rows that observed a strong MAC of the query at a similar RSS,
+        widened to every row that shares a MAC when there aren't enough
+        """
+        strong_columns = seen_columns[np.argsort(query[seen_columns])[::-1][:self.strong_aps]]
+
+        candidates, shared_aps = np.unique(np.concatenate([
+            self.postings(column, query[column] - self.rss_window, query[column] + self.rss_window)
+            for column in strong_columns
+        ]), return_counts=True)
+        if len(candidates) < self.n_neighbors:
+            candidates, shared_aps = np.unique(
+                np.concatenate([self.postings(column) for column in seen_columns]), return_counts=True
+            )
+
+        if len(candidates) > self.max_candidates:
+            candidates = candidates[np.argpartition(-shared_aps, self.max_candidates - 1)[:self.max_candidates]]
+
+        return candidates
+
+    def distances(self, query, query_seen, candidates):
+        rows = self.rss_[candidates].astype(np.int16)
+        rows_seen = rows > self.null_value
+
+        both = rows_seen & query_seen
+        gaps = np.where(both, rows - query, 0)
+        gaps = np.where(rows_seen & ~query_seen, np.maximum(rows - self.missing_rss, 0), gaps)
+        gaps = np.where(~rows_seen & query_seen, np.maximum(query - self.missing_rss, 0), gaps)
+
+        observed = np.maximum((rows_seen | query_seen).sum(axis=1), 1)
+        return np.sqrt((gaps.astype(float) ** 2).sum(axis=1) / observed)
+
+    def predict_proba(self, X):
+        X = np.rint(np.asarray(to_dense(X, self.null_value))).astype(np.int16)
+        probabilities = np.tile(self.class_prior_, (len(X), 1))
+
+        for row, query in enumerate(X):
+            query_seen = query > self.null_value
+            seen_columns = np.flatnonzero(query_seen)
+            if not len(seen_columns):
+                continue
+
+            candidates = self.candidates(query, seen_columns)
+            if not len(candidates):
+                continue
+
+            distances = self.distances(query, query_seen, candidates)
+            n_neighbors = min(self.n_neighbors, len(candidates))
+            nearest = np.argpartition(distances, n_neighbors - 1)[:n_neighbors]
+
+            if self.weights == 'distance':
+                neighbor_weights = 1 / (distances[nearest] + 1e-6)
+            else:
+                neighbor_weights = np.ones(n_neighbors)
+
+            votes = np.bincount(
+                self.y_codes_[candidates[nearest]], weights=neighbor_weights, minlength=len(self.classes_)
+            )
+            probabilities[row] = votes / votes.sum()
+
+        return probabilities
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
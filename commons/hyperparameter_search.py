@@ -0,0 +1,192 @@
+import hashlib
+import io
+import itertools
+import json
+
+import numpy as np
+from sklearn.metrics import balanced_accuracy_score
+from sklearn.model_selection import StratifiedKFold
+
+from commons.aws.s3_helper import get_file, get_json, put_file, put_json
+from commons.logger import logger
+from commons.settings import settings
+from commons.sparse_fingerprints import matrix_bytes
+from commons.training_engine import TrainingEngine
+
+TUNING_FOLDS = int(settings.get('TUNING_FOLDS', 5))
+TUNING_BUDGET = float(settings.get('TUNING_BUDGET', 480))
+TUNING_SEED = int(settings.get('TUNING_SEED', 0))
+
+# Values tried for every model, HYPERPARAMETER_SEARCH_SPACE (JSON) replaces
+# the space of the models it lists
+DEFAULT_SEARCH_SPACE = {
+    'Nearest Neighbors': {
+        'n_neighbors': [1, 3, 5, 7],
+        'weights': ['uniform', 'distance']
+    },
+    'Decision Tree': {
+        'max_depth': [3, 5, 8, None]
+    },
+    'Lineal SVM': {
+        'C': [0.01, 0.025, 0.1, 1]
+    },
+    'Random Forest': {
+        'max_depth': [5, 10, None],
+        'n_estimators': [10, 50],
+        'max_features': [1, 'sqrt']
+    },
+    'Neural Net': {
+        'alpha': [0.01, 0.1, 1],
+        'hidden_layer_sizes': [[100], [50, 50]]
+    },
+    'AdaBoost': {
+        'n_estimators': [50, 100],
+        'learning_rate': [0.5, 1.0]
+    },
+    'Fingerprint Index': {
+        'n_neighbors': [1, 3, 5],
+        'weights': ['uniform', 'distance'],
+        'rss_window': [6, 10, 15]
+    }
+}
+
+
+def get_search_space():
+    return {
+        **DEFAULT_SEARCH_SPACE,
+        **json.loads(settings.get('HYPERPARAMETER_SEARCH_SPACE', '{}'))
+    }
+
+
+def expand_grid(space):
+    names = sorted(space.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def config_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class FoldScore():
+    """
+    Stands in for a model in the TrainingEngine, fitting it trains the model on the
+    fold train rows and returns its Youden index on the fold test rows
+    """
+
+    def __init__(self, model, train_rows, test_rows):
+        self.model = model
+        self.train_rows = train_rows
+        self.test_rows = test_rows
+
+    def fit(self, X, y):
+        # Probability calibration (an internal CV) doesn't change predict, skip it
+        if 'probability' in self.model.get_params():
+            self.model.set_params(probability=False)
+
+        self.model.fit(X[self.train_rows], y[self.train_rows])
+        y_hat = self.model.predict(X[self.test_rows])
+
+        return balanced_accuracy_score(y[self.test_rows], y_hat, adjusted=True)
+
+
+class HyperparameterSearch():
+    """
+    Grid search with stratified k-fold cross validation run across worker processes.
+    Fold assignments and fold scores are stored in S3 by dataset hash, so repeating
+    a search over the same data only evaluates the configurations that are missing.
+    """
+
+    def __init__(
+        self, bucket_name, s3_path, build_model, search_space=None,
+        n_folds=TUNING_FOLDS, budget=TUNING_BUDGET, seed=TUNING_SEED
+    ):
+        self.bucket_name = bucket_name
+        self.s3_path = s3_path
+        self.build_model = build_model
+        self.search_space = search_space or get_search_space()
+        self.n_folds = n_folds
+        self.budget = budget
+        self.seed = seed
+
+    def cache_path(self, X, y):
+        dataset_hash = hashlib.sha256(matrix_bytes(X))
+        dataset_hash.update(np.ascontiguousarray(y).tobytes())
+        return f'{self.s3_path}/tuning/{dataset_hash.hexdigest()[:16]}-k{self.n_folds}-s{self.seed}'
+
+    def get_folds(self, cache_path, X, y):
+        """
+        Fold number of every row, read from the fold store when it exists
+        """
+        downloaded_data = get_file(self.bucket_name, f'{cache_path}/folds.npy')
+        if downloaded_data:
+            return np.load(io.BytesIO(downloaded_data))
+
+        folds = np.zeros(len(y), dtype=np.int8)
+        splitter = StratifiedKFold(n_splits=self.n_folds, shuffle=True, random_state=self.seed)
+        for fold, (_, test_rows) in enumerate(splitter.split(X, y)):
+            folds[test_rows] = fold
+
+        buffer = io.BytesIO()
+        np.save(buffer, folds)
+        put_file(self.bucket_name, f'{cache_path}/folds.npy', buffer.getvalue())
+
+        return folds
+
+    def run(self, X, y):
+        """
+        Return the best configuration of every model and the search stats
+        """
+        cache_path = self.cache_path(X, y)
+        folds = self.get_folds(cache_path, X, y)
+        scores = get_json(self.bucket_name, f'{cache_path}/scores.json') or {}
+
+        # Configuration major order, if the budget runs out the configurations
+        # evaluated so far have all their folds
+        jobs = {}
+        for model_name, space in self.search_space.items():
+            for params in expand_grid(space):
+                for fold in range(self.n_folds):
+                    job_name = f'{model_name}|{config_key(params)}|{fold}'
+                    if job_name not in scores:
+                        jobs[job_name] = FoldScore(
+                            self.build_model(model_name, params), folds != fold, folds == fold
+                        )
+
+        new_scores, _ = TrainingEngine(total_budget=self.budget).fit(jobs, X, y)
+        scores.update(new_scores)
+
+        if new_scores:
+            put_json(self.bucket_name, f'{cache_path}/scores.json', scores)
+
+        best_configurations, stats = self.best_configurations(scores)
+        stats['cached_fold_scores'] = len(scores) - len(new_scores)
+        stats['evaluated_fold_scores'] = len(new_scores)
+        stats['skipped_fold_scores'] = len(jobs) - len(new_scores)
+
+        logger.info({'message': 'Hyperparameter search finished', **stats})
+
+        return best_configurations, stats
+
+    def best_configurations(self, scores):
+        best_configurations = {}
+        stats = {'best_scores': {}}
+
+        for model_name, space in self.search_space.items():
+            best_score = None
+            for params in expand_grid(space):
+                fold_scores = [
+                    scores.get(f'{model_name}|{config_key(params)}|{fold}')
+                    for fold in range(self.n_folds)
+                ]
+                # Configurations missing a fold (failed or out of time) can't compete
+                if any(score is None for score in fold_scores):
+                    continue
+
+                mean_score = float(np.mean(fold_scores))
+                if best_score is None or mean_score > best_score:
+                    best_score = mean_score
+                    best_configurations[model_name] = params
+
+            stats['best_scores'][model_name] = best_score
+
+        return best_configurations, stats
@@ -0,0 +1,157 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from commons.logger import logger
+from commons.metrics import metrics
+from commons.settings import settings
+
+# One of 'sequential', 'thread' or 'process'
+INFERENCE_EXECUTOR = settings.get('INFERENCE_EXECUTOR', 'sequential')
+INFERENCE_WORKERS = int(settings.get('INFERENCE_WORKERS', os.cpu_count() or 1))
+# Batches smaller than this are not worth sending to other processes
+INFERENCE_PROCESS_MIN_ROWS = int(settings.get('INFERENCE_PROCESS_MIN_ROWS', 1000))
+
+
+class SequentialExecutor():
+    """
+    Runs every model in the calling thread, the cheapest option for a single row
+    """
+
+    def predict_proba(self, models, X):
+        model_results = {}
+        for model_name, model in models.items():
+            with metrics.span(f'Predict.{model_name}'):
+                model_results[model_name] = model.predict_proba(X)
+        return model_results
+
+
+class ThreadPoolInferenceExecutor():
+    """
+    Runs one model per task in a thread pool that is reused across calls
+    """
+
+    def __init__(self, max_workers=INFERENCE_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def predict_proba(self, models, X):
+        futures = {
+            model_name: self.pool.submit(self.timed_predict_proba, model_name, model, X)
+            for model_name, model in models.items()
+        }
+
+        return {model_name: future.result() for model_name, future in futures.items()}
+
+    @staticmethod
+    def timed_predict_proba(model_name, model, X):
+        with metrics.span(f'Predict.{model_name}'):
+            return model.predict_proba(X)
+
+
+# Models of the worker processes, set once per pool by _init_worker
+_worker_models = None
+
+
+def _init_worker(models):
+    global _worker_models
+    _worker_models = models
+
+
+def _predict_proba_chunk(X_chunk):
+    """
+    Worker process body, returns the probabilities and the time (ms) of every model
+    """
+    model_results = {}
+    model_times = {}
+    for model_name, model in _worker_models.items():
+        start = time.perf_counter()
+        model_results[model_name] = model.predict_proba(X_chunk)
+        model_times[model_name] = (time.perf_counter() - start) * 1000
+    return model_results, model_times
+
+
+class ProcessPoolInferenceExecutor():
+    """
+    Splits big batches by rows across a process pool. The models are sent to the
+    workers only when the pool is created, so a new set of models recreates the pool.
+    Batches under `min_rows` run sequentially.
+    """
+
+    def __init__(self, max_workers=INFERENCE_WORKERS, min_rows=INFERENCE_PROCESS_MIN_ROWS):
+        self.max_workers = max_workers
+        self.min_rows = min_rows
+        self.pool = None
+        self.pool_models = None
+
+    def get_pool(self, models):
+        models_key = [(model_name, id(model)) for model_name, model in models.items()]
+        if self.pool is None or self.pool_models != models_key:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_worker, initargs=(models,)
+            )
+            self.pool_models = models_key
+        return self.pool
+
+    def predict_proba(self, models, X):
+        from commons.sparse_fingerprints import is_sparse
+
+        if np.shape(X)[0] < self.min_rows:
+            return SequentialExecutor().predict_proba(models, X)
+
+        pool = self.get_pool(models)
+        # Contiguous row ranges, sparse matrices are sliced without densifying them
+        X = X if is_sparse(X) else np.asarray(X)
+        chunks = [
+            X[rows[0]:rows[-1] + 1]
+            for rows in np.array_split(np.arange(X.shape[0]), self.max_workers) if len(rows)
+        ]
+        chunk_results = list(pool.map(_predict_proba_chunk, chunks))
+
+        # Time spent by every model summed over the workers
+        for model_name in models.keys():
+            metrics.put(
+                f'Predict.{model_name}', sum(model_times[model_name] for _, model_times in chunk_results)
+            )
+
+        return {
+            model_name: np.concatenate([model_results[model_name] for model_results, _ in chunk_results])
+            for model_name in models.keys()
+        }
+
+
+_executors = {}
+
+
+def create_executor(mode):
+    if mode == 'sequential':
+        return SequentialExecutor()
+
+    if mode == 'thread':
+        return ThreadPoolInferenceExecutor()
+
+    if mode == 'process':
+        try:
+            # Fails where there is no /dev/shm (e.g.: AWS Lambda)
+            ProcessPoolExecutor(max_workers=1).shutdown()
+            return ProcessPoolInferenceExecutor()
+        except OSError as error:
+            logger.warning(f'Process pool not available ({error}), using a thread pool')
+            return ThreadPoolInferenceExecutor()
+
+    raise ValueError(f'Unknown inference executor "{mode}"')
+
+
+def get_executor(mode=None):
+    """
+    Return the shared executor for `mode` (INFERENCE_EXECUTOR by default)
+    """
+    mode = mode or INFERENCE_EXECUTOR
+
+    if mode not in _executors:
+        _executors[mode] = create_executor(mode)
+
+    return _executors[mode]
@@ -1,13 +1,17 @@
 import inspect
 import json
 import logging
+import os
+import random
 import traceback
 from functools import partial, wraps
 
 from pythonjsonlogger import jsonlogger
 
 # LOG_LEVEL = "INFO" if settings['STAGE'] == 'prod' else "DEBUG"
-LOG_LEVEL = "DEBUG"
+# With INFO the debug logs (e.g.: the logged decorator with truncation) are skipped
+# before serializing anything
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
 
 
 class LogFormatter(jsonlogger.JsonFormatter):
@@ -53,8 +57,17 @@ class PartnersLogger(object):
     def update_context(self, context):
         self.context.update(**context)
 
+    def is_enabled_for(self, log_level):
+        """
+        Whether a log of `log_level` would be written, check it before building expensive logs
+        """
+        if log_level == 'DEBUG':
+            # Debug logs are written as INFO when LOG_LEVEL allows them
+            return LOG_LEVEL == 'DEBUG' and self.logger.isEnabledFor(logging.INFO)
+        return self.logger.isEnabledFor(logging.getLevelName(log_level))
+
     def debug(self, msg, *args, **kwargs):
-        if LOG_LEVEL == 'DEBUG':
+        if self.is_enabled_for('DEBUG'):
             msg = self._contextualize(msg, log_level='DEBUG')
             self.logger.info(msg, *args, **kwargs)
 
@@ -97,75 +110,89 @@ class PartnersLogger(object):
 MAX_MESSAGE_LENGTH = 500
 
 
-def logged(method=None, truncate_long_messages=True):
+def _truncated(value):
+    try:
+        value_dumps = json.dumps(value)
+    except Exception:
+        return value
+
+    if len(value_dumps) > MAX_MESSAGE_LENGTH:
+        return f'{value_dumps[:MAX_MESSAGE_LENGTH]} ... truncated'
+    return value
+
+
+def logged(method=None, truncate_long_messages=True, sample_rate=1.0):
     """
     A decorator that wraps the passed in function and logs exceptions should one occur
+    The START and FINISHED logs of only a `sample_rate` fraction of the calls are written,
+    errors are always logged
     """
     # If called without method, we've been called with optional arguments.
     # We return a decorator with the optional arguments filled in.
     # Next time round we'll be decorating method.
     if method is None:
         return partial(
-            logged, truncate_long_messages=truncate_long_messages
+            logged, truncate_long_messages=truncate_long_messages, sample_rate=sample_rate
         )
 
-    @wraps(method)
-    def function(*args, **kwargs):
-        args_list = [arg for arg in args]
-        full_arg_spec = inspect.getfullargspec(method)
-        if full_arg_spec.defaults:
-            args_list.extend([default for default in full_arg_spec.defaults])
-        parameters = dict(zip(full_arg_spec.args, args_list))
-        parameters.update(kwargs)
+    # Everything that doesn't depend on the call is resolved once, when decorating
+    signature = inspect.signature(method)
+    method_name = f'{method.__name__}'
+    method_module = f"{method.__module__.replace('.', '/')}"
+    log_level = 'DEBUG' if truncate_long_messages else 'INFO'
+
+    def get_parameters(args, kwargs):
+        try:
+            bound_arguments = signature.bind(*args, **kwargs)
+        except TypeError:
+            # The call doesn't match the signature, the method itself will raise
+            return {'args': args, 'kwargs': kwargs}
+        bound_arguments.apply_defaults()
+
+        parameters = dict(bound_arguments.arguments)
         parameters.pop('self', '')
 
-        for name, value in parameters.items():
-            try:
-                value_dumps = json.dumps(value)
-            except Exception:
-                continue
+        if truncate_long_messages:
+            parameters = {name: _truncated(value) for name, value in parameters.items()}
+
+        return parameters
 
-            if truncate_long_messages and len(value_dumps) > MAX_MESSAGE_LENGTH:
-                parameters[name] = f'{value_dumps[:MAX_MESSAGE_LENGTH]} ... truncated'
+    @wraps(method)
+    def function(*args, **kwargs):
+        # Serializing the parameters and the result is the expensive part,
+        # skip it when the logs wouldn't be written
+        is_logged = (
+            (sample_rate >= 1 or random.random() < sample_rate)
+            and logger.is_enabled_for(log_level)
+        )
+        parameters = get_parameters(args, kwargs) if is_logged else None
 
         try:
-            parameters = {
-                parameter: value
-                for (parameter, value) in parameters.items()
-            }
-            method_name = f'{method.__name__}'
-            method_module = f"{method.__module__.replace('.', '/')}"
-            (logger.debug if truncate_long_messages else logger.info)({
-                "status": "START",
-                "function": method_name,
-                "module": method_module,
-                "parameters": parameters
-            })
+            if is_logged:
+                (logger.debug if truncate_long_messages else logger.info)({
+                    "status": "START",
+                    "function": method_name,
+                    "module": method_module,
+                    "parameters": parameters
+                })
+
             method_result = method(*args, **kwargs)
 
-            log_result = method_result
-            if truncate_long_messages:
-                try:
-                    result_dumps = json.dumps(log_result)
-                    if len(result_dumps) > MAX_MESSAGE_LENGTH:
-                        log_result = f'{result_dumps[:MAX_MESSAGE_LENGTH]} ... truncated'
-                except Exception:
-                    pass
-
-            (logger.debug if truncate_long_messages else logger.info)({
-                "status": "FINISHED",
-                "function": method_name,
-                "module": method_module,
-                "parameters": parameters,
-                "returns": log_result
-            })
+            if is_logged:
+                (logger.debug if truncate_long_messages else logger.info)({
+                    "status": "FINISHED",
+                    "function": method_name,
+                    "module": method_module,
+                    "parameters": parameters,
+                    "returns": _truncated(method_result) if truncate_long_messages else method_result
+                })
         except Exception as exception:
             # log the exception
             logger.error({
                 "status": "ERROR",
                 "function": method_name,
                 "module": method_module,
-                "parameters": parameters,
+                "parameters": parameters if is_logged else get_parameters(args, kwargs),
                 "type": type(exception),
                 "message": str(exception),
                 "traceback": traceback.format_exc()
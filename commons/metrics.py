@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from commons.logger import logger
+from commons.settings import settings
+
+METRICS_NAMESPACE = settings.get('METRICS_NAMESPACE', 'posifi')
+
+# CloudWatch Embedded Metric Format limits per log line
+MAX_METRICS_PER_LINE = 100
+MAX_VALUES_PER_METRIC = 100
+
+# The first invocation of a container is a cold start
+_is_cold_start = True
+_process_started_at = time.monotonic()
+
+
+class Metrics():
+    """
+    Values collected during an invocation (stage timings, counters), written at the
+    end as CloudWatch Embedded Metric Format logs. CloudWatch turns them into metrics
+    (p50, p99, ...) without calling its API.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.values = {}
+        self.units = {}
+        # Spans may end in the threads of an executor
+        self.lock = threading.Lock()
+
+    def put(self, name, value, unit='Milliseconds'):
+        with self.lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the enclosed block as the `name` metric (milliseconds)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, (time.perf_counter() - start) * 1000)
+
+    def drain(self):
+        """
+        Return the collected ({name: values}, {name: unit}) and start over
+        """
+        with self.lock:
+            values, units = self.values, self.units
+            self.values, self.units = {}, {}
+        return values, units
+
+    def flush(self, **dimensions):
+        """
+        Log the collected values tagged with the `dimensions` and start over
+        """
+        values, units = self.drain()
+
+        metric_names = list(values.keys())
+        for first_metric in range(0, len(metric_names), MAX_METRICS_PER_LINE):
+            line_metrics = metric_names[first_metric:first_metric + MAX_METRICS_PER_LINE]
+            longest = max(len(values[metric_name]) for metric_name in line_metrics)
+
+            for first_value in range(0, longest, MAX_VALUES_PER_METRIC):
+                line_values = {
+                    metric_name: values[metric_name][first_value:first_value + MAX_VALUES_PER_METRIC]
+                    for metric_name in line_metrics
+                }
+                line_values = {
+                    metric_name: metric_values
+                    for metric_name, metric_values in line_values.items() if metric_values
+                }
+
+                logger.info({
+                    '_aws': {
+                        'Timestamp': int(time.time() * 1000),
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [sorted(dimensions.keys())],
+                            'Metrics': [
+                                {'Name': metric_name, 'Unit': units[metric_name]}
+                                for metric_name in line_values.keys()
+                            ]
+                        }]
+                    },
+                    **dimensions,
+                    **line_values
+                })
+
+
+# The metrics of the running invocation, shared by the whole process
+metrics = Metrics()
+
+
+def metered(operation):
+    """
+    Decorator for the lambda handlers, times the whole invocation, marks cold and
+    warm starts and flushes the metrics of the invocation with the `operation` dimension
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def function(event, context):
+            global _is_cold_start
+
+            metrics.put('ColdStart', int(_is_cold_start), 'Count')
+            if _is_cold_start:
+                # Time from the import of this module to the first invocation
+                metrics.put('Initialization', (time.monotonic() - _process_started_at) * 1000)
+            _is_cold_start = False
+
+            try:
+                with metrics.span('Invocation'):
+                    return handler(event, context)
+            finally:
+                metrics.flush(Operation=operation, Stage=settings.get('STAGE') or 'local')
+        return function
+    return decorator
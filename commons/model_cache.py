@@ -0,0 +1,186 @@
+import hashlib
+import pickle
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+from commons.aws.s3_helper import get_file, get_file_if_modified
+from commons.logger import logger
+from commons.metrics import metrics
+from commons.settings import settings
+
+# Seconds a cached context is served without asking S3 if it changed.
+# With 0 every invocation does a conditional GET (If-None-Match)
+MODEL_CACHE_TTL = float(settings.get('MODEL_CACHE_TTL', 60))
+
+# Model artifacts are immutable (keyed by content hash), they are never revalidated
+MODEL_CACHE_MAX_MODELS = int(settings.get('MODEL_CACHE_MAX_MODELS', 24))
+
+# Process level cache, it survives between invocations of a warm container.
+# Maps the S3 key of a context (one per band) to its parsed content
+_contexts = {}
+
+# Loaded models by artifact hash, least recently used first
+_models = OrderedDict()
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'revalidations': 0,
+    'model_hits': 0,
+    'model_misses': 0
+}
+
+
+def get_context(bucket_name, key, loads=pickle.loads):
+    """
+    Return the context stored in `key` parsed with `loads`, downloading it only
+    when there is no cached copy or when S3 reports a different ETag.
+    A missing key is cached too (as None) for MODEL_CACHE_TTL seconds
+    """
+    entry = _contexts.get(key)
+    now = time.monotonic()
+
+    if entry and now - entry['checked_at'] < MODEL_CACHE_TTL:
+        _stats['hits'] += 1
+        return entry['context']
+
+    with metrics.span('ContextDownload'):
+        body, etag = get_file_if_modified(bucket_name, key, entry['etag'] if entry else None)
+
+    if entry:
+        _stats['revalidations'] += 1
+
+    if body is None and etag is not None and entry:
+        # Not modified, keep serving the cached context
+        entry['checked_at'] = now
+        _stats['hits'] += 1
+        return entry['context']
+
+    _stats['misses'] += 1
+
+    if body is None:
+        # e.g.: the manifest of a bucket that only has the legacy context,
+        # asked for before the fallback on every invocation
+        _contexts[key] = {'context': None, 'etag': None, 'checked_at': now}
+        return None
+
+    context = loads(body)
+    _contexts[key] = {
+        'context': context,
+        'etag': etag,
+        'checked_at': now
+    }
+    logger.info({'message': 'Model context loaded', 'key': key, 'etag': etag})
+
+    return context
+
+
+def load_model(bucket_name, artifact, use_cache=True):
+    """
+    Load the model of a manifest `artifact` ({'key', 'sha256'}), checking its hash.
+    Artifacts with the 'compiled' format are NumPy arrays (see commons.compiled_models)
+    """
+    sha256 = artifact['sha256']
+
+    if use_cache and sha256 in _models:
+        _models.move_to_end(sha256)
+        _stats['model_hits'] += 1
+        return _models[sha256]
+
+    with metrics.span('ModelDownload'):
+        body = get_file(bucket_name, artifact['key'])
+    if body is None or hashlib.sha256(body).hexdigest() != sha256:
+        raise ValueError(f'Model artifact {artifact["key"]} is missing or corrupted')
+
+    if artifact.get('format') == 'compiled':
+        from commons.compiled_models import loads
+
+        with metrics.span('ModelDecode'):
+            model = loads(body)
+    else:
+        with metrics.span('ModelUnpickle'):
+            model = pickle.loads(body)
+
+    if use_cache:
+        _stats['model_misses'] += 1
+        _models[sha256] = model
+        while len(_models) > MODEL_CACHE_MAX_MODELS:
+            _models.popitem(last=False)
+
+    return model
+
+
+class ModelArtifacts(MutableMapping):
+    """
+    Models of a manifest, each one is downloaded the first time it's used.
+    Iterating over the items loads all the missing ones concurrently.
+    Assigning a model replaces its artifact, it's uploaded with the next save_context.
+    """
+
+    def __init__(self, bucket_name, artifacts, use_cache=True):
+        self.bucket_name = bucket_name
+        self.artifacts = dict(artifacts)
+        self.use_cache = use_cache
+        self.models = {}
+
+    def __getitem__(self, model_name):
+        if model_name not in self.models:
+            if model_name not in self.artifacts:
+                raise KeyError(model_name)
+            self.models[model_name] = load_model(
+                self.bucket_name, self.artifacts[model_name], self.use_cache
+            )
+        return self.models[model_name]
+
+    def __setitem__(self, model_name, model):
+        self.models[model_name] = model
+        self.artifacts.pop(model_name, None)
+
+    def __delitem__(self, model_name):
+        if model_name not in self.models and model_name not in self.artifacts:
+            raise KeyError(model_name)
+        self.models.pop(model_name, None)
+        self.artifacts.pop(model_name, None)
+
+    def __contains__(self, model_name):
+        # Mapping.__contains__ would load the model
+        return model_name in self.models or model_name in self.artifacts
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self.artifacts.keys(), *self.models.keys()]))
+
+    def __len__(self):
+        return len(set(self.artifacts) | set(self.models))
+
+    def prefetch(self, model_names=None):
+        missing = [
+            model_name for model_name in (model_names or list(self))
+            if model_name not in self.models
+        ]
+        if len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                list(pool.map(self.__getitem__, missing))
+
+    def items(self):
+        self.prefetch()
+        return {model_name: self[model_name] for model_name in self}.items()
+
+    def values(self):
+        return [model for _, model in self.items()]
+
+    def unchanged_artifact(self, model_name):
+        """
+        Manifest entry of a model that wasn't replaced since it was loaded
+        """
+        return self.artifacts.get(model_name)
+
+
+def cache_stats():
+    return {**_stats, 'cached_keys': list(_contexts.keys()), 'cached_models': len(_models)}
+
+
+def clear_cache():
+    _contexts.clear()
+    _models.clear()
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from commons.settings import settings
+
+# Localizations cached per container, 0 disables the cache
+LOCALIZE_CACHE_SIZE = int(settings.get('LOCALIZE_CACHE_SIZE', 0))
+# Seconds a cached localization is served
+LOCALIZE_CACHE_TTL = float(settings.get('LOCALIZE_CACHE_TTL', 300))
+# Readings in the same bucket of this many dB share the cached localization, 1 is exact
+LOCALIZE_CACHE_RSS_BUCKET = int(settings.get('LOCALIZE_CACHE_RSS_BUCKET', 2))
+
+
+class ResultCache():
+    """
+    LRU cache of localizations keyed by the quantized fingerprint and the version of
+    the models that localized it. Each model context (band) keeps only the entries of
+    its current version, the first lookup with a new version drops the old ones.
+    """
+
+    def __init__(self, max_size=LOCALIZE_CACHE_SIZE, ttl=LOCALIZE_CACHE_TTL, rss_bucket=LOCALIZE_CACHE_RSS_BUCKET):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.rss_bucket = rss_bucket
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def quantize(self, fingerprint, null_value):
+        """
+        Bytes of the RSS buckets of a prepared fingerprint (one dense or sparse row),
+        0 for the MACs that weren't seen
+        """
+        from commons.sparse_fingerprints import to_dense
+
+        readings = np.asarray(to_dense(fingerprint, null_value), dtype=float).ravel()
+        seen = readings != null_value
+        buckets = np.where(seen, 1 + (readings - null_value) // self.rss_bucket, 0)
+
+        return buckets.astype(np.int16).tobytes()
+
+    def invalidate(self, context, version):
+        """
+        Make `version` the current one of `context`, dropping the entries of the previous one
+        """
+        if self.versions.get(context) == version:
+            return
+
+        stale = [key for key in self.entries if key[0] == context]
+        for key in stale:
+            del self.entries[key]
+        if context in self.versions:
+            self.stats['invalidations'] += 1
+        self.versions[context] = version
+
+    def get(self, key):
+        entry = self.entries.get(key)
+
+        if entry is not None and time.monotonic() - entry['cached_at'] >= self.ttl:
+            del self.entries[key]
+            self.stats['expirations'] += 1
+            entry = None
+
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return entry['result']
+
+    def put(self, key, result):
+        self.entries[key] = {'result': result, 'cached_at': time.monotonic()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.versions.clear()
+
+    def get_stats(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            'size': len(self.entries)
+        }
+
+
+# Process level, it survives between invocations of a warm container
+localize_cache = ResultCache()
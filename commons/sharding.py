@@ -0,0 +1,325 @@
+"""
+Hierarchical localization: a router picks the shard (site, floor...) of a fingerprint
+and only the small ensemble of that shard localizes it.
+
+The shard of a fingerprint is the first SHARD_DEPTH parts of its label, e.g.: with
+SHARD_DEPTH=2 the label 'hq/2/kitchen' is in the 'hq/2' shard. Every shard is a whole
+AIEngine context under ai/<band>/shards/<shard>/, the router is ai/<band>/shards.json.
+"""
+import hashlib
+import json
+import time
+
+import numpy as np
+
+from commons.ai_engine import (
+    AI_BUCKET, ENSEMBLE_WEIGHTING, FEATURE_FORMAT, FINGERPRINT_INDEX, FINGERPRINT_NULL_VALUE, AIEngine,
+    band_macs, band_s3_path
+)
+from commons.aws.s3_helper import get_file, put_json
+from commons.feature_selection import (
+    FEATURE_MIN_COVERAGE, FEATURE_MIN_MUTUAL_INFO, FEATURE_MIN_VARIANCE, FEATURE_TOP_N, MUTUAL_INFO_RSS_BIN
+)
+from commons.fingerprint_encoder import get_encoder
+from commons.logger import logged, logger
+from commons.metrics import metrics
+from commons.model_cache import get_context
+from commons.settings import settings
+
+# Label parts that make the shard, 0 keeps the single context per band
+SHARD_DEPTH = int(settings.get('SHARD_DEPTH', 0))
+SHARD_SEPARATOR = settings.get('SHARD_SEPARATOR', '/')
+
+ROUTER_VERSION = 1
+
+
+def shard_of(label, depth=SHARD_DEPTH, separator=SHARD_SEPARATOR):
+    return separator.join(str(label).split(separator)[:depth])
+
+
+def shard_data_hash(X, labels, timestamps, hyperparameters=None):
+    """
+    Hash of the rows of a shard, of its tuned `hyperparameters` and of the settings
+    its models depend on, the shard is only retrained when it changes
+    """
+    from commons.sparse_fingerprints import matrix_bytes
+
+    data_hash = hashlib.sha256(matrix_bytes(X))
+    data_hash.update(np.asarray(labels).astype(str).tobytes())
+    data_hash.update(np.asarray(timestamps, dtype=float).tobytes())
+    data_hash.update(json.dumps({
+        'feature_format': FEATURE_FORMAT,
+        'fingerprint_index': FINGERPRINT_INDEX,
+        'ensemble_weighting': ENSEMBLE_WEIGHTING,
+        'feature_selection': [
+            FEATURE_MIN_COVERAGE,
+            FEATURE_MIN_VARIANCE,
+            FEATURE_MIN_MUTUAL_INFO,
+            FEATURE_TOP_N,
+            MUTUAL_INFO_RSS_BIN
+        ],
+        'hyperparameters': hyperparameters or {}
+    }, sort_keys=True).encode())
+    return data_hash.hexdigest()
+
+
+class ShardRouter():
+    """
+    AP set lookup: Bernoulli naive Bayes over which MACs a fingerprint saw.
+    Every shard keeps how many of its fingerprints saw every MAC, a shard whose
+    fingerprints always hear an AP the query didn't see is unlikely.
+    """
+
+    def __init__(self, headers, shards, rows, seen_counts):
+        self.headers = headers
+        self.shards = shards
+        self.rows = np.asarray(rows, dtype=float)
+        self.seen_counts = seen_counts
+
+        shard_seen = np.zeros((len(shards), len(headers)))
+        for index, counts in enumerate(seen_counts):
+            for column, count in counts.items():
+                shard_seen[index, int(column)] = count
+
+        # Laplace smoothed probability of seeing every MAC in every shard
+        seen_probability = (shard_seen + 1) / (self.rows[:, np.newaxis] + 2)
+        log_seen = np.log(seen_probability)
+        log_missing = np.log1p(-seen_probability)
+
+        self.base_scores = np.log(self.rows / self.rows.sum()) + log_missing.sum(axis=1)
+        self.seen_scores = log_seen - log_missing
+
+    @classmethod
+    def fit(cls, headers, X, shard_names, shards):
+        """
+        Router of the `shards` (names), `shard_names` is the shard of every row of X
+        """
+        from commons.sparse_fingerprints import is_sparse
+
+        # Sparse matrices only store the readings of the MACs that were seen
+        seen = (X != 0) if is_sparse(X) else (np.asarray(X) != FINGERPRINT_NULL_VALUE)
+
+        rows, seen_counts = [], []
+        for shard in shards:
+            shard_rows = shard_names == shard
+            counts = np.asarray(seen[shard_rows].sum(axis=0)).ravel()
+            rows.append(int(shard_rows.sum()))
+            seen_counts.append({str(column): int(counts[column]) for column in np.flatnonzero(counts)})
+
+        return cls(headers, list(shards), rows, seen_counts)
+
+    def route(self, readings_list):
+        """
+        Shard of every fingerprint, given as {column: rss} readings
+        """
+        shards = []
+        for readings in readings_list:
+            columns = list(readings.keys())
+            scores = self.base_scores + self.seen_scores[:, columns].sum(axis=1)
+            shards.append(self.shards[int(np.argmax(scores))])
+        return shards
+
+    def to_json(self):
+        return {
+            'headers': self.headers,
+            'shards': self.shards,
+            'rows': self.rows.astype(int).tolist(),
+            'seen_counts': self.seen_counts
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['headers'], data['shards'], data['rows'], data['seen_counts'])
+
+
+def parse_router(router_data):
+    return json.loads(router_data)
+
+
+class ShardedEngine():
+    """
+    Same interface as AIEngine for the lambda handlers, with one ensemble per shard.
+    Only the shards that localize something are loaded.
+    """
+
+    def __init__(self, is_5ghz=True, use_cache=False, compiled=False):
+        self.is_5ghz = is_5ghz
+        self.use_cache = use_cache
+        self.compiled = compiled
+        self.ai_s3_path = band_s3_path(is_5ghz)
+
+        if use_cache:
+            saved_data = get_context(AI_BUCKET, self.router_key, loads=parse_router)
+        else:
+            downloaded_data = get_file(AI_BUCKET, self.router_key)
+            saved_data = parse_router(downloaded_data) if downloaded_data else None
+
+        # {shard: {'labels', 'rows', 'data_hash'}} of the trained shards
+        self.shards = saved_data['shards'] if saved_data else {}
+        self.router = ShardRouter.from_json(saved_data['router']) if saved_data else None
+        self.engines = {}
+
+    @property
+    def router_key(self):
+        return f'{self.ai_s3_path}/shards.json'
+
+    def shard_engine(self, shard):
+        """
+        Engine of a shard, None for the shards with a single label that need no models
+        """
+        if len(self.shards[shard]['labels']) < 2:
+            return None
+
+        if shard not in self.engines:
+            with metrics.span('LoadShard'):
+                self.engines[shard] = AIEngine(self.is_5ghz, self.use_cache, shard=shard, compiled=self.compiled)
+        return self.engines[shard]
+
+    def route(self, raw_fingerprints):
+        if self.router is None:
+            raise RuntimeError('There are no trained shards yet')
+
+        encoder = get_encoder(self.router.headers, band_macs(self.is_5ghz), FINGERPRINT_NULL_VALUE)
+        with metrics.span('Route'):
+            return self.router.route([encoder.readings(raw_fingerprint) for raw_fingerprint in raw_fingerprints])
+
+    def prepare_fingerprint(self, raw_fingerprint):
+        shard = self.route([raw_fingerprint])[0]
+        engine = self.shard_engine(shard)
+
+        return shard, engine.prepare_fingerprint(raw_fingerprint) if engine else None
+
+    def prepare_fingerprints(self, raw_fingerprints):
+        """
+        The fingerprints grouped by shard, {shard: (row indexes, prepared fingerprints)}
+        """
+        shards = np.array(self.route(raw_fingerprints), dtype=object)
+
+        prepared = {}
+        for shard in dict.fromkeys(shards):
+            rows = np.flatnonzero(shards == shard)
+            engine = self.shard_engine(shard)
+            prepared[shard] = (
+                rows,
+                engine.prepare_fingerprints([raw_fingerprints[row] for row in rows]) if engine else None
+            )
+        return prepared
+
+    def single_label_result(self, shard):
+        label = self.shards[shard]['labels'][0]
+        return label, {label: 1.0}
+
+    @logged
+    def localize_fingerprint(self, prepared_fingerprint):
+        shard, fingerprint = prepared_fingerprint
+        engine = self.shard_engine(shard)
+        if engine is None:
+            return self.single_label_result(shard)
+
+        return engine.localize_fingerprint(fingerprint)
+
+    @logged
+    def localize_fingerprints(self, prepared_fingerprints):
+        n_rows = sum(len(rows) for rows, _ in prepared_fingerprints.values())
+        localizations = [None] * n_rows
+
+        for shard, (rows, fingerprints) in prepared_fingerprints.items():
+            engine = self.shard_engine(shard)
+            if engine is None:
+                shard_localizations = [self.single_label_result(shard)] * len(rows)
+            else:
+                shard_localizations = engine.localize_fingerprints(fingerprints)
+
+            for row, localization in zip(rows, shard_localizations):
+                localizations[row] = localization
+
+        return localizations
+
+    @logged
+    def train(self, full_rescan=False, tune=False, distributed=False, invoke=None):
+        """
+        Load the fingerprints once, retrain the shards whose rows changed and
+        rebuild the router. All the shards share one TRAIN_TOTAL_BUDGET, the ones
+        that fail or don't fit in it keep their previous models and are retrained
+        by the next training.
+        `distributed` fans out the models of every shard (see AIEngine.train).
+        """
+        from commons.dataset_snapshot import save_snapshot
+        from commons.training_engine import TRAIN_TOTAL_BUDGET
+
+        deadline = time.monotonic() + TRAIN_TOTAL_BUDGET
+        band_engine = AIEngine(self.is_5ghz)
+
+        with metrics.span('LoadDataset'):
+            X, raw_y, timestamps, _ = band_engine.load_dataset(full_rescan)
+        headers = band_engine.create_headers(band_engine.filtered_macs)
+        shard_names = np.array([shard_of(label) for label in raw_y], dtype=object)
+
+        shards = {}
+        trained_shards = 0
+        for shard in sorted(set(shard_names)):
+            rows = shard_names == shard
+            shard_dataset = (X[rows], raw_y[rows], timestamps[rows])
+            labels = sorted(set(np.asarray(raw_y[rows]).astype(str)))
+            # Single label shards have no models
+            engine = AIEngine(self.is_5ghz, shard=shard) if len(labels) > 1 else None
+            hyperparameters = engine.hyperparameters if engine else None
+            data_hash = shard_data_hash(*shard_dataset, hyperparameters)
+            previous = self.shards.get(shard)
+
+            if not tune and previous and previous['data_hash'] == data_hash:
+                shards[shard] = previous
+                continue
+
+            if engine:
+                if time.monotonic() > deadline:
+                    logger.warning({'message': 'No time left to train the shard', 'shard': shard})
+                    if previous:
+                        shards[shard] = previous
+                    continue
+
+                try:
+                    engine.train(
+                        tune=tune, dataset=shard_dataset, distributed=distributed, invoke=invoke,
+                        deadline=deadline
+                    )
+                except Exception as exception:
+                    logger.error({'message': 'Shard training failed', 'shard': shard, 'error': str(exception)})
+                    if previous:
+                        shards[shard] = previous
+                    continue
+                trained_shards += 1
+
+                if engine.hyperparameters != hyperparameters:
+                    # Tuning changed them, hash what the next training will compare with
+                    data_hash = shard_data_hash(*shard_dataset, engine.hyperparameters)
+
+            shards[shard] = {'labels': labels, 'rows': int(rows.sum()), 'data_hash': data_hash}
+
+        metrics.put('ShardsTrained', trained_shards, 'Count')
+        metrics.put('Shards', len(shards), 'Count')
+        if not shards:
+            raise RuntimeError('No shard could be trained')
+
+        self.shards = shards
+        self.router = ShardRouter.fit(headers, X, shard_names, list(shards))
+        put_json(AI_BUCKET, self.router_key, {
+            'version': ROUTER_VERSION,
+            'shards': self.shards,
+            'router': self.router.to_json()
+        })
+
+        with metrics.span('SaveSnapshot'):
+            save_snapshot(
+                AI_BUCKET, band_engine.snapshot_key, X, raw_y, timestamps, headers, FINGERPRINT_NULL_VALUE
+            )
+
+
+def create_engine(is_5ghz=True, use_cache=False, compiled=False):
+    """
+    The sharded engine when SHARD_DEPTH is set, the single context AIEngine otherwise.
+    `compiled` engines localize with the compiled models, they can't train
+    """
+    if SHARD_DEPTH > 0:
+        return ShardedEngine(is_5ghz, use_cache, compiled)
+    return AIEngine(is_5ghz, use_cache, compiled=compiled)
@@ -0,0 +1,76 @@
+"""
+Sparse (CSR) fingerprint matrices.
+
+A scan only sees a few of the whitelisted MACs, most of a dense matrix is the null
+value padding. The sparse matrices store the RSS offset from the null value
+(rss - null_value) so the MACs that weren't seen are the implicit zeros. Readings at
+or below the null value count as not seen too, the stored offsets are always positive.
+Distances and tree splits over the offsets are the same as over the dense readings.
+"""
+import numpy as np
+import scipy.sparse
+
+# float32 is what the sklearn trees work with, and the integer offsets are exact in it
+SPARSE_DTYPE = np.float32
+
+
+def is_sparse(X):
+    return scipy.sparse.issparse(X)
+
+
+def to_sparse(X, null_value, dtype=SPARSE_DTYPE):
+    """
+    CSR matrix of the offsets from `null_value` of a dense RSS matrix
+    """
+    if is_sparse(X):
+        return X.tocsr().astype(dtype, copy=False)
+
+    X = np.asarray(X)
+    rows, columns = np.nonzero(X > null_value)
+    offsets = X[rows, columns].astype(dtype) - dtype(null_value)
+
+    return scipy.sparse.csr_matrix((offsets, (rows, columns)), shape=X.shape, dtype=dtype)
+
+
+def to_dense(X, null_value, dtype=float):
+    """
+    Dense RSS matrix, `null_value` where the MAC wasn't seen, of a sparse matrix of offsets.
+    Dense matrices are returned as they are.
+    """
+    if not is_sparse(X):
+        return X
+
+    X = X.tocsr()
+    dense = np.full(X.shape, null_value, dtype=dtype)
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    dense[rows, X.indices] = X.data + null_value
+
+    return dense
+
+
+def concatenate_rows(matrices):
+    """
+    np.concatenate for dense matrices, vstack for sparse ones
+    """
+    if any(is_sparse(matrix) for matrix in matrices):
+        return scipy.sparse.vstack(matrices, format='csr')
+    return np.concatenate(matrices)
+
+
+def matrix_nbytes(X):
+    if is_sparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return np.asarray(X).nbytes
+
+
+def matrix_bytes(X):
+    """
+    Raw bytes of the matrix contents, to hash it
+    """
+    if is_sparse(X):
+        X = X.tocsr()
+        X.sort_indices()
+        return b''.join(
+            np.ascontiguousarray(array).tobytes() for array in (X.data, X.indices, X.indptr)
+        ) + repr(X.shape).encode()
+    return np.ascontiguousarray(X).tobytes()
@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+import resource
+import time
+from multiprocessing.connection import wait
+
+from commons.logger import logger
+from commons.settings import settings
+
+# Wall clock limits in seconds, the train-models lambda times out at 900
+TRAIN_MODEL_TIMEOUT = float(settings.get('TRAIN_MODEL_TIMEOUT', 300))
+TRAIN_TOTAL_BUDGET = float(settings.get('TRAIN_TOTAL_BUDGET', 780))
+TRAIN_WORKERS = int(settings.get('TRAIN_WORKERS', os.cpu_count() or 1))
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _fit_model(connection, model, X_train, y_train):
+    """
+    Worker process body, sends back the fitted model or the error
+    """
+    # The forked child starts with the parent's RSS, the peak is reported as growth over it
+    start_rss = _max_rss_mb()
+    start = time.perf_counter()
+    try:
+        fitted_model = model.fit(X_train, y_train)
+        connection.send({
+            'model': fitted_model,
+            'fit_time': time.perf_counter() - start,
+            'peak_memory_mb': _max_rss_mb() - start_rss
+        })
+    except Exception as exception:
+        connection.send({'error': f'{type(exception).__name__}: {exception}'})
+    finally:
+        connection.close()
+
+
+class PartialFit():
+    """
+    Stands in for an already fitted model that supports incremental learning,
+    fitting it updates the model with the new rows only
+    """
+
+    def __init__(self, model, X_new, y_new):
+        self.model = model
+        self.X_new = X_new
+        self.y_new = y_new
+
+    def fit(self, X_train, y_train):
+        if self.X_new.shape[0]:
+            self.model.partial_fit(self.X_new, self.y_new)
+        return self.model
+
+
+class TrainingEngine():
+    """
+    Fits models concurrently, one worker process per model.
+    Models that fail, exceed `model_timeout` or can't start before `total_budget`
+    runs out are left out of the result instead of failing the whole training.
+    Processes and pipes are used instead of a ProcessPoolExecutor because
+    AWS Lambda has no /dev/shm (needed by the pool semaphores) and because a
+    stuck fit must be killable.
+    """
+
+    def __init__(
+        self, max_workers=TRAIN_WORKERS, model_timeout=TRAIN_MODEL_TIMEOUT,
+        total_budget=TRAIN_TOTAL_BUDGET
+    ):
+        self.max_workers = max(1, max_workers)
+        self.model_timeout = model_timeout
+        self.total_budget = total_budget
+        self.mp_context = multiprocessing.get_context('fork')
+
+    def fit(self, models, X_train, y_train):
+        """
+        Return a ({model_name: fitted_model}, {model_name: stats}) tuple
+        """
+        deadline = time.monotonic() + self.total_budget
+        pending = list(models.items())
+        running = {}
+        fitted_models = {}
+        stats = {}
+
+        while pending or running:
+            while pending and len(running) < self.max_workers:
+                model_name, model = pending.pop(0)
+                if time.monotonic() >= deadline:
+                    stats[model_name] = {'status': 'skipped'}
+                    continue
+
+                receiver, sender = self.mp_context.Pipe(duplex=False)
+                process = self.mp_context.Process(
+                    target=_fit_model, args=(sender, model, X_train, y_train), daemon=True
+                )
+                process.start()
+                sender.close()
+                running[receiver] = (model_name, process, time.monotonic())
+
+            if not running:
+                break
+
+            next_timeout = min(
+                min(started + self.model_timeout for _, _, started in running.values()),
+                deadline
+            )
+            ready = wait(list(running.keys()), timeout=max(0, next_timeout - time.monotonic()))
+
+            for receiver in ready:
+                model_name, process, started = running.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    result = {'error': 'worker died without a result'}
+                receiver.close()
+                process.join()
+
+                if 'error' in result:
+                    logger.error({'message': 'Model training failed', 'model': model_name, 'error': result['error']})
+                    stats[model_name] = {
+                        'status': 'failed',
+                        'error': result['error'],
+                        'exitcode': process.exitcode
+                    }
+                    continue
+
+                fitted_models[model_name] = result.pop('model')
+                stats[model_name] = {'status': 'fitted', **result}
+
+            now = time.monotonic()
+            for receiver, (model_name, process, started) in list(running.items()):
+                if now - started >= self.model_timeout or now >= deadline:
+                    process.terminate()
+                    process.join()
+                    receiver.close()
+                    del running[receiver]
+                    logger.warning({'message': 'Model training timed out', 'model': model_name})
+                    stats[model_name] = {'status': 'timeout', 'fit_time': now - started}
+
+        return fitted_models, stats
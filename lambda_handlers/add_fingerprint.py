@@ -1,29 +1,94 @@
 import json
+import random
+import threading
 import time
 import os
+from decimal import Decimal
 
-from commons.aws.dynamodb_helper import add_element_to_table
+from commons.aws.dynamodb_helper import add_element_to_table, batch_add_elements_to_table
+from commons.fingerprint_schema import (
+    DATASET_ATTRIBUTE, DATASET_NAME, DICTIONARY_ATTRIBUTE, PACKED_ATTRIBUTE
+)
 from commons.logger import logged, logger
+from commons.metrics import metered, metrics
 from commons.settings import settings
 
 DYNAMO_TABLE = os.environ['DYNAMODB_FINGERPRINTS']
 
 MAC_WHITELIST = settings['MAC_WHITELIST'].split(',')
+WHITELISTED_MACS = set(MAC_WHITELIST)
 
+MAX_BATCH_SIZE = int(settings.get('FINGERPRINT_MAX_BATCH_SIZE', 1000))
 
+# 'attributes' stores every MAC as its own attribute,
+# 'packed' stores all the readings in one binary attribute (see commons.fingerprint_packing)
+FINGERPRINT_STORAGE = settings.get('FINGERPRINT_STORAGE', 'attributes')
+MAC_POSITIONS = {mac: position for position, mac in enumerate(MAC_WHITELIST)}
+
+# The table is keyed only on the timestamp, so every fingerprint gets a different one:
+# microseconds never repeated inside a container, followed by digits every container
+# picks at random, so containers writing in the same microseconds don't overwrite each other.
+# The readers parse the timestamps as floats, the extra digits only matter to the key
+CONTAINER_DIGITS = f'{random.randrange(10 ** 6):06d}'
+_last_timestamp_us = 0
+_timestamp_lock = threading.Lock()
+
+
+def new_timestamps(count):
+    global _last_timestamp_us
+
+    with _timestamp_lock:
+        first_timestamp_us = max(int(time.time() * 1e6), _last_timestamp_us + 1)
+        _last_timestamp_us = first_timestamp_us + count - 1
+
+    return [
+        Decimal(f'{timestamp_us // 10 ** 6}.{timestamp_us % 10 ** 6:06d}{CONTAINER_DIGITS}')
+        for timestamp_us in range(first_timestamp_us, first_timestamp_us + count)
+    ]
+
+
+def build_fingerprint(body):
+    """
+    Whitelisted readings of a request body plus its label, None if it can't be used
+    """
+    unfiltered_fingerprint = dict(body.get('wifi', {}))
+    unfiltered_fingerprint.update(body.get('bt', {}))
+
+    fingerprint = {mac: rss for mac, rss in unfiltered_fingerprint.items() if mac in WHITELISTED_MACS}
+
+    if not fingerprint or 'result' not in body:
+        return None
+
+    if FINGERPRINT_STORAGE == 'packed':
+        # Only the packed storage needs numpy
+        from commons.fingerprint_packing import dictionary_store, pack_readings
+
+        fingerprint = {
+            PACKED_ATTRIBUTE: pack_readings(fingerprint, MAC_POSITIONS),
+            DICTIONARY_ATTRIBUTE: dictionary_store.publish(MAC_WHITELIST)
+        }
+
+    fingerprint['result'] = body['result']
+    # Partition key of the timestamp index used by the incremental training
+    fingerprint[DATASET_ATTRIBUTE] = DATASET_NAME
+
+    return fingerprint
+
+
+@metered('add-fingerprint')
 @logged(truncate_long_messages=False)
 def run(event, context):
     """
     This lambda will add a fingerprint to the DynamoDB table
     Where the train data is stored.
+    Many labelled fingerprints can be sent at once in the `fingerprints` list.
     """
     body = json.loads(event['body'])
-    current_timestamp = int(time.time())
 
-    unfiltered_fingerprint = body.get('wifi', {})
-    unfiltered_fingerprint.update(body.get('bt', {}))
+    if 'fingerprints' in body:
+        return run_bulk(body['fingerprints'])
 
-    fingerprint = {mac:rss for mac,rss in unfiltered_fingerprint.items() if mac in MAC_WHITELIST}
+    fingerprint = build_fingerprint(body)
 
     if not fingerprint:
         return {
@@ -33,10 +98,10 @@ def run(event, context):
             'statusCode': 400
         }
 
-    fingerprint['timestamp'] = current_timestamp
-    fingerprint['result'] = body['result']
+    fingerprint['timestamp'] = new_timestamps(1)[0]
 
-    add_element_to_table(DYNAMO_TABLE, fingerprint)
+    with metrics.span('Write'):
+        add_element_to_table(DYNAMO_TABLE, fingerprint)
 
     return {
         'body': json.dumps({
@@ -44,3 +109,42 @@ def run(event, context):
         }),
         'statusCode': 200
     }
+
+
+def run_bulk(bodies):
+    if not isinstance(bodies, list) or not bodies or len(bodies) > MAX_BATCH_SIZE:
+        return {
+            'body': json.dumps({
+                'message': f'fingerprints must be a list of 1 to {MAX_BATCH_SIZE} items'
+            }),
+            'statusCode': 400
+        }
+
+    fingerprints = []
+    rejected = []
+    for index, body in enumerate(bodies):
+        fingerprint = build_fingerprint(body) if isinstance(body, dict) else None
+        if fingerprint:
+            fingerprints.append(fingerprint)
+        else:
+            rejected.append(index)
+
+    for fingerprint, timestamp in zip(fingerprints, new_timestamps(len(fingerprints))):
+        fingerprint['timestamp'] = timestamp
+
+    metrics.put('BatchSize', len(bodies), 'Count')
+
+    with metrics.span('Write'):
+        failed = batch_add_elements_to_table(DYNAMO_TABLE, fingerprints)
+    if failed:
+        logger.error({'message': 'Fingerprints left unprocessed', 'failed': failed})
+
+    return {
+        'body': json.dumps({
+            'accepted': len(fingerprints) - failed,
+            'rejected': len(rejected),
+            'rejected_items': rejected,
+            'failed': failed
+        }),
+        'statusCode': 200 if len(fingerprints) > failed else 400
+    }
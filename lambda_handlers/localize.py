@@ -1,23 +1,41 @@
 import json
 
-from commons.logger import logged
-from commons.ai_engine import AIEngine
+from commons.ai_engine import COMPILED_INFERENCE
+from commons.logger import logged, logger
+from commons.metrics import metered, metrics
+from commons.model_cache import cache_stats
+from commons.result_cache import localize_cache
+from commons.settings import settings
+from commons.sharding import create_engine
 
+MAX_BATCH_SIZE = int(settings.get('LOCALIZE_MAX_BATCH_SIZE', 500))
+
+
+@metered('localize')
 @logged(truncate_long_messages=False)
 def run(event, context):
     """
     This lambda will use a fingerprint to locate
     where an user is located.
+    A batch can be sent in the `fingerprints` list, each item
+    with its own `wifi`, `bt` and an optional `id`.
     """
 
     body = json.loads(event['body'])
     has_5_ghz = body.get('has_5_ghz', False)
 
-    ai_engine = AIEngine(has_5_ghz)
+    with metrics.span('LoadContext'):
+        ai_engine = create_engine(has_5_ghz, use_cache=True, compiled=COMPILED_INFERENCE)
+    logger.info({'model_cache': cache_stats(), 'result_cache': localize_cache.get_stats()})
+
+    if 'fingerprints' in body:
+        return run_batch(ai_engine, body['fingerprints'])
 
-    fingeprint = ai_engine.prepare_fingerprint(body)
+    with metrics.span('PrepareFingerprint'):
+        fingeprint = ai_engine.prepare_fingerprint(body)
 
-    location_label, probabilities = ai_engine.localize_fingerprint(fingeprint)
+    with metrics.span('Localize'):
+        location_label, probabilities = ai_engine.localize_fingerprint(fingeprint)
 
     return {
         'body': json.dumps({
@@ -26,3 +44,55 @@ def run(event, context):
         }),
         'statusCode': 200
     }
+
+
+def run_batch(ai_engine, raw_fingerprints):
+    if not isinstance(raw_fingerprints, list) or not raw_fingerprints:
+        return {
+            'body': json.dumps({
+                'message': 'fingerprints must be a non empty list'
+            }),
+            'statusCode': 400
+        }
+
+    if len(raw_fingerprints) > MAX_BATCH_SIZE:
+        return {
+            'body': json.dumps({
+                'message': f'At most {MAX_BATCH_SIZE} fingerprints can be sent per request'
+            }),
+            'statusCode': 400
+        }
+
+    for index, raw_fingerprint in enumerate(raw_fingerprints):
+        if not isinstance(raw_fingerprint, dict):
+            return {
+                'body': json.dumps({
+                    'message': f'fingerprints[{index}] must be an object'
+                }),
+                'statusCode': 400
+            }
+
+    metrics.put('BatchSize', len(raw_fingerprints), 'Count')
+
+    with metrics.span('PrepareFingerprint'):
+        fingerprints = ai_engine.prepare_fingerprints(raw_fingerprints)
+
+    with metrics.span('Localize'):
+        localizations = ai_engine.localize_fingerprints(fingerprints)
+
+    results = [
+        {
+            'id': raw_fingerprint.get('id', index),
+            'location': location_label,
+            'probabilities': probabilities
+        }
+        for index, (raw_fingerprint, (location_label, probabilities))
+        in enumerate(zip(raw_fingerprints, localizations))
+    ]
+
+    return {
+        'body': json.dumps({
+            'results': results
+        }),
+        'statusCode': 200
+    }
@@ -1,8 +1,10 @@
 import json
 
 from commons.logger import logged
-from commons.ai_engine import AIEngine
+from commons.metrics import metered, metrics
+from commons.sharding import create_engine
 
+@metered('train-models')
 @logged(truncate_long_messages=False)
 def run(event, context):
     """
@@ -15,6 +17,13 @@ def run(event, context):
         body = event['body']
         
     has_5_ghz = body.get('has_5_ghz', False)
+    # By default only the fingerprints added since the last training are read
+    full_rescan = body.get('full_rescan', False)
+    # Cross validated search of the models hyperparameters before training
+    tune = body.get('tune', False)
+    # Every model fitted by its own train-worker invocation
+    distributed = body.get('distributed', False)
 
-    ai_engine = AIEngine(has_5_ghz)
-    ai_engine.train()
\ No newline at end of file
+    with metrics.span('LoadContext'):
+        ai_engine = create_engine(has_5_ghz)
+    ai_engine.train(full_rescan=full_rescan, tune=tune, distributed=distributed)
\ No newline at end of file
@@ -0,0 +1,14 @@
+from commons.distributed_training import run_worker
+from commons.logger import logged
+from commons.metrics import metered
+
+
+@metered('train-worker')
+@logged(truncate_long_messages=False)
+def run(event, context):
+    """
+    This lambda will train one model of a distributed training,
+    started by train-models with `distributed` set.
+    """
+
+    return run_worker(event)
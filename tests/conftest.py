@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+# Module level settings of commons read these on import
+os.environ.setdefault('AI_BUCKET_NAME', 'test-ai')
+os.environ.setdefault('DYNAMODB_FINGERPRINTS', 'test-fingerprints')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+@pytest.fixture
+def local_aws():
+    """
+    Fresh in-process S3 and DynamoDB (see useful_scripts.local_aws) and empty model caches
+    """
+    from commons.model_cache import clear_cache
+    from useful_scripts.local_aws import install
+
+    clear_cache()
+    yield install()
+    clear_cache()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from commons import ai_engine
+from commons.ai_engine import TEST_SIZE, VALIDATION_SIZE, build_models, mix_keys, split_rows
+from useful_scripts.synthetic_fingerprints import synthetic_matrix
+
+
+def test_mix_keys_is_the_splitmix64_finalizer():
+    # First output of splitmix64 seeded with 0, the finalizer of the golden ratio increment
+    assert int(mix_keys(np.array([0x9e3779b97f4a7c15], dtype=np.uint64))[0]) == 0xe220a8397b1dcdaf
+
+
+def test_split_rows_is_deterministic():
+    timestamps = 1700000000 + np.arange(20000) * 1e-3
+
+    train_rows, test_rows, val_rows = split_rows(timestamps)
+
+    # Every row in exactly one set, in about the configured shares
+    assert np.all(train_rows.astype(int) + test_rows + val_rows == 1)
+    assert abs(test_rows.mean() - TEST_SIZE) < 0.02
+    assert abs(val_rows.mean() - VALIDATION_SIZE) < 0.02
+
+    # A row keeps its set whatever rows are loaded with it, e.g.: in an incremental training
+    subset = np.random.default_rng(0).permutation(len(timestamps))[:500]
+    for rows, subset_rows in zip((train_rows, test_rows, val_rows), split_rows(timestamps[subset])):
+        assert np.array_equal(rows[subset], subset_rows)
+
+
+@pytest.fixture(scope='module')
+def fitted_models():
+    X, y = synthetic_matrix(n_rows=300, n_macs=30, n_locations=5, seed=2)
+    models = build_models()
+    for model in models.values():
+        model.fit(X[:240], y[:240])
+    return models, X[240:]
+
+
+def test_cascade_with_a_large_margin_is_the_full_ensemble(local_aws, monkeypatch, fitted_models):
+    models, X_val = fitted_models
+    monkeypatch.setattr(ai_engine, 'CASCADE_MARGIN', 1e9)
+
+    engine = ai_engine.AIEngine(True)
+    engine.algorithms = dict(models)
+    engine.model_weights = {model_name: weight for weight, model_name in enumerate(models, 1)}
+    engine.cascade_order = list(reversed(list(models)))
+
+    cascade_labels, cascade_probabilities = engine.classify(X_val, cascade=True)
+    labels, probabilities = engine.classify(X_val, cascade=False)
+
+    assert np.array_equal(cascade_labels, labels)
+    assert np.allclose(cascade_probabilities, probabilities)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from commons.ai_engine import FINGERPRINT_NULL_VALUE, build_models
+from commons.compiled_models import COMPILED_TOLERANCE, compile_model, dumps, loads
+from commons.fingerprint_index import FingerprintIndexClassifier
+from commons.sparse_fingerprints import to_sparse
+from useful_scripts.synthetic_fingerprints import synthetic_matrix
+
+
+def ensemble_models():
+    return {
+        **build_models(),
+        'Fingerprint Index': FingerprintIndexClassifier(null_value=FINGERPRINT_NULL_VALUE)
+    }
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    X, y = synthetic_matrix(n_rows=300, n_macs=30, n_locations=5, null_value=FINGERPRINT_NULL_VALUE, seed=1)
+    return X[:240], y[:240], X[240:]
+
+
+@pytest.mark.parametrize('feature_format', ['dense', 'sparse'])
+@pytest.mark.parametrize('model_name', list(ensemble_models()))
+def test_compiled_probabilities_match_sklearn(dataset, model_name, feature_format):
+    X_train, y_train, X_val = dataset
+    if feature_format == 'sparse':
+        X_train, X_val = to_sparse(X_train, FINGERPRINT_NULL_VALUE), to_sparse(X_val, FINGERPRINT_NULL_VALUE)
+
+    model = ensemble_models()[model_name].fit(X_train, y_train)
+    # Through the artifact format localize downloads
+    compiled_model = loads(dumps(compile_model(model)))
+
+    assert np.array_equal(compiled_model.classes_, model.classes_)
+    assert np.max(np.abs(compiled_model.predict_proba(X_val) - model.predict_proba(X_val))) <= COMPILED_TOLERANCE
+
+
+def test_fingerprint_index_readings_below_null_are_unseen():
+    X = np.array([[-40, FINGERPRINT_NULL_VALUE], [-300, -60], [-45, FINGERPRINT_NULL_VALUE - 20]])
+    model = FingerprintIndexClassifier(null_value=FINGERPRINT_NULL_VALUE).fit(X, [0, 1, 0])
+
+    # Nothing wraps around to a strong positive reading
+    assert model.rss_.min() == FINGERPRINT_NULL_VALUE and model.rss_.max() == -40
+    # Only the readings above null are in the postings of their MAC
+    assert model.postings_indptr_.tolist() == [0, 2, 3]
@@ -0,0 +1,67 @@
+import numpy as np
+
+from commons import ai_engine
+from commons.aws.dynamodb_helper import batch_add_elements_to_table
+from commons.dataset_loader import load_fingerprints, new_rows_mask
+from commons.dataset_snapshot import save_snapshot
+from lambda_handlers import add_fingerprint
+
+MACS = ['02:00:00:00:00:01', '02:00:00:00:00:02']
+NOW = 1700000000.123456
+
+
+def write(monkeypatch, container_digits, rss, label):
+    """
+    Add a fingerprint like add-fingerprint does, from a container writing at NOW
+    """
+    monkeypatch.setattr(add_fingerprint, 'CONTAINER_DIGITS', container_digits)
+    monkeypatch.setattr(add_fingerprint, '_last_timestamp_us', 0)
+    monkeypatch.setattr(add_fingerprint.time, 'time', lambda: NOW)
+    monkeypatch.setattr(add_fingerprint, 'WHITELISTED_MACS', set(MACS))
+    monkeypatch.setattr(add_fingerprint, 'FINGERPRINT_STORAGE', 'attributes')
+
+    fingerprint = add_fingerprint.build_fingerprint({'wifi': {MACS[0]: rss}, 'result': label})
+    fingerprint['timestamp'] = add_fingerprint.new_timestamps(1)[0]
+    batch_add_elements_to_table(ai_engine.FINGERPRINT_TABLE, [fingerprint])
+
+
+def test_same_microsecond_writes_are_different_rows(local_aws, monkeypatch):
+    write(monkeypatch, '000001', -50, 'kitchen')
+    write(monkeypatch, '000002', -60, 'hall')
+
+    X, labels, timestamps = load_fingerprints(ai_engine.FINGERPRINT_TABLE, MACS, -100)
+
+    assert sorted(labels) == ['hall', 'kitchen']
+    assert sorted(X[:, 0]) == [-60, -50]
+    # Exact to the microsecond, whatever the container digits
+    assert np.all(np.rint(timestamps * 1e6) == round(NOW * 1e6))
+
+
+def test_incremental_load_keeps_same_microsecond_rows(local_aws, monkeypatch):
+    monkeypatch.setattr(ai_engine, 'MACS_5GHZ', MACS)
+    monkeypatch.setattr(ai_engine, 'FEATURE_FORMAT', 'dense')
+    engine = ai_engine.AIEngine(True)
+
+    write(monkeypatch, '000001', -50, 'kitchen')
+    X, labels, timestamps, _ = engine.load_dataset(full_rescan=True)
+    save_snapshot(
+        ai_engine.AI_BUCKET, engine.snapshot_key, X, labels, timestamps,
+        engine.create_headers(engine.filtered_macs), ai_engine.FINGERPRINT_NULL_VALUE
+    )
+
+    # Written by another container in the same microsecond, after the snapshot
+    write(monkeypatch, '000002', -60, 'hall')
+    engine = ai_engine.AIEngine(True)
+    X, labels, timestamps, new_rows = engine.load_dataset()
+
+    assert engine.is_incremental
+    assert sorted(labels) == ['hall', 'kitchen']
+    assert new_rows.sum() == 1
+
+
+def test_new_rows_mask_counts_rows_of_the_same_microsecond():
+    timestamps = np.array([1.000001, 1.000002, 1.000002, 1.000003])
+
+    new = new_rows_mask(timestamps, np.array([1.000002, 1.000001]))
+
+    assert new.tolist() == [False, False, True, True]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from commons.dataset_snapshot import MAGIC, PREAMBLE, VERSION, load_snapshot, save_snapshot
+from commons.sparse_fingerprints import to_dense, to_sparse
+
+BUCKET = 'test-ai'
+NULL_VALUE = -100
+HEADERS = {'02:00:00:00:00:01': 0, '02:00:00:00:00:02': 1, '02:00:00:00:00:03': 2}
+
+
+@pytest.fixture
+def dataset():
+    X = np.array([
+        [-40, NULL_VALUE, -90],
+        [NULL_VALUE, NULL_VALUE, -1],
+        [-70.4, -99, NULL_VALUE]
+    ])
+    labels = np.array(['kitchen', 'hall', 'kitchen'], dtype=object)
+    timestamps = np.array([1700000000.000001, 1700000000.5, 1700000001.25])
+    return X, labels, timestamps
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_snapshot_round_trip(local_aws, dataset, sparse):
+    s3, _ = local_aws
+    X, labels, timestamps = dataset
+
+    save_snapshot(
+        BUCKET, 'snapshot.bin', to_sparse(X, NULL_VALUE) if sparse else X, labels, timestamps, HEADERS, NULL_VALUE
+    )
+    snapshot = load_snapshot(BUCKET, 'snapshot.bin')
+
+    magic, version, _ = PREAMBLE.unpack_from(s3.objects[(BUCKET, 'snapshot.bin')][0])
+    assert (magic, version) == (MAGIC, VERSION)
+
+    # int8 readings, rounded
+    if sparse:
+        assert snapshot['X'].data.dtype == np.int8
+        loaded = to_dense(snapshot['X'], NULL_VALUE)
+    else:
+        assert snapshot['X'].dtype == np.int8
+        loaded = np.asarray(snapshot['X'])
+    assert np.array_equal(loaded, np.rint(X))
+
+    assert list(snapshot['labels']) == list(labels)
+    assert np.array_equal(snapshot['timestamps'], timestamps)
+    assert snapshot['headers'] == HEADERS
+    assert snapshot['null_value'] == NULL_VALUE
+    assert snapshot['high_water_mark'] == timestamps.max()
+
+
+def test_sparse_snapshot_drops_readings_at_or_below_null(local_aws):
+    X = np.array([[NULL_VALUE - 5, -50, NULL_VALUE]])
+
+    save_snapshot(
+        BUCKET, 'snapshot.bin', to_sparse(X, NULL_VALUE), np.array(['hall']), np.array([1.0]), HEADERS, NULL_VALUE
+    )
+    snapshot = load_snapshot(BUCKET, 'snapshot.bin')
+
+    assert snapshot['X'].toarray().tolist() == [[0, 50, 0]]
@@ -0,0 +1,30 @@
+from commons.aws.aws_common import set_client
+from commons.aws.dynamodb_helper import BATCH_WRITE_SIZE, batch_add_elements_to_table
+from useful_scripts.local_aws import LocalDynamoDB
+
+
+class FailingDynamoDB(LocalDynamoDB):
+    """
+    Fails every BatchWriteItem holding the item with the `failing` timestamp
+    """
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = str(failing)
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for requests in RequestItems.values():
+            if any(request['PutRequest']['Item']['timestamp']['N'] == self.failing for request in requests):
+                raise RuntimeError('Internal server error')
+        return super().batch_write_item(RequestItems, **kwargs)
+
+
+def test_failed_chunks_are_counted(local_aws):
+    dynamodb = FailingDynamoDB(failing=0)
+    set_client('dynamodb', dynamodb)
+    contents = [{'timestamp': index, 'result': 'kitchen'} for index in range(BATCH_WRITE_SIZE * 3)]
+
+    failed = batch_add_elements_to_table('fingerprints', contents)
+
+    assert failed == BATCH_WRITE_SIZE
+    assert len(dynamodb.table('fingerprints')) == BATCH_WRITE_SIZE * 2
@@ -0,0 +1,19 @@
+import numpy as np
+
+from commons.feature_selection import rank_features
+
+NULL_VALUE = -100
+
+
+def test_readings_below_null_count_as_unseen():
+    y = np.array([0, 0, 1, 1])
+    X = np.full((4, 2), NULL_VALUE)
+    X[:, 0] = [-60, -103, -70, NULL_VALUE]
+    X[:, 1] = [-60, NULL_VALUE, -70, NULL_VALUE]
+
+    ranking = rank_features(X, y, NULL_VALUE)
+
+    # The reading below null is dropped, not put in the unseen bin or a negative one
+    for name in ('coverage', 'variance', 'mutual_info'):
+        assert ranking[name][0] == ranking[name][1]
+    assert ranking['coverage'][0] == 0.5
@@ -0,0 +1,29 @@
+import numpy as np
+
+from commons.fingerprint_packing import DictionaryStore, pack_readings, unpack_readings
+
+MACS = ['02:00:00:00:00:01', '02:00:00:00:00:02', '02:00:00:00:00:03']
+MAC_POSITIONS = {mac: position for position, mac in enumerate(MACS)}
+
+
+def test_pack_unpack_round_trip():
+    fingerprints = [
+        {MACS[2]: -40, MACS[0]: -71},
+        {},
+        {MACS[1]: -99.6}
+    ]
+
+    fingerprint_indexes, mac_positions, rss = unpack_readings(
+        [pack_readings(readings, MAC_POSITIONS) for readings in fingerprints]
+    )
+
+    assert fingerprint_indexes.tolist() == [0, 0, 2]
+    assert [MACS[position] for position in mac_positions] == [MACS[2], MACS[0], MACS[1]]
+    assert rss.tolist() == [-40, -71, -100]
+
+
+def test_dictionary_store_round_trip(local_aws):
+    version = DictionaryStore('test-ai').publish(MACS)
+
+    # A cold container reads it back from S3
+    assert list(DictionaryStore('test-ai').get(version)) == MACS
@@ -0,0 +1,45 @@
+import hashlib
+import pickle
+
+import pytest
+
+from commons.aws.s3_helper import put_file
+from commons.model_cache import ModelArtifacts, get_context, load_model
+
+BUCKET = 'test-ai'
+
+
+def artifact(key, model):
+    body = pickle.dumps(model)
+    put_file(BUCKET, key, body)
+    return {'key': key, 'sha256': hashlib.sha256(body).hexdigest()}
+
+
+def test_membership_does_not_download(local_aws):
+    s3, _ = local_aws
+    models = ModelArtifacts(BUCKET, {'A': artifact('a.pkl', {'model': 'a'})})
+    requests = s3.requests
+
+    assert 'A' in models
+    assert 'B' not in models
+    assert s3.requests == requests
+
+    assert models['A'] == {'model': 'a'}
+    assert s3.requests == requests + 1
+
+
+def test_load_model_rejects_corrupted_artifacts(local_aws):
+    entry = artifact('a.pkl', 1)
+    put_file(BUCKET, 'a.pkl', pickle.dumps(2))
+
+    with pytest.raises(ValueError):
+        load_model(BUCKET, entry)
+
+
+def test_missing_context_is_cached(local_aws):
+    s3, _ = local_aws
+
+    assert get_context(BUCKET, 'manifest.json') is None
+    requests = s3.requests
+    assert get_context(BUCKET, 'manifest.json') is None
+    assert s3.requests == requests
@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+
+from commons.ai_engine import FINGERPRINT_NULL_VALUE
+from commons.sharding import ShardRouter, shard_of
+from commons.sparse_fingerprints import to_sparse
+
+NULL = FINGERPRINT_NULL_VALUE
+HEADERS = {f'02:00:00:00:00:0{column}': column for column in range(4)}
+
+
+def fit_router(sparse=False):
+    # The first floor hears the first two APs, the second floor the last two
+    X = np.array([
+        [-50, -60, NULL, NULL],
+        [-55, NULL, NULL, NULL],
+        [-45, -65, NULL, -90],
+        [NULL, NULL, -50, -60],
+        [NULL, -95, -40, -70]
+    ])
+    shard_names = np.array(['hq/1', 'hq/1', 'hq/1', 'hq/2', 'hq/2'], dtype=object)
+    return ShardRouter.fit(HEADERS, to_sparse(X, NULL) if sparse else X, shard_names, ['hq/1', 'hq/2'])
+
+
+def test_shard_of():
+    assert shard_of('hq/2/kitchen', depth=2) == 'hq/2'
+    assert shard_of('hq', depth=2) == 'hq'
+
+
+def test_router_routes_by_the_aps_seen():
+    router = fit_router()
+
+    assert router.route([{0: -50}, {2: -45, 3: -70}, {0: -60, 1: -70}]) == ['hq/1', 'hq/2', 'hq/1']
+
+
+def test_router_json_round_trip():
+    router = fit_router()
+    readings_list = [{0: -50}, {3: -70}, {1: -80}]
+
+    loaded_router = ShardRouter.from_json(json.loads(json.dumps(router.to_json())))
+
+    assert loaded_router.to_json() == router.to_json()
+    assert np.allclose(loaded_router.base_scores, router.base_scores)
+    assert loaded_router.route(readings_list) == router.route(readings_list)
+
+
+def test_sparse_and_dense_routers_match():
+    assert fit_router(sparse=True).to_json() == fit_router().to_json()
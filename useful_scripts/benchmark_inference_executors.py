@@ -0,0 +1,58 @@
+"""
+Compare the ensemble inference executors across batch sizes.
+
+Needs a commons/settings.json (python manage.py download-params -s dev).
+Usage: python -m useful_scripts.benchmark_inference_executors
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault('AI_BUCKET_NAME', 'benchmark')
+os.environ.setdefault('DYNAMODB_FINGERPRINTS', 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from commons.ai_engine import FINGERPRINT_NULL_VALUE, build_models  # noqa: E402
+from commons.inference_executor import create_executor  # noqa: E402
+from useful_scripts.synthetic_fingerprints import synthetic_matrix  # noqa: E402
+
+BATCH_SIZES = [1, 10, 100, 1000, 5000]
+MODES = ['sequential', 'thread', 'process']
+REPETITIONS = 20
+
+
+def main():
+    X, y = synthetic_matrix(null_value=FINGERPRINT_NULL_VALUE)
+    models = {model_name: model.fit(X, y) for model_name, model in build_models().items()}
+
+    results = []
+    for mode in MODES:
+        executor = create_executor(mode)
+        # The process executor only kicks in for big batches
+        if hasattr(executor, 'min_rows'):
+            executor.min_rows = 0
+
+        for batch_size in BATCH_SIZES:
+            batch = X[np.arange(batch_size) % len(X)]
+            executor.predict_proba(models, batch)  # warm up (e.g.: pool creation)
+
+            timings = []
+            for _ in range(REPETITIONS):
+                start = time.perf_counter()
+                executor.predict_proba(models, batch)
+                timings.append(time.perf_counter() - start)
+
+            results.append({
+                'mode': mode,
+                'batch_size': batch_size,
+                'p50_ms': float(np.percentile(timings, 50) * 1000),
+                'p99_ms': float(np.percentile(timings, 99) * 1000),
+                'per_row_us': float(np.median(timings) / batch_size * 1e6)
+            })
+            print(json.dumps(results[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Per call overhead of the logged decorator with an ensemble sized fingerprint payload.
+
+The logs are written to /dev/null, only the time spent building them is measured.
+Usage: LOG_LEVEL=INFO python -m useful_scripts.benchmark_logged
+       (run it with LOG_LEVEL=DEBUG too, the debug logs are enabled then)
+"""
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from commons.logger import LOG_LEVEL, logged, logger
+
+REPETITIONS = 2000
+PAYLOAD_MACS = 80
+
+
+def localize(fingerprint, band='5ghz', cascade=False):
+    return {'location': 'A1', 'probability': 0.9}
+
+
+def timed(function, payload):
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        function(payload)
+    return (time.perf_counter() - start) / REPETITIONS * 1e6
+
+
+def main():
+    logger.logger.handlers[0].setStream(open(os.devnull, 'w'))
+    logger.logger.setLevel(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    payloads = {
+        'dict': {f'mac_{index}': int(rss) for index, rss in enumerate(rng.integers(-90, -40, PAYLOAD_MACS))},
+        'ndarray': rng.integers(-90, -40, (1, PAYLOAD_MACS)).astype(np.int8)
+    }
+    variants = {
+        'bare': localize,
+        'logged': logged(localize),
+        'logged_sampled_1%': logged(localize, sample_rate=0.01),
+        'logged_no_truncation': logged(localize, truncate_long_messages=False)
+    }
+
+    bare_times = {}
+    for payload_name, payload in payloads.items():
+        for variant_name, function in variants.items():
+            microseconds = timed(function, payload)
+            bare_times.setdefault(payload_name, microseconds)
+            print(json.dumps({
+                'log_level': LOG_LEVEL,
+                'payload': payload_name,
+                'variant': variant_name,
+                'us_per_call': round(microseconds, 2),
+                'overhead_us': round(microseconds - bare_times[payload_name], 2)
+            }))
+
+
+if __name__ == '__main__':
+    main()
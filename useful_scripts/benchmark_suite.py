@@ -0,0 +1,379 @@
+"""
+Offline benchmarks of the dataset loading, the training and the localization,
+run against synthetic fingerprints and the in-process S3/DynamoDB of local_aws.
+
+Writes a JSON report (environment, configuration and results) to compare
+runs between commits, --compare prints the ratio of every timing to a previous report.
+
+Needs a commons/settings.json (python manage.py download-params -s dev).
+Usage: python -m useful_scripts.benchmark_suite --output report.json
+       python -m useful_scripts.benchmark_suite --quick --compare report.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault('AI_BUCKET_NAME', 'benchmark')
+os.environ.setdefault('DYNAMODB_FINGERPRINTS', 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+# The logged decorator debug logs would be measured too
+os.environ.setdefault('LOG_LEVEL', 'INFO')
+
+import sklearn  # noqa: E402
+
+from commons import ai_engine  # noqa: E402
+from commons.aws.dynamodb_helper import batch_add_elements_to_table  # noqa: E402
+from commons.dataset_loader import (  # noqa: E402
+    DATASET_ATTRIBUTE, DATASET_NAME, DICTIONARY_ATTRIBUTE, PACKED_ATTRIBUTE
+)
+from commons.dataset_snapshot import save_snapshot  # noqa: E402
+from commons.distributed_training import TRAIN_WORKER_FUNCTION  # noqa: E402
+from commons.fingerprint_packing import dictionary_store, pack_readings  # noqa: E402
+from commons.metrics import metrics  # noqa: E402
+from commons.model_cache import clear_cache  # noqa: E402
+from lambda_handlers import train_worker  # noqa: E402
+from useful_scripts.local_aws import LocalLambda, install  # noqa: E402
+from useful_scripts.synthetic_fingerprints import synthetic_fingerprints  # noqa: E402
+
+REPORT_VERSION = 1
+
+# Fingerprints added after the snapshot for the incremental load, as a fraction of the table
+INCREMENTAL_FRACTION = 0.05
+
+FIRST_TIMESTAMP = 1600000000.0
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p99': float(np.percentile(values, 99)),
+        'mean': float(values.mean()),
+        'min': float(values.min())
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def max_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Scenario():
+    """
+    Fresh stand-ins holding a synthetic fingerprints table, the engine uses its MACs
+    """
+
+    def __init__(self, config, n_rows, seed):
+        self.config = config
+        self.s3, self.dynamodb = install(
+            lambda_client=LocalLambda({TRAIN_WORKER_FUNCTION: train_worker.run})
+        )
+        clear_cache()
+        dictionary_store.dictionaries.clear()
+
+        self.bodies, self.macs = synthetic_fingerprints(
+            n_rows=n_rows,
+            n_macs=config.macs,
+            n_locations=config.locations,
+            null_density=config.null_density,
+            rss_noise=config.rss_noise,
+            null_value=ai_engine.FINGERPRINT_NULL_VALUE,
+            seed=seed,
+            layout=config.layout
+        )
+        ai_engine.MACS_5GHZ = self.macs
+        ai_engine.MACS_2_4GHZ = []
+        ai_engine.FINGERPRINT_INDEX = config.fingerprint_index
+        ai_engine.FEATURE_FORMAT = config.feature_format
+        self.next_timestamp = FIRST_TIMESTAMP
+
+        self.write(self.bodies)
+
+    def write(self, bodies):
+        """
+        Store the fingerprints the way add-fingerprint does
+        """
+        mac_positions = {mac: position for position, mac in enumerate(self.macs)}
+        fingerprints = []
+        for body in bodies:
+            if self.config.storage == 'packed':
+                fingerprint = {
+                    PACKED_ATTRIBUTE: pack_readings(body['wifi'], mac_positions),
+                    DICTIONARY_ATTRIBUTE: dictionary_store.publish(self.macs)
+                }
+            else:
+                fingerprint = dict(body['wifi'])
+            fingerprint['result'] = body['result']
+            fingerprint[DATASET_ATTRIBUTE] = DATASET_NAME
+            fingerprint['timestamp'] = self.next_timestamp
+            self.next_timestamp += 1e-3
+            fingerprints.append(fingerprint)
+
+        batch_add_elements_to_table(ai_engine.FINGERPRINT_TABLE, fingerprints)
+
+
+def benchmark_get_datasets(config, n_rows):
+    scenario = Scenario(config, n_rows, config.seed)
+
+    full_times = []
+    for _ in range(config.repetitions):
+        engine = ai_engine.AIEngine(True)
+        _, elapsed = timed(engine.get_datasets, full_rescan=True)
+        full_times.append(elapsed)
+
+    save_snapshot(
+        ai_engine.AI_BUCKET, engine.snapshot_key, *engine.dataset, engine.create_headers(engine.filtered_macs),
+        ai_engine.FINGERPRINT_NULL_VALUE
+    )
+    new_bodies, _ = synthetic_fingerprints(
+        n_rows=max(1, int(n_rows * INCREMENTAL_FRACTION)), n_macs=config.macs,
+        n_locations=config.locations, null_density=config.null_density,
+        rss_noise=config.rss_noise, null_value=ai_engine.FINGERPRINT_NULL_VALUE,
+        seed=config.seed + 1, layout=config.layout
+    )
+    scenario.write(new_bodies)
+
+    incremental_times = []
+    for _ in range(config.repetitions):
+        engine = ai_engine.AIEngine(True)
+        _, elapsed = timed(engine.get_datasets, full_rescan=False)
+        incremental_times.append(elapsed)
+
+    return {
+        'full_load_ms': percentiles(full_times),
+        'incremental_load_ms': percentiles(incremental_times),
+        'incremental_rows': len(new_bodies),
+        'dynamodb_requests': scenario.dynamodb.requests,
+        'max_rss_mb': max_rss_mb()
+    }
+
+
+def benchmark_train(config, n_rows):
+    """
+    Returns the results and the scenario, whose trained models are then localized
+    """
+    scenario = Scenario(config, n_rows, config.seed)
+
+    engine = ai_engine.AIEngine(True)
+    _, elapsed = timed(engine.train, full_rescan=True, distributed=config.distributed)
+
+    results = {
+        'train_ms': elapsed,
+        'models': {
+            model_name: {
+                'status': model_stats['status'],
+                'fit_ms': model_stats.get('fit_time', 0) * 1000,
+                'peak_memory_mb': model_stats.get('peak_memory_mb'),
+                'inference_ms_per_row': engine.inference_costs.get(model_name),
+                'youden_index': engine.youden_indexes.get(model_name),
+                'compiled': engine.compile_stats.get(model_name, {}).get('status')
+            }
+            for model_name, model_stats in engine.training_stats.items()
+        },
+        'artifacts_mb': sum(
+            len(body) for (_, key), (body, _) in scenario.s3.objects.items()
+            if '/models/' in key and key.endswith('.pkl')
+        ) / 2 ** 20,
+        'compiled_artifacts_mb': sum(
+            len(body) for (_, key), (body, _) in scenario.s3.objects.items()
+            if '/models/' in key and key.endswith('.npz')
+        ) / 2 ** 20,
+        'max_rss_mb': max_rss_mb()
+    }
+
+    return results, scenario
+
+
+def benchmark_localize(config, scenario, model_count, batch_size):
+    engine = ai_engine.AIEngine(True, use_cache=True, compiled=config.inference == 'compiled')
+    # The cheapest models first, like the cascade
+    model_names = engine.cascade_order[:model_count]
+    engine.algorithms = {model_name: engine.algorithms[model_name] for model_name in model_names}
+
+    n_bodies = len(scenario.bodies)
+    requests = [
+        [scenario.bodies[(index * batch_size + offset) % n_bodies] for offset in range(batch_size)]
+        for index in range(config.localize_repetitions)
+    ]
+
+    def localize(bodies):
+        if batch_size == 1:
+            return engine.localize_fingerprint(engine.prepare_fingerprint(bodies[0]))
+        return engine.localize_fingerprints(engine.prepare_fingerprints(bodies))
+
+    localize(requests[0])  # warm up
+    metrics.drain()
+
+    latencies = [timed(localize, bodies)[1] for bodies in requests]
+    stage_values, _ = metrics.drain()
+
+    return {
+        'models': model_names,
+        'latency_ms': percentiles(latencies),
+        'latency_ms_per_row': float(np.median(latencies)) / batch_size,
+        'stages_ms_p50': {
+            stage: float(np.median(values)) for stage, values in stage_values.items()
+        }
+    }
+
+
+def run_suite(config):
+    results = []
+
+    def record(benchmark, params, benchmark_results):
+        results.append({'benchmark': benchmark, 'params': params, 'results': benchmark_results})
+        print(json.dumps({'benchmark': benchmark, **params}), file=sys.stderr)
+
+    for n_rows in config.rows:
+        record('get_datasets', {'rows': n_rows}, benchmark_get_datasets(config, n_rows))
+
+    train_results, scenario = benchmark_train(config, config.train_rows)
+    record('train', {'rows': config.train_rows}, train_results)
+
+    for model_count in config.model_counts:
+        for batch_size in config.batch_sizes:
+            record(
+                'localize',
+                {'rows': config.train_rows, 'model_count': model_count, 'batch_size': batch_size},
+                benchmark_localize(config, scenario, model_count, batch_size)
+            )
+
+    return {
+        'version': REPORT_VERSION,
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {**vars(config), 'compare': None, 'output': None},
+        'results': results
+    }
+
+
+def timings(values, path=''):
+    """
+    Flatten the `*_ms` values of a result, {'train_ms': 1, 'latency_ms.p50': 2, ...}
+    """
+    flat = {}
+    for name, value in values.items():
+        key = f'{path}{name}'
+        if isinstance(value, dict):
+            flat.update(timings(value, f'{key}.'))
+        elif isinstance(value, (int, float)) and '_ms' in key:
+            flat[key] = value
+    return flat
+
+
+def compare(report, baseline):
+    """
+    Ratio (current / baseline) of every timing of the results present in both reports
+    """
+    def result_key(result):
+        return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+    baseline_results = {result_key(result): result for result in baseline['results']}
+
+    for result in report['results']:
+        baseline_result = baseline_results.get(result_key(result))
+        if not baseline_result:
+            continue
+
+        current_timings = timings(result['results'])
+        baseline_timings = timings(baseline_result['results'])
+        print(json.dumps({
+            'benchmark': result['benchmark'],
+            'params': result['params'],
+            'baseline_commit': baseline['commit'],
+            'ratios': {
+                key: round(value / baseline_timings[key], 3)
+                for key, value in current_timings.items() if baseline_timings.get(key)
+            }
+        }))
+
+
+def parse_arguments(arguments=None):
+    def integers(value):
+        return [int(item) for item in value.split(',')]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=integers, default=[1000, 5000, 20000], help='get_datasets table sizes')
+    parser.add_argument('--train-rows', type=int, default=5000)
+    parser.add_argument('--macs', type=int, default=80)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--null-density', type=float, default=0.7)
+    parser.add_argument('--rss-noise', type=float, default=4)
+    parser.add_argument('--layout', choices=['random', 'site'], default='random')
+    parser.add_argument('--storage', choices=['attributes', 'packed'], default='attributes')
+    parser.add_argument(
+        '--fingerprint-index', choices=['off', 'add', 'replace'], default=ai_engine.FINGERPRINT_INDEX
+    )
+    parser.add_argument('--feature-format', choices=['dense', 'sparse'], default=ai_engine.FEATURE_FORMAT)
+    parser.add_argument(
+        '--distributed', action='store_true', help='train every model in a (local) train-worker invocation'
+    )
+    parser.add_argument(
+        '--inference', choices=['compiled', 'sklearn'],
+        default='compiled' if ai_engine.COMPILED_INFERENCE else 'sklearn', help='models localize runs'
+    )
+    parser.add_argument('--batch-sizes', type=integers, default=[1, 10, 100])
+    parser.add_argument('--model-counts', type=integers, default=[1, 3, 6], help='cheapest models first')
+    parser.add_argument('--repetitions', type=int, default=5, help='repetitions of every dataset load')
+    parser.add_argument('--localize-repetitions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='small sizes, to check the suite runs')
+    parser.add_argument('--output', help='report path, stdout by default')
+    parser.add_argument('--compare', help='previous report to compare with')
+
+    config = parser.parse_args(arguments)
+    if config.quick:
+        config.rows = [500]
+        config.train_rows = 500
+        config.repetitions = 2
+        config.localize_repetitions = 20
+
+    return config
+
+
+def main():
+    config = parse_arguments()
+    report = run_suite(config)
+
+    if config.output:
+        with open(config.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if config.compare:
+        with open(config.compare) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
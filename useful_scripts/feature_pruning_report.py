@@ -0,0 +1,137 @@
+"""
+Accuracy vs latency and size trade-off of the MAC feature selection, on the synthetic
+fingerprints and the in-process S3/DynamoDB of the benchmark suite.
+
+Every selection trains the ensemble from scratch with its FEATURE_* values and is
+reported with its columns, validation precision and top-k accuracy, training time,
+artifacts size and localize latency. The unknown arguments are benchmark suite ones
+(--train-rows, --macs, --layout, --batch-sizes, --inference...).
+
+Needs a commons/settings.json (python manage.py download-params -s dev).
+Usage: python -m useful_scripts.feature_pruning_report --top-n 0,60,40,20,10 --layout site
+       python -m useful_scripts.feature_pruning_report --min-coverage 0,0.05,0.1 --output pruning.json
+"""
+import argparse
+import json
+import sys
+import time
+
+# Sets the environment of the stand-ins, it goes before commons
+from useful_scripts import benchmark_suite  # isort: skip
+
+from commons import ai_engine, feature_selection  # noqa: E402
+from commons.aws.s3_helper import get_json  # noqa: E402
+
+SELECTION_SETTINGS = {
+    'top_n': 'FEATURE_TOP_N',
+    'min_coverage': 'FEATURE_MIN_COVERAGE',
+    'min_variance': 'FEATURE_MIN_VARIANCE',
+    'min_mutual_info': 'FEATURE_MIN_MUTUAL_INFO'
+}
+
+
+def selections(arguments):
+    """
+    One selection per value of the swept setting, the other settings keep their values
+    """
+    for name, setting in SELECTION_SETTINGS.items():
+        values = getattr(arguments, name)
+        if values:
+            return [{setting: value} for value in values]
+    return [{}]
+
+
+def run_selection(config, selection):
+    for setting, value in selection.items():
+        setattr(feature_selection, setting, value)
+
+    train_results, scenario = benchmark_suite.benchmark_train(config, config.train_rows)
+    engine = ai_engine.AIEngine(True)
+    stats = get_json(ai_engine.AI_BUCKET, f'{engine.ai_s3_path}/stats.json')
+    top_k_accuracy = next((value for name, value in stats.items() if name.startswith('top_')), None)
+
+    localize = {
+        batch_size: benchmark_suite.benchmark_localize(config, scenario, len(engine.algorithms), batch_size)
+        for batch_size in config.batch_sizes
+    }
+
+    return {
+        'selection': selection,
+        'columns': stats['feature_selection']['columns'],
+        'total_columns': stats['feature_selection']['total_columns'],
+        'precision': stats['precision'],
+        'top_k_accuracy': top_k_accuracy,
+        'train_ms': train_results['train_ms'],
+        'artifacts_mb': train_results['artifacts_mb'],
+        'compiled_artifacts_mb': train_results['compiled_artifacts_mb'],
+        'localize_ms_p50': {
+            str(batch_size): results['latency_ms']['p50'] for batch_size, results in localize.items()
+        }
+    }
+
+
+def print_table(rows):
+    batch_sizes = list(rows[0]['localize_ms_p50']) if rows else []
+    header = ['selection', 'columns', 'precision', 'top_k', 'train_ms', 'pickles_mb', 'compiled_mb'] + [
+        f'localize_{batch_size}_ms' for batch_size in batch_sizes
+    ]
+    print('\t'.join(header), file=sys.stderr)
+
+    for row in rows:
+        print('\t'.join([
+            json.dumps(row['selection']) if row['selection'] else 'defaults',
+            f'{row["columns"]}/{row["total_columns"]}',
+            f'{row["precision"]:.3f}',
+            f'{row["top_k_accuracy"]:.3f}' if row['top_k_accuracy'] is not None else '-',
+            f'{row["train_ms"]:.0f}',
+            f'{row["artifacts_mb"]:.3f}',
+            f'{row["compiled_artifacts_mb"]:.3f}',
+            *(f'{row["localize_ms_p50"][batch_size]:.2f}' for batch_size in batch_sizes)
+        ]), file=sys.stderr)
+
+
+def parse_arguments(arguments=None):
+    def integers(value):
+        return [int(item) for item in value.split(',')]
+
+    def floats(value):
+        return [float(item) for item in value.split(',')]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sweep = parser.add_mutually_exclusive_group()
+    sweep.add_argument('--top-n', type=integers, help='FEATURE_TOP_N values, 0 keeps every column')
+    sweep.add_argument('--min-coverage', type=floats, help='FEATURE_MIN_COVERAGE values')
+    sweep.add_argument('--min-variance', type=floats, help='FEATURE_MIN_VARIANCE values')
+    sweep.add_argument('--min-mutual-info', type=floats, help='FEATURE_MIN_MUTUAL_INFO values')
+    parser.add_argument('--output', help='report path, stdout by default')
+
+    arguments, suite_arguments = parser.parse_known_args(arguments)
+
+    return arguments, benchmark_suite.parse_arguments(suite_arguments)
+
+
+def main():
+    arguments, config = parse_arguments()
+
+    rows = []
+    for selection in selections(arguments):
+        rows.append(run_selection(config, selection))
+        print(json.dumps(rows[-1]['selection'] or 'defaults'), file=sys.stderr)
+
+    print_table(rows)
+
+    report = {
+        'commit': benchmark_suite.git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {**vars(config), 'compare': None, 'output': None},
+        'results': rows
+    }
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
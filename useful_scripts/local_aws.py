@@ -0,0 +1,239 @@
+"""
+In-process stand-ins for the S3, DynamoDB and Lambda clients used by commons.aws,
+enough of their API to run the fingerprint storage, training and localization offline.
+`install()` makes commons.aws use them.
+"""
+import hashlib
+import json
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+from commons.aws.aws_common import set_client
+
+
+class NoSuchKey(ClientError):
+    pass
+
+
+class LocalS3():
+    """
+    Objects kept in memory, with ETags and conditional GETs like S3.
+    `latency` seconds are waited on every request.
+    """
+
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+    meta = SimpleNamespace(endpoint_url='local://s3')
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.objects = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, bucket_name, key):
+        if (bucket_name, key) not in self.objects:
+            raise NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return self.objects[(bucket_name, key)]
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._request()
+        body, etag = self._get(Bucket, Key)
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'}}, 'GetObject')
+        return {'Body': SimpleNamespace(read=lambda: body), 'ETag': etag, 'ContentLength': len(body)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._request()
+        body = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.objects[(Bucket, Key)] = (body, etag)
+        return {'ETag': etag}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def download_file(self, Bucket, Key, Filename):
+        self._request()
+        try:
+            body, _ = self._get(Bucket, Key)
+        except NoSuchKey:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        with open(f'{Filename}.download', 'wb') as file:
+            file.write(body)
+        shutil.move(f'{Filename}.download', Filename)
+
+
+# `#name = :value AND #other > :other` as written by commons.dataset_loader
+CONDITION = re.compile(r'\s*(\S+)\s*(=|<=|>=|<|>)\s*(\S+)\s*')
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+
+def _key(attribute_value):
+    """
+    Exact value of a key attribute, DynamoDB compares numbers with all their digits
+    """
+    if 'N' in attribute_value:
+        return Decimal(attribute_value['N'])
+    return next(iter(attribute_value.values()))
+
+
+class LocalPaginator():
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def pages(self, items, ProjectionExpression=None, ExpressionAttributeNames=None):
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            attribute_names = {
+                names.get(name.strip(), name.strip()) for name in ProjectionExpression.split(',')
+            }
+            items = [
+                {name: value for name, value in item.items() if name in attribute_names}
+                for item in items
+            ]
+
+        page_size = self.dynamodb.page_size
+        for first in range(0, len(items), page_size):
+            self.dynamodb._request()
+            page = items[first:first + page_size]
+            yield {'Items': page, 'Count': len(page)}
+
+
+class LocalScanPaginator(LocalPaginator):
+
+    def paginate(self, TableName, Segment=0, TotalSegments=1, ProjectionExpression=None,
+                 ExpressionAttributeNames=None, **kwargs):
+        items = list(self.dynamodb.table(TableName).values())[Segment::TotalSegments]
+        return self.pages(items, ProjectionExpression, ExpressionAttributeNames)
+
+
+class LocalQueryPaginator(LocalPaginator):
+
+    def paginate(self, TableName, KeyConditionExpression, ExpressionAttributeValues,
+                 ExpressionAttributeNames=None, ProjectionExpression=None, IndexName=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        conditions = []
+        for condition in re.split(r'\s+AND\s+', KeyConditionExpression, flags=re.IGNORECASE):
+            name, operator, placeholder = CONDITION.fullmatch(condition).groups()
+            conditions.append((
+                names.get(name, name), COMPARISONS[operator],
+                _key(ExpressionAttributeValues[placeholder])
+            ))
+
+        items = [
+            item for item in self.dynamodb.table(TableName).values()
+            if all(
+                name in item and compare(_key(item[name]), value)
+                for name, compare, value in conditions
+            )
+        ]
+        # Sorted by the range key, the last condition
+        items.sort(key=lambda item: _key(item[conditions[-1][0]]))
+
+        return self.pages(items, ProjectionExpression, ExpressionAttributeNames)
+
+
+class LocalDynamoDB():
+    """
+    Tables of items in DynamoDB JSON, keyed by `key_attribute` (the fingerprints
+    table hash key). Pages hold `page_size` items, `latency` seconds are waited on
+    every request (and every page read).
+    """
+
+    def __init__(self, key_attribute='timestamp', page_size=500, latency=0):
+        self.key_attribute = key_attribute
+        self.page_size = page_size
+        self.latency = latency
+        self.tables = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, table_name):
+        with self.lock:
+            return self.tables.setdefault(table_name, {})
+
+    def get_paginator(self, operation_name):
+        paginators = {'scan': LocalScanPaginator, 'query': LocalQueryPaginator}
+        return paginators[operation_name](self)
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._request()
+        table = self.table(TableName)
+        with self.lock:
+            table[_key(Item[self.key_attribute])] = Item
+        return {}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._request()
+        for table_name, requests in RequestItems.items():
+            table = self.table(table_name)
+            with self.lock:
+                for request in requests:
+                    item = request['PutRequest']['Item']
+                    table[_key(item[self.key_attribute])] = item
+        return {'UnprocessedItems': {}}
+
+
+class LocalLambda():
+    """
+    Runs the invoked functions in this process, `handlers` maps the function names
+    to their handler. 'Event' invocations run in a thread pool like concurrent lambdas.
+    """
+
+    def __init__(self, handlers, max_workers=4):
+        self.handlers = handlers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.invocations = []
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        handler = self.handlers[FunctionName]
+        event = json.loads(Payload)
+
+        if InvocationType == 'Event':
+            self.invocations.append(self.pool.submit(handler, event, None))
+            return {'StatusCode': 202}
+
+        result = handler(event, None)
+        return {'StatusCode': 200, 'Payload': SimpleNamespace(read=lambda: json.dumps(result).encode('utf-8'))}
+
+
+def install(s3=None, dynamodb=None, lambda_client=None):
+    """
+    Replace the S3 and DynamoDB (and Lambda, if given) clients of commons.aws,
+    returns the S3 and DynamoDB stand-ins
+    """
+    s3 = s3 or LocalS3()
+    dynamodb = dynamodb or LocalDynamoDB()
+
+    set_client('s3', s3)
+    set_client('dynamodb', dynamodb)
+    if lambda_client:
+        set_client('lambda', lambda_client)
+
+    return s3, dynamodb
@@ -0,0 +1,107 @@
+"""
+Import time of every lambda handler, what a cold start pays before the first invocation.
+
+Every handler is imported in a fresh interpreter (python -X importtime), the report
+has the total time, the packages that take the most and which heavy packages are loaded.
+
+Needs a commons/settings.json (python manage.py download-params -s dev).
+Usage: python -m useful_scripts.profile_imports [--repetitions 5] [--output imports.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+
+HANDLERS_DIR = Path(__file__).resolve().parent.parent / 'lambda_handlers'
+
+# Packages that should only be imported by the handlers that need them
+WATCHED_PACKAGES = ['sklearn', 'scipy', 'pandas', 'boto3', 'botocore', 'numpy']
+
+ENVIRONMENT = {
+    'AI_BUCKET_NAME': 'benchmark',
+    'DYNAMODB_FINGERPRINTS': 'benchmark',
+    'AWS_DEFAULT_REGION': 'us-east-1'
+}
+
+
+def import_times(module_name):
+    """
+    {module: (self_us, cumulative_us)} of importing `module_name` in a new interpreter
+    """
+    environment = {**ENVIRONMENT, **os.environ}
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        capture_output=True, text=True, env=environment, cwd=HANDLERS_DIR.parent
+    )
+    if process.returncode:
+        raise RuntimeError(f'Importing {module_name} failed:\n{process.stderr}')
+
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def profile_handler(module_name, repetitions, top):
+    runs = [import_times(module_name) for _ in range(repetitions)]
+    totals_ms = [run[module_name][1] / 1000 for run in runs]
+
+    # Self time of every top level package, median over the runs
+    package_times = {}
+    for run in runs:
+        run_packages = {}
+        for name, (self_us, _) in run.items():
+            package = name.split('.')[0]
+            run_packages[package] = run_packages.get(package, 0) + self_us / 1000
+        for package, milliseconds in run_packages.items():
+            package_times.setdefault(package, []).append(milliseconds)
+
+    packages_ms = {
+        package: float(np.median(times)) for package, times in package_times.items()
+    }
+    top_packages = sorted(packages_ms.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        'handler': module_name,
+        'import_ms': {
+            'p50': float(np.median(totals_ms)),
+            'min': float(np.min(totals_ms)),
+            'max': float(np.max(totals_ms))
+        },
+        'modules': len(runs[0]),
+        'top_packages_ms': dict(top_packages),
+        'watched_packages': {package: package in packages_ms for package in WATCHED_PACKAGES}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='packages listed per handler')
+    parser.add_argument('--output', help='write the whole report as JSON')
+    arguments = parser.parse_args()
+
+    handlers = sorted(
+        f'lambda_handlers.{path.stem}' for path in HANDLERS_DIR.glob('*.py') if path.stem != '__init__'
+    )
+
+    report = []
+    for module_name in handlers:
+        report.append(profile_handler(module_name, arguments.repetitions, arguments.top))
+        print(json.dumps(report[-1]))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
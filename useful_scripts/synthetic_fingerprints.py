@@ -0,0 +1,89 @@
+"""
+Reproducible synthetic fingerprints for the benchmarks.
+
+Every location has a mean RSS per MAC, readings are that mean plus gaussian noise
+and a `null_density` fraction of them are missing (the MAC wasn't seen).
+With the 'random' layout the means are uniform, every MAC can be heard anywhere.
+With the 'site' layout the locations are a grid and the APs are spread over the
+same area, the means follow a log distance path loss and the far APs aren't heard.
+"""
+import numpy as np
+
+
+def synthetic_macs(n_macs, prefix='02:00'):
+    """
+    Locally administered MAC addresses, always the same ones for the same count
+    """
+    return [
+        f'{prefix}:{(index >> 24) & 0xff:02x}:{(index >> 16) & 0xff:02x}:'
+        f'{(index >> 8) & 0xff:02x}:{index & 0xff:02x}'
+        for index in range(n_macs)
+    ]
+
+
+# Log distance path loss of the 'site' layout
+REFERENCE_RSS = -35
+PATH_LOSS_EXPONENT = 3
+LOCATION_SPACING = 3
+SENSITIVITY = -92
+
+
+def location_centers(n_locations, n_macs, layout, rng):
+    if layout == 'random':
+        return rng.uniform(-90, -40, size=(n_locations, n_macs))
+
+    if layout != 'site':
+        raise ValueError(f'Unknown layout "{layout}"')
+
+    side = int(np.ceil(np.sqrt(n_locations)))
+    grid = np.stack(np.meshgrid(np.arange(side), np.arange(side)), axis=-1).reshape(-1, 2)
+    locations = grid[:n_locations] * LOCATION_SPACING
+    access_points = rng.uniform(0, side * LOCATION_SPACING, size=(n_macs, 2))
+
+    distances = np.linalg.norm(locations[:, np.newaxis] - access_points[np.newaxis], axis=-1)
+    centers = REFERENCE_RSS - 10 * PATH_LOSS_EXPONENT * np.log10(np.maximum(distances, 1))
+    # Not heard at all, whatever the noise
+    centers[centers < SENSITIVITY] = np.nan
+
+    return centers
+
+
+def synthetic_matrix(
+    n_rows=2000, n_macs=80, n_locations=10, null_density=0.7, rss_noise=4,
+    null_value=-100, seed=0, layout='random'
+):
+    """
+    RSS matrix (rows, n_macs) with `null_value` for the missing readings,
+    and the location index of every row
+    """
+    rng = np.random.default_rng(seed)
+    centers = location_centers(n_locations, n_macs, layout, rng)
+    y = rng.integers(0, n_locations, size=n_rows)
+
+    X = np.rint(centers[y] + rng.normal(0, rss_noise, size=(n_rows, n_macs)))
+    X = np.clip(X, null_value + 1, -1)
+    X[np.isnan(X) | (rng.random((n_rows, n_macs)) < null_density)] = null_value
+
+    return X, y
+
+
+def synthetic_fingerprints(
+    n_rows=2000, n_macs=80, n_locations=10, null_density=0.7, rss_noise=4,
+    null_value=-100, seed=0, layout='random'
+):
+    """
+    Request bodies like the ones add-fingerprint receives ({'wifi': {mac: rss}, 'result': label})
+    and the MACs they use
+    """
+    macs = synthetic_macs(n_macs)
+    X, y = synthetic_matrix(n_rows, n_macs, n_locations, null_density, rss_noise, null_value, seed, layout)
+
+    bodies = []
+    for readings, location in zip(X, y):
+        seen = np.flatnonzero(readings != null_value)
+        bodies.append({
+            'wifi': {macs[column]: int(readings[column]) for column in seen},
+            'result': f'location-{location}'
+        })
+
+    return bodies, macs